@@ -64,18 +64,8 @@ export default function CalendarViewFull({ scheduleId, projectName }: { schedule
         const warnings = detectConflicts(ass);
         setConflicts(warnings);
 
-        const groups = new Map();
-        ass.forEach(a => {
-          const key = `${a.date}::${a.shift_id}`;
-          const cur = groups.get(key) || { date: a.date, shift_id: a.shift_id, shift_name: a.shift_name, assigned: { chat:0, email:0, both:0, total:0 } };
-          const skill = (a.agent_skill || "both").toLowerCase();
-          if (skill === "chat") cur.assigned.chat++;
-          else if (skill === "email") cur.assigned.email++;
-          else cur.assigned.both++;
-          cur.assigned.total++;
-          groups.set(key, cur);
-        });
-        setCoverages(Array.from(groups.values()));
+        const cov = await client.get(`/schedules/${scheduleId}/coverage`);
+        setCoverages(cov.data || []);
 
       } catch (e) {
         console.error(e);
@@ -152,15 +142,13 @@ export default function CalendarViewFull({ scheduleId, projectName }: { schedule
           slotMaxTime="24:00:00"
         />
         <Box sx={{ mt: 1 }}>
-          <ExportButtons assignments={assignments.map(a => ({
-            date: a.date, shift_name: a.shift_name, shift_start: a.shift_start, shift_end: a.shift_end, agent_id: a.agent_id, agent_name: a.agent_name, agent_skill: a.agent_skill, role: a.role
-          }))} projectName={projectName} />
+          <ExportButtons scheduleId={scheduleId} />
         </Box>
       </Box>
 
       <Box sx={{ width: 360 }}>
         <CoveragePanel coverages={coverages.map((c:any) => ({
-          date: c.date, shift_id: c.shift_id, shift_name: c.shift_name, assigned: c.assigned, required: undefined
+          date: c.date, shift_id: c.shift_id, shift_name: c.shift_name, assigned: c.assigned, required: c.required
         }))} />
       </Box>
 
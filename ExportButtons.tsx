@@ -1,58 +1,40 @@
 import React from "react";
 import { Button } from "@mui/material";
-import Papa from "papaparse";
-import fileDownload from "js-file-download";
-import jsPDF from "jspdf";
-import "jspdf-autotable";
-import html2canvas from "html2canvas";
+import client from "../api";
 
-type Assignment = {
-  date: string;
-  shift_name: string;
-  shift_start: string;
-  shift_end: string;
-  agent_id: number;
-  agent_name: string;
-  agent_skill: string;
-  role: string;
+type ExportFilters = {
+  start?: string;
+  end?: string;
+  agentIds?: number[];
 };
 
-export default function ExportButtons({ assignments, projectName }: { assignments: Assignment[], projectName?: string }) {
+// Files are generated server-side from a cursor (/schedules/{id}/export) and
+// downloaded by the browser directly, so large schedules never have to be
+// held in the tab.
+export function exportUrl(scheduleId: number, format: "csv" | "xlsx" | "pdf", filters: ExportFilters = {}) {
+  const params = new URLSearchParams({ format });
+  if (filters.start) params.append("start", filters.start);
+  if (filters.end) params.append("end", filters.end);
+  (filters.agentIds || []).forEach(id => params.append("agent_id", String(id)));
+  return `${client.defaults.baseURL}/schedules/${scheduleId}/export?${params.toString()}`;
+}
 
-  const exportCSV = () => {
-    const rows = assignments.map(a => ({
-      project: projectName || "",
-      date: a.date,
-      shift: a.shift_name,
-      start: a.shift_start,
-      end: a.shift_end,
-      agent_id: a.agent_id,
-      agent_name: a.agent_name,
-      skill: a.agent_skill,
-      role: a.role
-    }));
-    const csv = Papa.unparse(rows);
-    fileDownload(csv, `schedule_${projectName || "project"}_${new Date().toISOString().slice(0,10)}.csv`);
-  };
+export default function ExportButtons({ scheduleId, filters }: { scheduleId: number, filters?: ExportFilters }) {
 
-  const exportPDF = async () => {
-    const doc = new jsPDF({ orientation: "landscape" });
-    const head = [["Date","Shift","Start","End","Agent","Skill","Role"]];
-    const body = assignments.map(a => [a.date, a.shift_name, a.shift_start, a.shift_end, a.agent_name, a.agent_skill, a.role]);
-    (doc as any).autoTable({
-      head,
-      body,
-      startY: 20,
-      styles: { fontSize: 9 }
-    });
-    doc.text(`Schedule export — ${projectName || ""}`, 14, 12);
-    doc.save(`schedule_${projectName || "project"}_${new Date().toISOString().slice(0,10)}.pdf`);
+  const download = (format: "csv" | "xlsx" | "pdf") => {
+    const a = document.createElement("a");
+    a.href = exportUrl(scheduleId, format, filters);
+    a.rel = "noopener";
+    document.body.appendChild(a);
+    a.click();
+    a.remove();
   };
 
   return (
     <>
-      <Button variant="outlined" onClick={exportCSV}>Export CSV</Button>
-      <Button variant="contained" onClick={exportPDF}>Export PDF</Button>
+      <Button variant="outlined" onClick={() => download("csv")}>Export CSV</Button>
+      <Button variant="outlined" onClick={() => download("xlsx")}>Export XLSX</Button>
+      <Button variant="contained" onClick={() => download("pdf")}>Export PDF</Button>
     </>
   );
 }
@@ -7,21 +7,26 @@ export default function JobStatus({ jobId, onComplete }: { jobId: string | null,
   const [result, setResult] = useState<any>(null);
   const [polling, setPolling] = useState(false);
 
+  const [progress, setProgress] = useState<any>(null);
+
   useEffect(() => {
     let t: any = null;
-    if (jobId) {
-      setStatus("PENDING");
-      setResult(null);
-      setPolling(true);
+    let es: EventSource | null = null;
+    const finish = (r: any) => {
+      setPolling(false);
+      if (es) es.close();
+      if (t) clearInterval(t);
+      if (onComplete) onComplete(r);
+    };
+    // fallback for when the event stream is unavailable
+    const poll = () => {
       t = setInterval(async () => {
         try {
           const res = await client.get(`/jobs/${jobId}`);
           setStatus(res.data.status);
           setResult(res.data.result);
           if (["SUCCESS", "FAILURE", "REVOKED"].includes(res.data.status) || (res.data.result && (res.data.result.schedule_id || res.data.result.status === "no_solution"))) {
-            setPolling(false);
-            clearInterval(t);
-            if (onComplete) onComplete(res.data.result);
+            finish(res.data.result);
           }
         } catch (e) {
           setStatus("ERROR");
@@ -29,17 +34,53 @@ export default function JobStatus({ jobId, onComplete }: { jobId: string | null,
           clearInterval(t);
         }
       }, 2000);
+    };
+    if (jobId) {
+      setStatus("PENDING");
+      setResult(null);
+      setProgress(null);
+      setPolling(true);
+      es = new EventSource(`${client.defaults.baseURL}/jobs/${jobId}/events`);
+      es.addEventListener("progress", (ev: MessageEvent) => {
+        setStatus("PROGRESS");
+        setProgress(JSON.parse(ev.data));
+      });
+      es.addEventListener("done", (ev: MessageEvent) => {
+        const r = JSON.parse(ev.data);
+        setStatus(r && r.status === "error" ? "FAILURE" : "SUCCESS");
+        setResult(r);
+        finish(r);
+      });
+      es.onerror = () => {
+        if (es) es.close();
+        es = null;
+        if (!t) poll();
+      };
     }
-    return () => { if(t) clearInterval(t); };
+    return () => { if (es) es.close(); if (t) clearInterval(t); };
   }, [jobId]);
 
+  const acceptBest = async () => {
+    try {
+      await client.post(`/jobs/${jobId}/accept`);
+    } catch (e) {
+      console.error(e);
+    }
+  };
+
   if (!jobId) return <Box>No active job</Box>;
 
   return (
     <Box>
       <Typography>Job ID: {jobId}</Typography>
       <Typography>Status: {status}</Typography>
+      {progress && (
+        <Typography variant="body2">
+          Best objective {progress.objective} (bound {progress.bound}, gap {(progress.gap * 100).toFixed(1)}%) after {progress.elapsed}s
+        </Typography>
+      )}
       {polling && <LinearProgress sx={{mt:1}} />}
+      {polling && progress && <Button sx={{mt:1}} size="small" variant="outlined" onClick={acceptBest}>Accept current best</Button>}
       {result && <pre style={{whiteSpace:"pre-wrap"}}>{JSON.stringify(result, null, 2)}</pre>}
     </Box>
   );
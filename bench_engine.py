@@ -0,0 +1,193 @@
+import argparse, json, os, platform, random, resource, sys
+import multiprocessing as mp
+from datetime import date, timedelta
+from time import perf_counter
+from . import scheduler_engine, evaluator
+
+# Drives scheduler_engine.build_schedule with synthetic projects, no database.
+# Each case runs in a fresh process so peak RSS is per case.
+#
+#   python -m app.bench_engine --suite default --out bench/baseline.json
+#   python -m app.bench_engine --suite default --compare bench/baseline.json
+#   python -m app.bench_engine --agents 200 --days 28 --pattern 2x12 --exceptions 0.1
+
+# (name, start, end, crosses_midnight, share of the daily load)
+SHIFT_PATTERNS = {
+    "3x9": [("Morning", "07:00", "16:00", False, 0.45), ("Afternoon", "15:00", "00:00", True, 0.35), ("Night", "23:00", "08:00", True, 0.2)],
+    "2x12": [("Day", "07:00", "19:00", False, 0.6), ("Night", "19:00", "07:00", True, 0.4)],
+    "4x8": [("Early", "06:00", "14:00", False, 0.3), ("Mid", "10:00", "18:00", False, 0.3),
+            ("Late", "14:00", "22:00", False, 0.25), ("Night", "22:00", "06:00", True, 0.15)],
+}
+
+SUITES = {
+    "small": [
+        {"agents": 30, "days": 7, "pattern": "3x9"},
+        {"agents": 30, "days": 14, "pattern": "2x12", "exceptions": 0.1},
+    ],
+    "default": [
+        {"agents": 47, "days": 14, "pattern": "3x9"},
+        {"agents": 71, "days": 14, "pattern": "3x9", "exceptions": 0.1},
+        {"agents": 100, "days": 28, "pattern": "2x12", "exceptions": 0.05},
+        {"agents": 150, "days": 14, "pattern": "4x8", "skill_mix": [0.4, 0.4, 0.2]},
+    ],
+    "large": [
+        {"agents": 300, "days": 28, "pattern": "3x9", "exceptions": 0.05},
+        {"agents": 500, "days": 28, "pattern": "4x8", "exceptions": 0.05},
+    ],
+}
+
+CASE_DEFAULTS = {"agents": 47, "days": 14, "pattern": "3x9", "skill_mix": [0.35, 0.35, 0.3], "exceptions": 0.0,
+                 "load": 0.6, "mode": "exact", "time_limit": 30, "workers": 1, "seed": 1}
+
+def case_name(case: dict) -> str:
+    return f"{case['pattern']}-a{case['agents']}-d{case['days']}-x{case['exceptions']}-{case['mode']}"
+
+def make_project(agents: int, days: int, pattern: str, skill_mix, exceptions: float, load: float, seed: int, start: date):
+    # skill_mix is the chat/email/both share; exceptions is the share of
+    # agents getting one fixed_off range (1-3 days) or a fixed_shift day
+    rnd = random.Random(seed)
+    shifts, reqs = [], {}
+    for i, (name, st, et, cm, share) in enumerate(SHIFT_PATTERNS[pattern]):
+        shifts.append({"id": i + 1, "name": name, "start_time": st, "end_time": et, "crosses_midnight": cm})
+        total = max(1, int(agents * load * share))
+        reqs[i + 1] = {"chat_min": total // 3, "email_min": total // 3, "total": total}
+    skills = rnd.choices(["chat", "email", "both"], weights=skill_mix, k=agents)
+    agent_rows = [{"id": i + 1, "name": f"Bench-{i + 1}", "channel_skill": s} for i, s in enumerate(skills)]
+    ex_rows = []
+    for a in rnd.sample(agent_rows, int(agents * exceptions)):
+        first = start + timedelta(days=rnd.randrange(days))
+        if rnd.random() < 0.7:
+            ex_rows.append({"agent_id": a["id"], "type": "fixed_off", "start_date": first,
+                            "end_date": min(first + timedelta(days=rnd.randint(0, 2)), start + timedelta(days=days - 1)), "shift_id": None})
+        else:
+            ex_rows.append({"agent_id": a["id"], "type": "fixed_shift", "start_date": first, "end_date": first,
+                            "shift_id": rnd.choice(shifts)["id"]})
+    return agent_rows, shifts, ex_rows, reqs
+
+def run_case(case: dict) -> dict:
+    case = dict(CASE_DEFAULTS, **case)
+    start = date(2026, 1, 5)
+    agents, shifts, exceptions, reqs = make_project(case["agents"], case["days"], case["pattern"], case["skill_mix"],
+                                                    case["exceptions"], case["load"], case["seed"], start)
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    t = perf_counter()
+    sol = scheduler_engine.build_schedule(
+        project_id=0,
+        start_date=start,
+        horizon_days=case["days"],
+        agents=agents,
+        shifts=shifts,
+        exceptions=exceptions,
+        per_shift_requirements=reqs,
+        solver_time_limit=case["time_limit"],
+        mode=case["mode"],
+        num_workers=case["workers"],
+        stop_policy={"relative_gap": 0, "adaptive_time": False}
+    )
+    wall = perf_counter() - t
+    m = sol["metrics"]
+    # the evaluator is the oracle: the schedule must break no hard rule and
+    # score what the solver says it scores
+    ev = evaluator.evaluate(sol.get("assignments", []), agents, shifts, exceptions, reqs, start, case["days"])
+    # ru_maxrss is KiB on Linux, bytes on macOS
+    scale = 1 if sys.platform == "darwin" else 1024
+    return {
+        "case": case,
+        "status": m.get("status"),
+        "objective": m.get("objective"),
+        "build_time": m.get("build_time"),
+        "solve_time": m.get("solve_time"),
+        "first_solution_time": m.get("first_solution_time"),
+        "wall_time": round(wall, 4),
+        "num_vars": m.get("num_vars"),
+        "num_constraints": m.get("num_constraints"),
+        "live_vars": m.get("live_vars"),
+        "assignments": len(sol.get("assignments", [])),
+        "valid": ev["valid"],
+        "violations": {k: n for k, n in ev["violations"].items() if n},
+        "oracle_objective": ev["objective"],
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale / 2**20, 1),
+        "rss_growth_mb": round((resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rss_before) * scale / 2**20, 1),
+    }
+
+def run_suite(cases, isolate: bool = True) -> dict:
+    results = {}
+    for case in cases:
+        case = dict(CASE_DEFAULTS, **case)
+        if isolate:
+            with mp.get_context("spawn").Pool(1) as pool:
+                r = pool.apply(run_case, (case,))
+        else:
+            r = run_case(case)
+        results[case_name(case)] = r
+        print(f"{case_name(case):40s} {r['status']:10s} obj={r['objective']} build={r['build_time']}s "
+              f"first={r['first_solution_time']}s solve={r['solve_time']}s rss={r['peak_rss_mb']}MB", file=sys.stderr)
+    return {"env": {"python": platform.python_version(), "machine": platform.machine(), "cpus": os.cpu_count()}, "results": results}
+
+STATUS_RANK = {"OPTIMAL": 0, "FEASIBLE": 1, "UNKNOWN": 2, "INFEASIBLE": 3, "MODEL_INVALID": 3}
+
+def compare(baseline: dict, current: dict, time_tolerance: float = 0.25, time_slack: float = 0.5, objective_tolerance: float = 0.02) -> list:
+    # a regression is an invalid schedule or one the solver mis-scored, a
+    # worse status, a worse objective beyond the tolerance, a model that
+    # grew, or a timing that slowed beyond tolerance + slack
+    problems = []
+    for name, cur in current["results"].items():
+        if not cur.get("valid", True):
+            problems.append(f"{name}: invalid schedule {cur.get('violations')}")
+        if cur["objective"] is not None and cur.get("oracle_objective") is not None and round(cur["objective"]) != cur["oracle_objective"]:
+            problems.append(f"{name}: solver objective {cur['objective']} != evaluated {cur['oracle_objective']}")
+    for name, base in baseline["results"].items():
+        cur = current["results"].get(name)
+        if cur is None:
+            continue
+        if STATUS_RANK.get(cur["status"], 3) > STATUS_RANK.get(base["status"], 3):
+            problems.append(f"{name}: status {base['status']} -> {cur['status']}")
+        if base["objective"] is not None and cur["objective"] is not None:
+            if cur["objective"] > base["objective"] + abs(base["objective"]) * objective_tolerance:
+                problems.append(f"{name}: objective {base['objective']} -> {cur['objective']}")
+        for k in ("num_vars", "num_constraints", "live_vars"):
+            if base.get(k) and cur.get(k) and cur[k] > base[k]:
+                problems.append(f"{name}: {k} {base[k]} -> {cur[k]}")
+        for k in ("build_time", "first_solution_time", "solve_time"):
+            if base.get(k) is not None and cur.get(k) is not None and cur[k] > base[k] * (1 + time_tolerance) + time_slack:
+                problems.append(f"{name}: {k} {base[k]}s -> {cur[k]}s")
+    return problems
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--suite", choices=sorted(SUITES), default=None)
+    ap.add_argument("--agents", type=int, default=None)
+    ap.add_argument("--days", type=int, default=CASE_DEFAULTS["days"])
+    ap.add_argument("--pattern", choices=sorted(SHIFT_PATTERNS), default=CASE_DEFAULTS["pattern"])
+    ap.add_argument("--skill-mix", default=None, help="chat,email,both shares, e.g. 0.4,0.4,0.2")
+    ap.add_argument("--exceptions", type=float, default=CASE_DEFAULTS["exceptions"])
+    ap.add_argument("--load", type=float, default=CASE_DEFAULTS["load"])
+    ap.add_argument("--mode", default=CASE_DEFAULTS["mode"])
+    ap.add_argument("--time-limit", type=float, default=CASE_DEFAULTS["time_limit"])
+    ap.add_argument("--workers", type=int, default=CASE_DEFAULTS["workers"])
+    ap.add_argument("--seed", type=int, default=CASE_DEFAULTS["seed"])
+    ap.add_argument("--no-isolate", action="store_true", help="run cases in this process (RSS is then cumulative)")
+    ap.add_argument("--out", default=None)
+    ap.add_argument("--compare", default=None)
+    ap.add_argument("--time-tolerance", type=float, default=0.25)
+    args = ap.parse_args()
+
+    common = {"mode": args.mode, "time_limit": args.time_limit, "workers": args.workers, "seed": args.seed, "load": args.load}
+    if args.agents:
+        cases = [dict(common, agents=args.agents, days=args.days, pattern=args.pattern, exceptions=args.exceptions,
+                      skill_mix=[float(x) for x in args.skill_mix.split(",")] if args.skill_mix else CASE_DEFAULTS["skill_mix"])]
+    else:
+        cases = [dict(common, **c) for c in SUITES[args.suite or "default"]]
+    report = run_suite(cases, isolate=not args.no_isolate)
+    if args.out:
+        os.makedirs(os.path.dirname(os.path.abspath(args.out)), exist_ok=True)
+        with open(args.out, "w") as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+    else:
+        print(json.dumps(report, indent=2, sort_keys=True))
+    if args.compare:
+        with open(args.compare) as f:
+            problems = compare(json.load(f), report, time_tolerance=args.time_tolerance)
+        for p in problems:
+            print("REGRESSION", p, file=sys.stderr)
+        sys.exit(1 if problems else 0)
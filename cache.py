@@ -0,0 +1,236 @@
+import os, json, time, hashlib, threading
+from collections import OrderedDict
+from typing import Any, Optional
+from . import metrics
+
+REDIS_URL = os.environ.get("REDIS_URL", "redis://localhost:6379/0")
+
+_redis = None
+_redis_checked_at = 0.0
+
+def get_redis():
+    # shared client, or None when Redis is not reachable; re-probed at most
+    # every 30s so a missing Redis does not cost a connect per call
+    global _redis, _redis_checked_at
+    if _redis is not None:
+        return _redis
+    if time.monotonic() - _redis_checked_at < 30 and _redis_checked_at:
+        return None
+    _redis_checked_at = time.monotonic()
+    try:
+        import redis
+        client = redis.Redis.from_url(REDIS_URL, socket_connect_timeout=0.5, socket_timeout=2)
+        client.ping()
+        _redis = client
+    except Exception:
+        _redis = None
+    return _redis
+
+def canonical_hash(obj: Any) -> str:
+    payload = json.dumps(obj, sort_keys=True, default=str, separators=(",", ":"))
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+class TTLCache:
+    # in-process LRU with per-entry expiry; with maxbytes, entries set with a
+    # size also count against a byte budget
+    def __init__(self, maxsize: int = 256, ttl: float = 3600, maxbytes: int = 0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.maxbytes = maxbytes
+        self.nbytes = 0
+        self._data = OrderedDict()
+        self._sizes = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            value, expires = item
+            if expires < time.monotonic():
+                del self._data[key]
+                self.nbytes -= self._sizes.pop(key, 0)
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl: Optional[float] = None, size: int = 0):
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + (ttl or self.ttl))
+            self._data.move_to_end(key)
+            self.nbytes += size - self._sizes.pop(key, 0)
+            if size:
+                self._sizes[key] = size
+            self._evict()
+
+    def add(self, key, value, ttl: Optional[float] = None) -> bool:
+        with self._lock:
+            item = self._data.get(key)
+            if item is not None and item[1] >= time.monotonic():
+                return False
+            self._data[key] = (value, time.monotonic() + (ttl or self.ttl))
+            self._data.move_to_end(key)
+            self._evict()
+            return True
+
+    def _evict(self):
+        # under the lock: expired entries at the LRU end, then the least
+        # recently used ones until count and bytes fit
+        now = time.monotonic()
+        while self._data:
+            old, (_, expires) = next(iter(self._data.items()))
+            if expires >= now and len(self._data) <= self.maxsize and not (self.maxbytes and self.nbytes > self.maxbytes and len(self._data) > 1):
+                break
+            del self._data[old]
+            self.nbytes -= self._sizes.pop(old, 0)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+            self.nbytes -= self._sizes.pop(key, 0)
+
+class SolveCache:
+    # Results of finished solves keyed by input hash, plus in-flight markers
+    # so identical concurrent jobs share one solve. Redis when available
+    # (sliding TTL, so entries that keep being hit stay), otherwise a
+    # per-process LRU.
+    def __init__(self, prefix: str = "solve", ttl: int = None, maxsize: int = None):
+        self.prefix = prefix
+        self.ttl = ttl or int(os.environ.get("SOLVE_CACHE_TTL", 86400))
+        self.local = TTLCache(maxsize or int(os.environ.get("SOLVE_CACHE_SIZE", 256)), self.ttl)
+        self.inflight = TTLCache(1024, 600)
+
+    def get(self, key: str) -> Optional[dict]:
+        r = get_redis()
+        if r is not None:
+            raw = r.get(f"{self.prefix}:result:{key}")
+            if raw is not None:
+                r.expire(f"{self.prefix}:result:{key}", self.ttl)
+            value = json.loads(raw) if raw is not None else None
+        else:
+            value = self.local.get(key)
+        CACHE_REQUESTS.inc(cache=self.prefix, result="hit" if value is not None else "miss")
+        return value
+
+    def set(self, key: str, value: dict):
+        r = get_redis()
+        if r is not None:
+            r.set(f"{self.prefix}:result:{key}", json.dumps(value, default=str), ex=self.ttl)
+        else:
+            self.local.set(key, value)
+
+    def delete(self, key: str):
+        r = get_redis()
+        if r is not None:
+            r.delete(f"{self.prefix}:result:{key}")
+        self.local.delete(key)
+
+    def acquire(self, key: str, owner: str, ttl: int) -> bool:
+        r = get_redis()
+        if r is not None:
+            return bool(r.set(f"{self.prefix}:inflight:{key}", owner, nx=True, ex=ttl))
+        return self.inflight.add(key, owner, ttl)
+
+    def release(self, key: str, owner: str):
+        r = get_redis()
+        if r is not None:
+            name = f"{self.prefix}:inflight:{key}"
+            if (r.get(name) or b"").decode() == owner:
+                r.delete(name)
+        elif self.inflight.get(key) == owner:
+            self.inflight.delete(key)
+
+    def in_flight(self, key: str) -> bool:
+        r = get_redis()
+        if r is not None:
+            return bool(r.exists(f"{self.prefix}:inflight:{key}"))
+        return self.inflight.get(key) is not None
+
+    def wait(self, key: str, timeout: float, poll: float = 0.5) -> Optional[dict]:
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            hit = self.get(key)
+            if hit is not None:
+                return hit
+            if not self.in_flight(key):
+                return self.get(key)
+            time.sleep(poll)
+        return None
+
+CACHE_REQUESTS = metrics.Counter("scheduler_cache_requests_total", "Cache lookups", ["cache", "result"])
+
+class ReferenceCache:
+    # Read-through cache for per-project reference data (shift and agent
+    # lists) and enriched schedule payloads. Keys carry the project's version;
+    # writes bump the version instead of deleting keys, so stale entries are
+    # never read and simply age out. Versions live in Redis when available so
+    # every API process sees a bump; values are kept in-process and, when
+    # Redis is there, also in Redis for the other processes.
+    #
+    # Values are sized by their JSON encoding: the in-process copies share a
+    # REFERENCE_CACHE_MAX_BYTES budget, and a value above
+    # REFERENCE_CACHE_MAX_ENTRY_BYTES (a very large schedule page) is not
+    # cached at all. Every call may talk to Redis, so async code goes
+    # through a threadpool.
+    def __init__(self, prefix: str = "ref", ttl: int = None, maxsize: int = None, max_bytes: int = None,
+                 max_entry_bytes: int = None):
+        self.prefix = prefix
+        self.ttl = ttl or int(os.environ.get("REFERENCE_CACHE_TTL", 3600))
+        self.max_entry_bytes = max_entry_bytes or int(os.environ.get("REFERENCE_CACHE_MAX_ENTRY_BYTES", 4 * 2**20))
+        self.local = TTLCache(maxsize or int(os.environ.get("REFERENCE_CACHE_SIZE", 128)), self.ttl,
+                              max_bytes or int(os.environ.get("REFERENCE_CACHE_MAX_BYTES", 64 * 2**20)))
+        self.versions = {}
+        self._lock = threading.Lock()
+
+    def version(self, project_id: int) -> int:
+        r = get_redis()
+        if r is not None:
+            return int(r.get(f"{self.prefix}:ver:{project_id}") or 0)
+        return self.versions.get(project_id, 0)
+
+    def bump(self, project_id: int):
+        r = get_redis()
+        if r is not None:
+            r.incr(f"{self.prefix}:ver:{project_id}")
+        with self._lock:
+            self.versions[project_id] = self.versions.get(project_id, 0) + 1
+
+    def _key(self, project_id: int, name: str) -> str:
+        return f"{self.prefix}:{project_id}:v{self.version(project_id)}:{name}"
+
+    def get(self, project_id: int, name: str):
+        key = self._key(project_id, name)
+        value = self.local.get(key)
+        layer = "local"
+        if value is None:
+            r = get_redis()
+            raw = r.get(key) if r is not None else None
+            if raw is not None:
+                value = json.loads(raw)
+                self.local.set(key, value, size=len(raw))
+                layer = "redis"
+        CACHE_REQUESTS.inc(cache=self.prefix, result="miss" if value is None else ("hit" if layer == "local" else "redis_hit"))
+        return value
+
+    def set(self, project_id: int, name: str, value) -> bool:
+        # False when the value is over the per-entry limit and was not cached
+        payload = json.dumps(value, default=str)
+        if len(payload) > self.max_entry_bytes:
+            CACHE_REQUESTS.inc(cache=self.prefix, result="too_large")
+            return False
+        key = self._key(project_id, name)
+        self.local.set(key, value, size=len(payload))
+        r = get_redis()
+        if r is not None:
+            r.set(key, payload, ex=self.ttl)
+        return True
+
+    def get_or_load(self, project_id: int, name: str, loader):
+        value = self.get(project_id, name)
+        if value is None:
+            value = loader()
+            self.set(project_id, name, value)
+        return value
+
+reference_cache = ReferenceCache()
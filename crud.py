@@ -1,7 +1,10 @@
-from sqlalchemy.orm import Session
+from sqlalchemy import insert, select, delete, func, case
+from sqlalchemy.orm import Session, selectinload
 from . import models
+from .schedule_matrix import ScheduleMatrix
+from .cache import reference_cache
 from datetime import date, timedelta
-from typing import List
+from typing import List, Optional
 
 def create_project(db: Session, project):
     p = models.Project(name=project.name, max_agents=project.max_agents, off_pattern=project.off_pattern)
@@ -26,6 +29,7 @@ def create_shift(db: Session, project_id: int, s):
     db.add(shift)
     db.commit()
     db.refresh(shift)
+    reference_cache.bump(project_id)
     return shift
 
 def create_agent(db: Session, project_id: int, a):
@@ -33,31 +37,217 @@ def create_agent(db: Session, project_id: int, a):
     db.add(ag)
     db.commit()
     db.refresh(ag)
+    reference_cache.bump(project_id)
     return ag
 
-def list_agents(db: Session, project_id: int):
-    return db.query(models.Agent).filter(models.Agent.project_id==project_id).all()
+def list_agents(db: Session, project_id: int, include_inactive: bool = False):
+    # the roster; agents removed by a repair stay for the schedules that
+    # still name them, and are only listed with include_inactive
+    q = db.query(models.Agent).filter(models.Agent.project_id==project_id)
+    if not include_inactive:
+        q = q.filter(models.Agent.is_active.isnot(False))
+    return q.all()
 
 def get_shifts(db: Session, project_id: int):
     return db.query(models.Shift).filter(models.Shift.project_id==project_id).order_by(models.Shift.shift_order).all()
 
+def bulk_create_agents(db: Session, project_id: int, agents: List[dict], exceptions: List[dict]):
+    # exceptions reference their agent by position in `agents`; everything is
+    # written with executemany inserts in a single transaction
+    ids = []
+    if agents:
+        rows = [{"project_id": project_id, "name": a["name"], "email": a.get("email"), "channel_skill": a["channel_skill"]} for a in agents]
+        ids = db.scalars(insert(models.Agent).returning(models.Agent.id, sort_by_parameter_order=True), rows).all()
+    if exceptions:
+        rows = [{"agent_id": ids[e["agent_index"]], "type": e["type"], "start_date": e["start_date"], "end_date": e["end_date"], "shift_id": e.get("shift_id")} for e in exceptions]
+        db.execute(insert(models.ExceptionRow), rows)
+    db.commit()
+    reference_cache.bump(project_id)
+    return ids
+
 def add_exception(db: Session, ex):
     e = models.ExceptionRow(agent_id=ex.agent_id, type=ex.type, start_date=ex.start_date, end_date=ex.end_date, shift_id=ex.shift_id)
     db.add(e)
     db.commit()
     db.refresh(e)
+    agent = db.get(models.Agent, ex.agent_id)
+    if agent is not None:
+        reference_cache.bump(agent.project_id)
     return e
 
-def persist_schedule(db: Session, project_id: int, start_date: date, end_date: date, generation_metadata: dict, assignments: List[dict]):
+def apply_roster_delta(db: Session, exceptions: List[dict], removed_agent_ids: List[int]):
+    # new exceptions and deactivations for a repair; no commit, so they land
+    # with the repaired schedule or not at all (the caller bumps the cache)
+    if exceptions:
+        db.execute(insert(models.ExceptionRow), exceptions)
+    if removed_agent_ids:
+        db.query(models.Agent).filter(models.Agent.id.in_(removed_agent_ids)).update({models.Agent.is_active: False}, synchronize_session=False)
+
+def persist_schedule(db: Session, project_id: int, start_date: date, end_date: date, generation_metadata: dict, assignments):
+    # assignments: a ScheduleMatrix from the engine, or a list of row dicts
     sch = models.Schedule(project_id=project_id, start_date=start_date, end_date=end_date, generation_metadata=generation_metadata)
     db.add(sch)
+    db.flush()
+    if isinstance(assignments, ScheduleMatrix):
+        rows = assignments.db_rows(sch.id)
+    else:
+        rows = [{"schedule_id": sch.id, "date": date.fromisoformat(a['date']) if isinstance(a['date'], str) else a['date'],
+                 "shift_id": a['shift_id'], "agent_id": a['agent_id'], "role": a['role']} for a in assignments]
+    if rows:
+        db.execute(insert(models.ScheduleAssignment), rows)
+        materialize_coverage(db, sch.id)
+    night_ids = night_shift_ids(db, project_id)
+    record_fairness(db, sch, assignments.fairness_counts(night_ids) if isinstance(assignments, ScheduleMatrix)
+                    else fairness_counts(rows, night_ids))
     db.commit()
     db.refresh(sch)
-    for a in assignments:
-        ass = models.ScheduleAssignment(schedule_id=sch.id, date=a['date'], shift_id=a['shift_id'], agent_id=a['agent_id'], role=a['role'])
-        db.add(ass)
+    return sch
+
+def update_generation_metadata(db: Session, sch, generation_metadata: dict):
+    sch.generation_metadata = dict(generation_metadata)
     db.commit()
     return sch
 
+def materialize_coverage(db: Session, schedule_id: int):
+    # per date/shift assigned counts, aggregated once in SQL so coverage reads
+    # are O(days x shifts) instead of O(assignments)
+    SA = models.ScheduleAssignment
+    agg = (select(SA.schedule_id, SA.date, SA.shift_id,
+                  func.sum(case((SA.role == "chat", 1), else_=0)),
+                  func.sum(case((SA.role == "email", 1), else_=0)),
+                  func.sum(case((models.Agent.channel_skill == "both", 1), else_=0)),
+                  func.count(SA.id))
+           .outerjoin(models.Agent, models.Agent.id == SA.agent_id)
+           .where(SA.schedule_id == schedule_id)
+           .group_by(SA.schedule_id, SA.date, SA.shift_id))
+    C = models.ScheduleCoverage
+    db.execute(insert(C).from_select([C.schedule_id, C.date, C.shift_id, C.chat, C.email, C.both, C.total], agg))
+
+def get_coverage(db: Session, schedule_id: int):
+    rows = db.query(models.ScheduleCoverage).filter(models.ScheduleCoverage.schedule_id == schedule_id).all()
+    if not rows:
+        # schedules persisted before coverage was materialized
+        materialize_coverage(db, schedule_id)
+        db.commit()
+        rows = db.query(models.ScheduleCoverage).filter(models.ScheduleCoverage.schedule_id == schedule_id).all()
+    return rows
+
 def get_schedule(db: Session, schedule_id: int):
     return db.query(models.Schedule).filter(models.Schedule.id==schedule_id).first()
+
+def schedule_rows_stmt(schedule_id: int, start: Optional[date] = None, end: Optional[date] = None,
+                       agent_ids: Optional[List[int]] = None, after_id: Optional[int] = None, limit: Optional[int] = None,
+                       enriched: bool = True):
+    SA = models.ScheduleAssignment
+    cols = [SA.id, SA.date, SA.shift_id, SA.agent_id, SA.role]
+    if enriched:
+        cols += [models.Shift.name.label("shift_name"), models.Shift.start_time, models.Shift.end_time, models.Shift.crosses_midnight,
+                 models.Agent.name.label("agent_name"), models.Agent.channel_skill]
+    q = select(*cols).where(SA.schedule_id == schedule_id)
+    if enriched:
+        q = q.outerjoin(models.Shift, models.Shift.id == SA.shift_id).outerjoin(models.Agent, models.Agent.id == SA.agent_id)
+    if start is not None:
+        q = q.where(SA.date >= start)
+    if end is not None:
+        q = q.where(SA.date <= end)
+    if agent_ids:
+        q = q.where(SA.agent_id.in_(agent_ids))
+    if after_id is not None:
+        q = q.where(SA.id > after_id)
+    q = q.order_by(SA.id)
+    if limit is not None:
+        q = q.limit(limit)
+    return q
+
+def iter_schedule_rows(db: Session, schedule_id: int, batch_size: int = 2000, **filters):
+    return db.execute(schedule_rows_stmt(schedule_id, **filters).execution_options(yield_per=batch_size))
+
+# async read paths for the API (AsyncSession); same statements as above
+
+async def list_projects_async(db):
+    return (await db.execute(select(models.Project))).scalars().all()
+
+async def get_project_async(db, project_id: int):
+    return await db.get(models.Project, project_id)
+
+async def list_agents_async(db, project_id: int, include_inactive: bool = False):
+    stmt = select(models.Agent).filter(models.Agent.project_id==project_id)
+    if not include_inactive:
+        stmt = stmt.filter(models.Agent.is_active.isnot(False))
+    return (await db.execute(stmt)).scalars().all()
+
+async def get_shifts_async(db, project_id: int):
+    return (await db.execute(select(models.Shift).filter(models.Shift.project_id==project_id).order_by(models.Shift.shift_order))).scalars().all()
+
+async def get_schedule_async(db, schedule_id: int):
+    return await db.get(models.Schedule, schedule_id)
+
+async def stream_schedule_rows(db, schedule_id: int, batch_size: int = 2000, **filters):
+    return await db.stream(schedule_rows_stmt(schedule_id, **filters).execution_options(yield_per=batch_size))
+
+def list_agents_with_exceptions(db: Session, project_id: int):
+    return (db.query(models.Agent).options(selectinload(models.Agent.exceptions))
+            .filter(models.Agent.project_id==project_id, models.Agent.is_active.isnot(False))
+            .order_by(models.Agent.id).all())
+
+def get_latest_schedule(db: Session, project_id: int, before: Optional[date] = None):
+    q = db.query(models.Schedule).filter(models.Schedule.project_id==project_id)
+    if before is not None:
+        q = q.filter(models.Schedule.start_date < before)
+    return q.order_by(models.Schedule.generated_at.desc()).first()
+
+def night_shift_ids(db: Session, project_id: int) -> set:
+    return set(db.scalars(select(models.Shift.id).where(models.Shift.project_id == project_id,
+                                                        func.lower(models.Shift.name).like("night%"))))
+
+def fairness_counts(rows, night_ids: set) -> dict:
+    # agent_id -> [nights, weekend days, shifts] from rows with date objects
+    counts = {}
+    for r in rows:
+        c = counts.setdefault(r['agent_id'], [0, 0, 0])
+        c[0] += r['shift_id'] in night_ids
+        c[1] += r['date'].weekday() >= 5
+        c[2] += 1
+    return counts
+
+def record_fairness(db: Session, sch, counts: dict):
+    # a schedule supersedes the ledger rows of every older one starting
+    # inside its cycle (regenerations, repairs); no commit, so the ledger
+    # lands in the same transaction as the assignments
+    FL = models.FairnessLedger
+    db.execute(delete(FL).where(FL.project_id == sch.project_id, FL.cycle_start >= sch.start_date,
+                                FL.cycle_start <= sch.end_date, FL.schedule_id != sch.id))
+    rows = [{"project_id": sch.project_id, "schedule_id": sch.id, "agent_id": agent_id, "cycle_start": sch.start_date,
+             "cycle_end": sch.end_date, "nights": n, "weekends": w, "shifts": t} for agent_id, (n, w, t) in counts.items() if t]
+    if rows:
+        db.execute(insert(FL), rows)
+
+def fairness_history(db: Session, project_id: int, before: date, since: date) -> List[dict]:
+    # ledger rows of cycles starting before `before` and ending on or after
+    # `since`: one range scan on (project_id, cycle_end)
+    FL = models.FairnessLedger
+    stmt = (select(FL.agent_id, FL.cycle_start, FL.cycle_end, FL.nights, FL.weekends, FL.shifts)
+            .where(FL.project_id == project_id, FL.cycle_end >= since, FL.cycle_start < before))
+    return [dict(r._mapping) for r in db.execute(stmt)]
+
+def fairness_recorded(db: Session, schedule_id: int) -> bool:
+    # False for a schedule a later one of its cycle has superseded (or one
+    # from before the ledger)
+    FL = models.FairnessLedger
+    return db.scalar(select(FL.id).where(FL.schedule_id == schedule_id).limit(1)) is not None
+
+def backfill_fairness_ledger(db: Session, project_id: int, before: date) -> bool:
+    # projects with schedules persisted before the ledger existed: replay all
+    # their schedules in generation order, once; True when it did
+    latest = get_latest_schedule(db, project_id, before=before)
+    if latest is None or fairness_recorded(db, latest.id):
+        return False
+    night_ids = night_shift_ids(db, project_id)
+    SA = models.ScheduleAssignment
+    schedules = (db.query(models.Schedule).filter(models.Schedule.project_id == project_id)
+                 .order_by(models.Schedule.generated_at).all())
+    for sch in schedules:
+        rows = db.execute(select(SA.agent_id, SA.date, SA.shift_id).where(SA.schedule_id == sch.id)).mappings()
+        record_fairness(db, sch, fairness_counts(rows, night_ids))
+    db.commit()
+    return True
@@ -0,0 +1,206 @@
+import numpy as np
+from datetime import date, datetime, timedelta
+from time import perf_counter
+from typing import Any, Dict, List, Tuple
+from .schedule_matrix import ScheduleMatrix, ROLES
+from .scheduler_engine import COVERAGE_PENALTY, NIGHT_ALPHA, availability, exception_days, parse_date_obj, roles_for_skill, shift_window_for_date, shift_windows
+
+# Checks a finished schedule against the rules build_schedule encodes and
+# scores it with the same objective, without building a CP-SAT model. The
+# schedule becomes an agent x day x shift x role count tensor and every rule
+# is a vectorised pass over it, so it is cheap enough for an API call and is
+# the oracle bench_engine checks solver output against.
+
+HARD_RULES = ('unknown_agent', 'unknown_shift', 'unknown_role', 'outside_horizon', 'role_skill', 'multiple_shifts',
+              'overlap', 'fixed_off', 'fixed_shift', 'boundary_overlap', 'missing_fixed_shift')
+
+def _positions(ids: np.ndarray, known: List[int]) -> np.ndarray:
+    # id -> position in `known`, -1 when unknown
+    known_arr = np.asarray(known, dtype=np.int64)
+    if not len(known_arr):
+        return np.full(len(ids), -1, dtype=np.int64)
+    order = np.argsort(known_arr)
+    idx = np.searchsorted(known_arr[order], ids)
+    idx = np.clip(idx, 0, len(known_arr) - 1)
+    pos = order[idx]
+    return np.where(known_arr[pos] == ids, pos, -1)
+
+def assignment_arrays(assignments, start_date: date) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    # (agent_id, day offset, shift_id, role index) columns from rows or a
+    # ScheduleMatrix; role index is -1 for an unknown role
+    if isinstance(assignments, ScheduleMatrix):
+        a, d = np.nonzero(assignments.codes >= 0)
+        code = assignments.codes[a, d].astype(np.int64)
+        offset = (assignments.start_date - start_date).days
+        return assignments.agent_ids[a], d + offset, assignments.shift_ids[code >> 1], code & 1
+    day_of = {}
+    days = np.empty(len(assignments), dtype=np.int64)
+    for i, r in enumerate(assignments):
+        d = r['date']
+        day = day_of.get(d)
+        if day is None:
+            day = day_of[d] = (parse_date_obj(d) - start_date).days
+        days[i] = day
+    agent_ids = np.fromiter((r['agent_id'] for r in assignments), dtype=np.int64, count=len(assignments))
+    shift_ids = np.fromiter((r['shift_id'] for r in assignments), dtype=np.int64, count=len(assignments))
+    roles = np.fromiter((ROLES.index(r['role']) if r['role'] in ROLES else -1 for r in assignments), dtype=np.int64, count=len(assignments))
+    return agent_ids, days, shift_ids, roles
+
+def _minutes(dt: datetime, origin: datetime) -> int:
+    return int((dt - origin).total_seconds() // 60)
+
+def next_day_conflicts(shifts: List[Dict[str,Any]], start_date: date) -> np.ndarray:
+    # [s, t] is True when shift s on some day overlaps shift t the day after;
+    # windows only depend on the time of day, so one pair of days is enough
+    origin = datetime.combine(start_date, datetime.min.time())
+    today = [shift_window_for_date(start_date, s) for s in shifts]
+    tomorrow = [shift_window_for_date(start_date + timedelta(days=1), s) for s in shifts]
+    st0 = np.array([_minutes(w[0], origin) for w in today]); ed0 = np.array([_minutes(w[1], origin) for w in today])
+    st1 = np.array([_minutes(w[0], origin) for w in tomorrow]); ed1 = np.array([_minutes(w[1], origin) for w in tomorrow])
+    return (st0[:, None] < ed1[None, :]) & (st1[None, :] < ed0[:, None])
+
+def exception_masks(agents: List[Dict[str,Any]], shifts: List[Dict[str,Any]], exceptions: List[Dict[str,Any]],
+                    start_date: date, horizon_days: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    # off[a, d], fixed[a, d, s] (the shift a fixed_shift day has to be) and
+    # other[a, d, s] (shifts a fixed_shift day rules out); same precedence
+    # as availability(): a later fixed_shift replaces an earlier one and
+    # fixed_off wins over both
+    agent_pos = {a['id']: i for i, a in enumerate(agents)}
+    shift_pos = {s['id']: i for i, s in enumerate(shifts)}
+    A, D, S = len(agents), horizon_days, len(shifts)
+    off = np.zeros((A, D), dtype=bool)
+    fixed = np.zeros((A, D, S), dtype=bool)
+    pinned = np.zeros((A, D), dtype=bool)
+    for ex in exceptions:
+        a = agent_pos.get(ex['agent_id'])
+        days = exception_days(ex, start_date, horizon_days)
+        if a is None or not len(days):
+            continue
+        sl = slice(days.start, days.stop)
+        if ex['type'] == 'fixed_shift':
+            pinned[a, sl] = True
+            fixed[a, sl, :] = False
+            if ex['shift_id'] in shift_pos:
+                fixed[a, sl, shift_pos[ex['shift_id']]] = True
+        elif ex['type'] == 'fixed_off':
+            off[a, sl] = True
+    pinned &= ~off
+    fixed &= pinned[:, :, None]
+    other = pinned[:, :, None] & ~fixed
+    return off, fixed, other
+
+def evaluate(assignments,
+             agents: List[Dict[str,Any]],
+             shifts: List[Dict[str,Any]],
+             exceptions: List[Dict[str,Any]],
+             per_shift_requirements: Dict[int, Dict[str,Any]],
+             start_date: date,
+             horizon_days: int,
+             previous_metrics: Dict[int, Dict[str,int]] = None,
+             boundary_assignments: List[Dict[str,Any]] = None,
+             max_samples: int = 20) -> Dict[str,Any]:
+    # assignments: rows ({date, shift_id, agent_id, role}) or a ScheduleMatrix
+    started = perf_counter()
+    previous_metrics = previous_metrics or {}
+    agent_ids = [a['id'] for a in agents]
+    shift_ids = [s['id'] for s in shifts]
+    A, D, S, R = len(agents), horizon_days, len(shifts), len(ROLES)
+    label = lambda day: (start_date + timedelta(days=int(day))).isoformat()
+    violations = {k: 0 for k in HARD_RULES}
+    samples = []
+
+    def flag(rule, agent, day, shift=None):
+        # agent/day/shift: id and day-offset arrays of the offending cells
+        violations[rule] += len(agent)
+        for i in range(min(len(agent), max_samples - len(samples))):
+            item = {'rule': rule, 'agent_id': int(agent[i]), 'date': label(day[i])}
+            if shift is not None:
+                item['shift_id'] = int(shift[i])
+            samples.append(item)
+
+    agent_col, day_col, shift_col, role_col = assignment_arrays(assignments, start_date)
+    a_pos = _positions(agent_col, agent_ids)
+    s_pos = _positions(shift_col, shift_ids)
+    bad = np.zeros(len(agent_col), dtype=bool)
+    for rule, mask in (('unknown_agent', a_pos < 0), ('unknown_shift', s_pos < 0), ('unknown_role', role_col < 0),
+                       ('outside_horizon', (day_col < 0) | (day_col >= D))):
+        mask = mask & ~bad
+        flag(rule, agent_col[mask], day_col[mask], shift_col[mask])
+        bad |= mask
+    ok = ~bad
+
+    # counts[a, d, s, r]; duplicates of one cell count twice and show up as
+    # multiple shifts below
+    counts = np.zeros((A, D, S, R), dtype=np.int16)
+    np.add.at(counts, (a_pos[ok], day_col[ok], s_pos[ok], role_col[ok]), 1)
+    worked = counts.sum(axis=3)                       # a, d, s
+    per_day = worked.sum(axis=2)                      # a, d
+    on = worked > 0
+
+    ids = np.asarray(agent_ids, dtype=np.int64)
+    sids = np.asarray(shift_ids, dtype=np.int64)
+
+    skill_roles = np.array([[r in roles_for_skill(a['channel_skill']) for r in ROLES] for a in agents], dtype=bool).reshape(A, R)
+    a, d, s, r = np.nonzero(counts * ~skill_roles[:, None, None, :])
+    flag('role_skill', ids[a], d, sids[s])
+
+    a, d = np.nonzero(per_day > 1)
+    flag('multiple_shifts', ids[a], d)
+
+    # cross-midnight: a shift on day d overlapping one on day d+1 (two shifts
+    # on the same day are already multiple_shifts)
+    if D > 1 and S:
+        conflict = next_day_conflicts(shifts, start_date).astype(np.int16)
+        hits = np.einsum('ads,st,adt->ad', on[:, :-1].astype(np.int16), conflict, on[:, 1:].astype(np.int16))
+        a, d = np.nonzero(hits)
+        flag('overlap', ids[a], d)
+
+    off, fixed, other = exception_masks(agents, shifts, exceptions, start_date, horizon_days)
+    a, d = np.nonzero(off & (per_day > 0))
+    flag('fixed_off', ids[a], d)
+    a, d, s = np.nonzero(other & on)
+    flag('fixed_shift', ids[a], d, sids[s])
+
+    # neighbouring schedules' rows rule out overlapping shifts, exactly as in
+    # the engine's availability()
+    blocked = np.zeros((A, D, S), dtype=bool)
+    if boundary_assignments:
+        agent_pos = {x: i for i, x in enumerate(agent_ids)}
+        shift_pos = {x: i for i, x in enumerate(shift_ids)}
+        windows = shift_windows(start_date, horizon_days, shifts)
+        for (agent_id, day), free in availability(agents, shifts, [], start_date, horizon_days, windows, boundary_assignments).items():
+            if agent_id in agent_pos:
+                blocked[agent_pos[agent_id], day, :] = True
+                blocked[agent_pos[agent_id], day, [shift_pos[x] for x in free]] = False
+        a, d, s = np.nonzero(blocked & on)
+        flag('boundary_overlap', ids[a], d, sids[s])
+
+    # the engine only forces a fixed shift it could create variables for
+    a, d, s = np.nonzero(fixed & ~blocked & ~on)
+    flag('missing_fixed_shift', ids[a], d, sids[s])
+
+    # coverage, the soft part: same three floors as the model
+    reqs = {int(k): v for k, v in (per_shift_requirements or {}).items()}
+    chat_min = np.array([reqs.get(x, {}).get('chat_min', 0) or 0 for x in shift_ids], dtype=np.int64)
+    email_min = np.array([reqs.get(x, {}).get('email_min', 0) or 0 for x in shift_ids], dtype=np.int64)
+    total = np.array([reqs.get(x, {}).get('total') if reqs.get(x, {}).get('total') is not None else -1 for x in shift_ids], dtype=np.int64)
+    served = counts.sum(axis=0, dtype=np.int64)       # d, s, r
+    unmet = (np.maximum(0, chat_min[None, :] - served[:, :, 0]) + np.maximum(0, email_min[None, :] - served[:, :, 1])
+             + np.where(total[None, :] >= 0, np.maximum(0, total[None, :] - served.sum(axis=2)), 0))
+    by_day = unmet.sum(axis=1)
+
+    night = np.array([x['name'].lower().startswith('night') for x in shifts], dtype=bool)
+    nights = worked[:, :, night].sum(axis=(1, 2)) if S else np.zeros(A, dtype=np.int64)
+    prev = np.array([previous_metrics.get(x, {}).get('nights', 0) for x in agent_ids], dtype=np.int64)
+    shortfall = int(unmet.sum())
+    objective = shortfall * COVERAGE_PENALTY + int((nights * (1 + NIGHT_ALPHA * prev)).sum())
+
+    return {'valid': not any(violations.values()),
+            'violations': violations,
+            'samples': samples,
+            'assignments': int(ok.sum()),
+            'shortfall': shortfall,
+            'short_days': {label(day): int(n) for day, n in enumerate(by_day) if n},
+            'nights': {int(x): int(n) for x, n in zip(agent_ids, nights) if n},
+            'objective': objective,
+            'time': round(perf_counter() - started, 4)}
@@ -0,0 +1,172 @@
+import csv, io, os, tempfile, uuid
+from typing import Iterable, Iterator, Optional
+from . import metrics
+
+# Schedule exports generated from a server-side cursor. CSV is streamed to
+# the client while it is written; XLSX and PDF need the whole file before the
+# first byte can go out, so they are written to disk row by row and sent from
+# there. Finished files are kept in EXPORT_DIR: a schedule's assignments never
+# change, so an artifact is valid until the project's reference data (shift
+# and agent names) changes, which the caller folds into the key.
+#
+# openpyxl and reportlab are optional; without them only CSV is available.
+
+EXPORT_DIR = os.environ.get("EXPORT_DIR") or os.path.join(tempfile.gettempdir(), "scheduler_exports")
+EXPORT_CACHE_FILES = int(os.environ.get("EXPORT_CACHE_FILES", 200))
+CSV_FLUSH_ROWS = 1000
+
+FORMATS = {
+    "csv": "text/csv",
+    "xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+    "pdf": "application/pdf",
+}
+HEADER = ["project", "date", "shift", "start", "end", "agent_id", "agent_name", "skill", "role"]
+
+EXPORTS = metrics.Counter("scheduler_exports_total", "Schedule exports by artifact cache result", ["format", "result"])
+
+class ExportUnavailable(Exception):
+    pass
+
+def row_values(r, project_name: str):
+    return [project_name, r.date.isoformat(), r.shift_name,
+            r.start_time.strftime("%H:%M") if r.start_time else "", r.end_time.strftime("%H:%M") if r.end_time else "",
+            r.agent_id, r.agent_name, r.channel_skill, r.role]
+
+def check_available(fmt: str):
+    try:
+        if fmt == "xlsx":
+            import openpyxl  # noqa: F401
+        elif fmt == "pdf":
+            import reportlab  # noqa: F401
+    except ImportError:
+        raise ExportUnavailable(f"{fmt} export needs {'openpyxl' if fmt == 'xlsx' else 'reportlab'} installed")
+
+def artifact_path(key: str, fmt: str) -> str:
+    return os.path.join(EXPORT_DIR, f"{key}.{fmt}")
+
+def cached_artifact(key: str, fmt: str) -> Optional[str]:
+    path = artifact_path(key, fmt)
+    if os.path.exists(path):
+        os.utime(path)
+        return path
+    return None
+
+def _tmp_path(path: str) -> str:
+    os.makedirs(EXPORT_DIR, exist_ok=True)
+    return f"{path}.{uuid.uuid4().hex}.tmp"
+
+def _publish(tmp: str, path: str):
+    # atomic, so concurrent exports of the same key never see a partial file
+    os.replace(tmp, path)
+    prune()
+
+def prune(max_files: int = None):
+    # least recently used artifacts go first (cached_artifact touches mtime)
+    max_files = max_files or EXPORT_CACHE_FILES
+    try:
+        entries = [e for e in os.scandir(EXPORT_DIR) if e.is_file() and not e.name.endswith(".tmp")]
+    except FileNotFoundError:
+        return
+    if len(entries) <= max_files:
+        return
+    entries.sort(key=lambda e: e.stat().st_mtime)
+    for e in entries[:len(entries) - max_files]:
+        try:
+            os.remove(e.path)
+        except OSError:
+            pass
+
+def stream_csv(rows: Iterable, project_name: str, key: str) -> Iterator[bytes]:
+    # yields CSV chunks as rows come off the cursor and tees them into the
+    # artifact cache; an aborted download leaves no file behind
+    path = artifact_path(key, "csv")
+    tmp = _tmp_path(path)
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    done = False
+    try:
+        with open(tmp, "wb") as f:
+            writer.writerow(HEADER)
+            n = 0
+            for r in rows:
+                writer.writerow(row_values(r, project_name))
+                n += 1
+                if n % CSV_FLUSH_ROWS == 0:
+                    chunk = buf.getvalue().encode("utf-8")
+                    buf.seek(0)
+                    buf.truncate()
+                    f.write(chunk)
+                    yield chunk
+            chunk = buf.getvalue().encode("utf-8")
+            f.write(chunk)
+            yield chunk
+        _publish(tmp, path)
+        done = True
+    finally:
+        if not done and os.path.exists(tmp):
+            os.remove(tmp)
+
+def write_xlsx(rows: Iterable, project_name: str, key: str, title: str = "Schedule") -> str:
+    from openpyxl import Workbook
+    path = artifact_path(key, "xlsx")
+    tmp = _tmp_path(path)
+    try:
+        # write-only workbooks stream rows to a temp file instead of keeping
+        # a cell object per value
+        wb = Workbook(write_only=True)
+        ws = wb.create_sheet(title[:31])
+        ws.append(HEADER)
+        for r in rows:
+            ws.append(row_values(r, project_name))
+        wb.save(tmp)
+        _publish(tmp, path)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+    return path
+
+PDF_COLUMNS = [("Date", 0), ("Shift", 70), ("Start", 190), ("End", 235), ("Agent", 280), ("Skill", 480), ("Role", 540)]
+PDF_VALUES = (1, 2, 3, 4, 6, 7, 8)  # indexes into row_values
+
+def write_pdf(rows: Iterable, project_name: str, key: str, title: str = "Schedule export") -> str:
+    # plain canvas drawing, one line per assignment; unlike a platypus Table
+    # nothing is laid out ahead of time, finished pages are only kept
+    # compressed until save
+    from reportlab.lib.pagesizes import A4, landscape
+    from reportlab.pdfgen import canvas
+    path = artifact_path(key, "pdf")
+    tmp = _tmp_path(path)
+    width, height = landscape(A4)
+    margin, line = 36, 12
+    try:
+        c = canvas.Canvas(tmp, pagesize=(width, height), pageCompression=1)
+
+        def page_header(page):
+            c.setFont("Helvetica-Bold", 11)
+            c.drawString(margin, height - margin, f"{title} — {project_name}")
+            c.setFont("Helvetica", 8)
+            c.drawRightString(width - margin, height - margin, f"page {page}")
+            c.setFont("Helvetica-Bold", 9)
+            y = height - margin - 2 * line
+            for name, x in PDF_COLUMNS:
+                c.drawString(margin + x, y, name)
+            c.setFont("Helvetica", 9)
+            return y - line
+
+        page = 1
+        y = page_header(page)
+        for r in rows:
+            if y < margin:
+                c.showPage()
+                page += 1
+                y = page_header(page)
+            values = row_values(r, project_name)
+            for (_, x), i in zip(PDF_COLUMNS, PDF_VALUES):
+                c.drawString(margin + x, y, str(values[i] if values[i] is not None else ""))
+            y -= line
+        c.save()
+        _publish(tmp, path)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+    return path
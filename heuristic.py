@@ -0,0 +1,234 @@
+import os, random
+import numpy as np
+from datetime import date
+from time import perf_counter
+from typing import Any, Callable, Dict, List, Tuple
+from .schedule_matrix import ScheduleMatrix, OFF
+from .scheduler_engine import availability, roles_for_skill
+from .evaluator import COVERAGE_PENALTY, NIGHT_ALPHA, evaluate, exception_masks, next_day_conflicts
+
+# Fast path without CP-SAT: a greedy day-by-day construction followed by a
+# time-boxed large-neighbourhood search. The objective (coverage penalty plus
+# per-agent night weights) splits by day and days only interact through
+# cross-midnight overlap, so the neighbourhood is one or two days: clear
+# them, rebuild them against the fixed neighbours, keep the result if it is
+# no worse.
+
+HEURISTIC_TIME_LIMIT = float(os.environ.get("SCHEDULER_HEURISTIC_TIME", 0.5))
+CHAT, EMAIL, EXTRA = 0, 1, 2
+
+class _Draft:
+    def __init__(self, agents, shifts, exceptions, per_shift_requirements, previous_metrics, start_date, horizon_days, allowed):
+        A, D, S = len(agents), horizon_days, len(shifts)
+        self.A, self.D, self.S = A, D, S
+        self.codes = np.full((A, D), OFF, dtype=np.int16)
+        agent_pos = {a['id']: i for i, a in enumerate(agents)}
+        shift_pos = {s['id']: i for i, s in enumerate(shifts)}
+        self.allowed = np.ones((A, D, S), dtype=bool)
+        for (agent_id, day), free in allowed.items():
+            if agent_id in agent_pos:
+                self.allowed[agent_pos[agent_id], day, :] = False
+                self.allowed[agent_pos[agent_id], day, [shift_pos[x] for x in free if x in shift_pos]] = True
+        _, fixed, _ = exception_masks(agents, shifts, exceptions, start_date, horizon_days)
+        self.fixed = (fixed & self.allowed).any(axis=2)
+        self.can_chat = np.array(['chat' in roles_for_skill(a['channel_skill']) for a in agents], dtype=bool)
+        self.can_email = np.array(['email' in roles_for_skill(a['channel_skill']) for a in agents], dtype=bool)
+        self.flex = self.can_chat & self.can_email
+        self.weight = np.array([1 + NIGHT_ALPHA * previous_metrics.get(a['id'], {}).get('nights', 0) for a in agents], dtype=np.int64)
+        self.night = np.array([s['name'].lower().startswith('night') for s in shifts], dtype=bool)
+        self.conflict = next_day_conflicts(shifts, start_date) if S else np.zeros((0, 0), dtype=bool)
+        reqs = {int(k): v for k, v in (per_shift_requirements or {}).items()}
+        # slots per shift (chat_min, email_min, the rest of total) and the
+        # three floors the model scores shortfall against
+        demand = np.zeros((3, S), dtype=np.int64)
+        self.floors = np.zeros((3, S), dtype=np.int64)
+        for i, s in enumerate(shifts):
+            req = reqs.get(s['id'], {})
+            chat_min = req.get('chat_min', 0) or 0
+            email_min = req.get('email_min', 0) or 0
+            total = req.get('total', None)
+            demand[:, i] = (chat_min, email_min, max(0, total - chat_min - email_min) if total is not None else 0)
+            self.floors[:, i] = (chat_min, email_min, total if total is not None else 0)
+        self.demand = demand
+        # fixed shift days are placed up front (role settled per day below)
+        a, d = np.nonzero(self.fixed)
+        s = np.argmax(fixed & self.allowed, axis=2)[a, d]
+        self.codes[a, d] = s * 2 + np.where(self.can_chat[a], CHAT, EMAIL)
+        self.day_unmet = np.zeros(D, dtype=np.int64)
+        self.day_nights = np.zeros(D, dtype=np.int64)
+
+    def eligible(self, d: int) -> np.ndarray:
+        # (agent, shift) pairs open on day d given the days either side
+        ok = self.allowed[:, d, :].copy()
+        if d > 0:
+            prev = self.codes[:, d - 1]
+            on = prev >= 0
+            ok[on] &= ~self.conflict[prev[on] >> 1, :]
+        if d < self.D - 1:
+            nxt = self.codes[:, d + 1]
+            on = nxt >= 0
+            ok[on] &= ~self.conflict[:, nxt[on] >> 1].T
+        return ok
+
+    def cost(self, d: int) -> int:
+        return int(self.day_unmet[d]) * COVERAGE_PENALTY + int(self.day_nights[d])
+
+    def _role(self, a: int, k: int) -> int:
+        return k if k != EXTRA else (CHAT if self.can_chat[a] else EMAIL)
+
+    def _swap_nights(self, d: int, ok: np.ndarray, kind: np.ndarray, skill):
+        # coverage-neutral moves: a night slot goes to a cheaper agent who is
+        # free, or who can trade slots with the agent on it
+        if not self.night.any():
+            return
+        codes = self.codes[:, d]
+        for a in sorted(np.flatnonzero((codes >= 0) & ~self.fixed[:, d] & self.night[np.maximum(codes, 0) >> 1]),
+                        key=lambda a: -self.weight[a]):
+            s, k = codes[a] >> 1, kind[a]
+            cheaper = ok[:, s] & skill[k] & (self.weight < self.weight[a]) & ~self.fixed[:, d]
+            free = np.flatnonzero(cheaper & (codes == OFF))
+            if len(free):
+                b = free[np.argmin(self.weight[free])]
+                codes[b], kind[b] = s * 2 + self._role(b, k), k
+                codes[a], kind[a] = OFF, -1
+                continue
+            busy = np.flatnonzero(cheaper & (codes >= 0) & ~self.night[np.maximum(codes, 0) >> 1])
+            for b in busy[np.argsort(self.weight[busy])]:
+                s2, k2 = codes[b] >> 1, kind[b]
+                if ok[a, s2] and skill[k2][a]:
+                    codes[b], kind[b] = s * 2 + self._role(b, k), k
+                    codes[a], kind[a] = s2 * 2 + self._role(a, k2), k2
+                    break
+
+    def solve_day(self, d: int, rng: random.Random = None):
+        codes = self.codes[:, d]
+        codes[~self.fixed[:, d]] = OFF
+        ok = self.eligible(d)
+        need = self.demand.copy()
+        kind = np.full(self.A, -1, dtype=np.int64)
+        # fixed agents take a slot of their shift first, in the channel that
+        # still needs them most
+        for a in np.flatnonzero(self.fixed[:, d]):
+            s = codes[a] >> 1
+            if self.can_chat[a] and need[CHAT, s] > 0 and (not self.can_email[a] or need[CHAT, s] >= need[EMAIL, s]):
+                k = CHAT
+            elif self.can_email[a] and need[EMAIL, s] > 0:
+                k = EMAIL
+            else:
+                k = EXTRA
+            need[k, s] = max(0, need[k, s] - 1)
+            kind[a] = k
+            codes[a] = s * 2 + self._role(a, k)
+        free = codes == OFF
+        skill = (self.can_chat, self.can_email, np.ones(self.A, dtype=bool))
+        noise = np.array([rng.random() for _ in range(self.A)]) if rng is not None else np.zeros(self.A)
+        groups = [(k, s) for s in range(self.S) for k in (CHAT, EMAIL, EXTRA) if need[k, s] > 0]
+        # scarce groups first; specialists before flex agents; nights go to
+        # the lowest night weights, other shifts keep those agents free
+        groups.sort(key=lambda g: int((ok[:, g[1]] & skill[g[0]] & free).sum()) - need[g])
+        missing = []
+        for k, s in groups:
+            cand = np.flatnonzero(ok[:, s] & skill[k] & free)
+            n = min(int(need[k, s]), len(cand))
+            if n:
+                w = self.weight[cand] if self.night[s] else -self.weight[cand]
+                order = np.lexsort((noise[cand], w, self.flex[cand]))[:n]
+                picked = cand[order]
+                codes[picked] = s * 2 + (k if k != EXTRA else np.where(self.can_chat[picked], CHAT, EMAIL))
+                kind[picked] = k
+                free[picked] = False
+            missing += [(k, s)] * (int(need[k, s]) - n)
+        # one augmenting step per open slot: an assigned agent who could take
+        # it moves over if a free agent can take the agent's old slot
+        for k, s in missing:
+            for b in np.flatnonzero(~free & ~self.fixed[:, d] & ok[:, s] & skill[k]):
+                s2, k2 = codes[b] >> 1, kind[b]
+                if s2 == s and k2 == k:
+                    continue
+                c = np.flatnonzero(free & ok[:, s2] & skill[k2])
+                if len(c):
+                    c = c[np.argmin(self.weight[c] if self.night[s2] else -self.weight[c])]
+                    codes[c] = s2 * 2 + self._role(c, k2)
+                    kind[c] = k2
+                    free[c] = False
+                    codes[b] = s * 2 + self._role(b, k)
+                    kind[b] = k
+                    break
+        self._swap_nights(d, ok, kind, skill)
+        on = codes >= 0
+        served = np.bincount(codes[on], minlength=2 * self.S).reshape(self.S, 2)
+        self.day_unmet[d] = int(np.maximum(0, self.floors[CHAT] - served[:, CHAT]).sum()
+                                + np.maximum(0, self.floors[EMAIL] - served[:, EMAIL]).sum()
+                                + np.maximum(0, self.floors[EXTRA] - served.sum(axis=1)).sum())
+        self.day_nights[d] = int(self.weight[on & self.night[np.maximum(codes, 0) >> 1]].sum()) if self.S else 0
+
+def build_schedule_heuristic(project_id: int,
+                             start_date: date,
+                             horizon_days: int,
+                             agents: List[Dict[str,Any]],
+                             shifts: List[Dict[str,Any]],
+                             exceptions: List[Dict[str,Any]],
+                             per_shift_requirements: Dict[int, Dict[str,Any]],
+                             previous_metrics: Dict[int, Dict[str,int]] = None,
+                             time_limit: float = None,
+                             allowed: Dict[Tuple[int,int], set] = None,
+                             boundary_assignments: List[Dict[str,Any]] = None,
+                             should_stop: Callable[[], bool] = None,
+                             seed: int = 0) -> Dict[str,Any]:
+    # returns {'matrix': ScheduleMatrix, 'metrics': ...}; the search runs
+    # until time_limit or until max_stall rebuilds in a row found nothing
+    started = perf_counter()
+    previous_metrics = previous_metrics or {}
+    time_limit = HEURISTIC_TIME_LIMIT if time_limit is None else time_limit
+    if allowed is None:
+        allowed = availability(agents, shifts, exceptions, start_date, horizon_days, boundary_assignments=boundary_assignments)
+    draft = _Draft(agents, shifts, exceptions, per_shift_requirements, previous_metrics, start_date, horizon_days, allowed)
+    build_time = perf_counter() - started
+
+    for d in range(horizon_days):
+        draft.solve_day(d)
+    greedy_time = perf_counter() - started
+    greedy_cost = sum(draft.cost(d) for d in range(horizon_days))
+
+    # LNS: rebuild one day (or a day and the next) with noisy tie-breaks,
+    # against the fixed neighbours; days with open slots are picked more often
+    rng = random.Random(seed)
+    deadline = started + time_limit
+    iterations = improvements = stall = 0
+    max_stall = max(30, 4 * horizon_days)
+    while horizon_days and perf_counter() < deadline and stall < max_stall:
+        if should_stop is not None and should_stop():
+            break
+        short = np.flatnonzero(draft.day_unmet)
+        d = int(rng.choice(short)) if len(short) and rng.random() < 0.5 else rng.randrange(horizon_days)
+        days = [d, d + 1] if d + 1 < horizon_days and rng.random() < 0.3 else [d]
+        saved = draft.codes[:, days].copy()
+        saved_unmet, saved_nights = draft.day_unmet[days].copy(), draft.day_nights[days].copy()
+        before = sum(draft.cost(x) for x in days)
+        for x in days[1:]:
+            draft.codes[~draft.fixed[:, x], x] = OFF
+        for x in days:
+            draft.solve_day(x, rng)
+        after = sum(draft.cost(x) for x in days)
+        iterations += 1
+        if after < before:
+            improvements += 1
+            stall = 0
+        else:
+            stall += 1
+            if after > before:
+                draft.codes[:, days] = saved
+                draft.day_unmet[days], draft.day_nights[days] = saved_unmet, saved_nights
+    solve_time = perf_counter() - started - build_time
+
+    matrix = ScheduleMatrix(start_date, [a['id'] for a in agents], [s['id'] for s in shifts], draft.codes)
+    ev = evaluate(matrix, agents, shifts, exceptions, per_shift_requirements, start_date, horizon_days, previous_metrics,
+                  boundary_assignments)
+    metrics = {'status': 'FEASIBLE' if ev['valid'] else 'INFEASIBLE', 'objective': ev['objective'],
+               'build_time': round(build_time, 4), 'solve_time': round(solve_time, 4),
+               'first_solution_time': round(greedy_time - build_time, 4), 'greedy_objective': greedy_cost,
+               'lns_iterations': iterations, 'lns_improvements': improvements, 'shortfall': ev['shortfall'],
+               'time_limit': time_limit, 'mode': 'heuristic'}
+    if not ev['valid']:
+        metrics['violations'] = {k: n for k, n in ev['violations'].items() if n}
+    return {'matrix': matrix, 'metrics': metrics}
@@ -1,10 +1,14 @@
-from fastapi import FastAPI, Depends, HTTPException, UploadFile, File
+from fastapi import FastAPI, Depends, HTTPException, UploadFile, File, Query
+from fastapi.responses import StreamingResponse, Response, FileResponse
 from fastapi.middleware.cors import CORSMiddleware
+from starlette.concurrency import run_in_threadpool
 from sqlalchemy.orm import Session
-from . import db, models, schemas, crud
-from .tasks import run_schedule_task, celery_app
-from datetime import date
-import csv, io
+from . import db, models, schemas, crud, metrics, export, evaluator, scheduler_engine
+from .cache import reference_cache, canonical_hash
+from .tasks import run_schedule_task, run_batch_task, run_repair_task, celery_app, load_solver_input
+from datetime import date, timedelta
+from typing import List, Optional
+import csv, io, json, re, time
 
 app = FastAPI(title="Scheduler API")
 
@@ -17,23 +21,82 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+class MetricsMiddleware:
+    # request duration and DB query count per route template; pure ASGI so
+    # streamed bodies are included (the response ends with the last chunk)
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] == "/metrics":
+            return await self.app(scope, receive, send)
+        started = time.perf_counter()
+        status = [500]
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+            await send(message)
+
+        with metrics.count_queries() as queries:
+            try:
+                await self.app(scope, receive, send_wrapper)
+            finally:
+                route = route_template(scope)
+                metrics.HTTP_SECONDS.observe(time.perf_counter() - started, method=scope["method"], route=route, status=status[0])
+                metrics.HTTP_DB_QUERIES.observe(queries[0], route=route)
+
+def route_template(scope) -> str:
+    from starlette.routing import Match
+    for r in app.router.routes:
+        if r.matches(scope)[0] == Match.FULL:
+            return getattr(r, "path", "unmatched")
+    return "unmatched"
+
+app.add_middleware(MetricsMiddleware)
+metrics.instrument_engine(db.engine)
+
+@app.get("/metrics")
+def get_metrics():
+    return Response(metrics.render(), media_type=metrics.CONTENT_TYPE)
+
 @app.on_event("startup")
 def on_startup():
     models.Base.metadata.create_all(bind=db.engine)
+    if db.ASYNC_READS:
+        metrics.instrument_engine(db.get_async_engine().sync_engine)
 
 def get_db_session():
     yield from db.get_db()
 
+async def get_async_db_session():
+    async for s in db.get_async_db():
+        yield s
+
+# The read-heavy endpoints (projects, agents, shifts, schedules) have an async
+# variant on the async engine, so a burst of reads waits on the database
+# instead of on threadpool slots. SCHEDULER_ASYNC_READS=0 keeps the sync
+# handlers.
+def read_route(path: str):
+    def register(sync_handler, async_handler):
+        app.get(path)(async_handler if db.ASYNC_READS else sync_handler)
+    return register
+
 @app.post("/projects")
 def create_project(p: schemas.ProjectCreate, db_s: Session = Depends(get_db_session)):
     proj = crud.create_project(db_s, p)
     return {"id": proj.id, "name": proj.name}
 
-@app.get("/projects")
 def list_projects(db_s: Session = Depends(get_db_session)):
     projs = crud.list_projects(db_s)
     return [{"id": p.id, "name": p.name} for p in projs]
 
+async def list_projects_async(db_s = Depends(get_async_db_session)):
+    projs = await crud.list_projects_async(db_s)
+    return [{"id": p.id, "name": p.name} for p in projs]
+
+read_route("/projects")(list_projects, list_projects_async)
+
 @app.post("/projects/{project_id}/shifts")
 def add_shift(project_id: int, s: schemas.ShiftCreate, db_s: Session = Depends(get_db_session)):
     proj = crud.get_project(db_s, project_id)
@@ -41,12 +104,65 @@ def add_shift(project_id: int, s: schemas.ShiftCreate, db_s: Session = Depends(g
     sh = crud.create_shift(db_s, project_id, s)
     return {"id": sh.id, "name": sh.name}
 
-@app.get("/projects/{project_id}/shifts")
+def shift_out(s):
+    return {"id": s.id, "name": s.name, "start_time": s.start_time.strftime("%H:%M"), "end_time": s.end_time.strftime("%H:%M"), "crosses_midnight": s.crosses_midnight}
+
+def agent_out(a):
+    return {"id": a.id, "name": a.name, "channel_skill": a.channel_skill}
+
+# per-project reference data through reference_cache; crud writes bump the
+# project version, so a hit is never stale
+def project_shifts(db_s: Session, project_id: int):
+    return reference_cache.get_or_load(project_id, "shifts", lambda: [shift_out(s) for s in crud.get_shifts(db_s, project_id)])
+
+# schedules may name agents a repair has since removed, so their lookup
+# tables take inactive agents too; the roster endpoints do not
+def project_agents(db_s: Session, project_id: int, include_inactive: bool = False):
+    name = "agents_all" if include_inactive else "agents"
+    return reference_cache.get_or_load(project_id, name, lambda: [agent_out(a) for a in crud.list_agents(db_s, project_id, include_inactive)])
+
+# reference_cache may do blocking Redis I/O, so the async handlers reach it
+# through the threadpool rather than on the event loop
+async def cache_get(project_id: int, name: str):
+    return await run_in_threadpool(reference_cache.get, project_id, name)
+
+async def cache_set(project_id: int, name: str, value):
+    return await run_in_threadpool(reference_cache.set, project_id, name, value)
+
+async def project_shifts_async(db_s, project_id: int):
+    shifts = await cache_get(project_id, "shifts")
+    if shifts is None:
+        shifts = [shift_out(s) for s in await crud.get_shifts_async(db_s, project_id)]
+        await cache_set(project_id, "shifts", shifts)
+    return shifts
+
+async def project_agents_async(db_s, project_id: int, include_inactive: bool = False):
+    name = "agents_all" if include_inactive else "agents"
+    agents = await cache_get(project_id, name)
+    if agents is None:
+        agents = [agent_out(a) for a in await crud.list_agents_async(db_s, project_id, include_inactive)]
+        await cache_set(project_id, name, agents)
+    return agents
+
 def get_shifts(project_id: int, db_s: Session = Depends(get_db_session)):
-    proj = crud.get_project(db_s, project_id)
-    if not proj: raise HTTPException(404, "project not found")
-    shifts = crud.get_shifts(db_s, project_id)
-    return [{"id": s.id, "name": s.name, "start_time": s.start_time.strftime("%H:%M"), "end_time": s.end_time.strftime("%H:%M"), "crosses_midnight": s.crosses_midnight} for s in shifts]
+    shifts = reference_cache.get(project_id, "shifts")
+    if shifts is None:
+        proj = crud.get_project(db_s, project_id)
+        if not proj: raise HTTPException(404, "project not found")
+        shifts = [shift_out(s) for s in crud.get_shifts(db_s, project_id)]
+        reference_cache.set(project_id, "shifts", shifts)
+    return shifts
+
+async def get_shifts_async(project_id: int, db_s = Depends(get_async_db_session)):
+    shifts = await cache_get(project_id, "shifts")
+    if shifts is None:
+        proj = await crud.get_project_async(db_s, project_id)
+        if not proj: raise HTTPException(404, "project not found")
+        shifts = [shift_out(s) for s in await crud.get_shifts_async(db_s, project_id)]
+        await cache_set(project_id, "shifts", shifts)
+    return shifts
+
+read_route("/projects/{project_id}/shifts")(get_shifts, get_shifts_async)
 
 @app.post("/projects/{project_id}/agents")
 def add_agent(project_id: int, a: schemas.AgentCreate, db_s: Session = Depends(get_db_session)):
@@ -55,47 +171,66 @@ def add_agent(project_id: int, a: schemas.AgentCreate, db_s: Session = Depends(g
     ag = crud.create_agent(db_s, project_id, a)
     return {"id": ag.id, "name": ag.name}
 
-@app.get("/projects/{project_id}/agents")
 def list_agents(project_id: int, db_s: Session = Depends(get_db_session)):
-    return [ { "id": ag.id, "name": ag.name, "channel_skill": ag.channel_skill } for ag in crud.list_agents(db_s, project_id) ]
+    return project_agents(db_s, project_id)
 
-@app.post("/projects/{project_id}/agents/bulk_upload")
-async def bulk_upload_agents(project_id: int, file: UploadFile = File(...), db_s: Session = Depends(get_db_session)):
-    proj = crud.get_project(db_s, project_id)
-    if not proj:
-        raise HTTPException(404, "project not found")
-    contents = await file.read()
-    s = contents.decode('utf-8')
-    reader = csv.DictReader(io.StringIO(s))
-    created = []
-    for row in reader:
-        name = row.get('name') or row.get('Name')
+async def list_agents_async(project_id: int, db_s = Depends(get_async_db_session)):
+    return await project_agents_async(db_s, project_id)
+
+read_route("/projects/{project_id}/agents")(list_agents, list_agents_async)
+
+def parse_agent_csv(text: str, shift_ids: set):
+    agents, exceptions, errors = [], [], []
+    reader = csv.DictReader(io.StringIO(text))
+    for line, row in enumerate(reader, start=2):
+        name = (row.get('name') or row.get('Name') or '').strip()
+        if not name:
+            errors.append({"line": line, "error": "missing name"})
+            continue
         email = row.get('email') or row.get('Email') or None
         skill = (row.get('channel_skill') or row.get('channel') or 'both').strip().lower()
         if skill not in ('chat','email','both'):
             skill = 'both'
-        ag = crud.create_agent(db_s, project_id, type("A", (), {"name": name, "email": email, "channel_skill": skill}))
-        created.append({"id": ag.id, "name": ag.name})
+        idx = len(agents)
+        agents.append({"name": name, "email": email, "channel_skill": skill})
         fos = row.get('fixed_off_start') or row.get('fixed_off')
         foe = row.get('fixed_off_end')
         if fos and foe:
             try:
                 start = date.fromisoformat(fos.strip()); end = date.fromisoformat(foe.strip())
-                ex = type("E", (), {"agent_id": ag.id, "type": "fixed_off", "start_date": start, "end_date": end, "shift_id": None})
-                crud.add_exception(db_s, ex)
-            except:
-                pass
+                if end < start: raise ValueError("end before start")
+                exceptions.append({"agent_index": idx, "type": "fixed_off", "start_date": start, "end_date": end, "shift_id": None})
+            except ValueError as e:
+                errors.append({"line": line, "error": f"fixed_off: {e}"})
         fsid = row.get('fixed_shift_id')
         fs_start = row.get('fixed_shift_start')
         fs_end = row.get('fixed_shift_end')
         if fsid and fs_start and fs_end:
             try:
                 start = date.fromisoformat(fs_start.strip()); end = date.fromisoformat(fs_end.strip())
-                ex = type("E", (), {"agent_id": ag.id, "type": "fixed_shift", "start_date": start, "end_date": end, "shift_id": int(fsid)})
-                crud.add_exception(db_s, ex)
-            except:
-                pass
-    return {"created": created, "count": len(created)}
+                if end < start: raise ValueError("end before start")
+                if int(fsid) not in shift_ids: raise ValueError(f"unknown shift {fsid}")
+                exceptions.append({"agent_index": idx, "type": "fixed_shift", "start_date": start, "end_date": end, "shift_id": int(fsid)})
+            except ValueError as e:
+                errors.append({"line": line, "error": f"fixed_shift: {e}"})
+    return agents, exceptions, errors
+
+def import_agent_csv(db_s: Session, project_id: int, s: str):
+    proj = crud.get_project(db_s, project_id)
+    if not proj:
+        raise HTTPException(404, "project not found")
+    shift_ids = {sh.id for sh in crud.get_shifts(db_s, project_id)}
+    agents, exceptions, errors = parse_agent_csv(s, shift_ids)
+    ids = crud.bulk_create_agents(db_s, project_id, agents, exceptions)
+    created = [{"id": i, "name": a["name"]} for i, a in zip(ids, agents)]
+    return {"created": created, "count": len(created), "errors": errors}
+
+@app.post("/projects/{project_id}/agents/bulk_upload")
+async def bulk_upload_agents(project_id: int, file: UploadFile = File(...), db_s: Session = Depends(get_db_session)):
+    # async only to read the upload; the sync session and the cache bump run
+    # in the threadpool
+    contents = await file.read()
+    return await run_in_threadpool(import_agent_csv, db_s, project_id, contents.decode('utf-8'))
 
 @app.post("/exceptions")
 def add_exception(ex: schemas.ExceptionCreate, db_s: Session = Depends(get_db_session)):
@@ -107,14 +242,73 @@ def generate_schedule_async(project_id: int, g: schemas.GenerateScheduleReq, db_
     proj = crud.get_project(db_s, project_id)
     if not proj:
         raise HTTPException(404, "project not found")
+    if g.mode not in scheduler_engine.MODES:
+        raise HTTPException(400, "unknown mode")
+    if g.window_days and g.mode != "exact":
+        raise HTTPException(400, "rolling windows require exact mode")
     reqs = {}
     for p in g.per_shift_requirements:
         reqs[p.shift_id] = {"chat_min": p.chat_min, "email_min": p.email_min, "total": p.total}
-    job = run_schedule_task.apply_async(args=[project_id, g.start_date.isoformat(), g.horizon_days, reqs, g.solver_time_limit or 120])
+    job = run_schedule_task.apply_async(args=[project_id, g.start_date.isoformat(), g.horizon_days, reqs, g.solver_time_limit or 120], kwargs={"warm_start": g.warm_start, "mode": g.mode, "window_days": g.window_days, "window_overlap_days": g.window_overlap_days, "parallel_windows": g.parallel_windows, "stop_policy": g.stop_policy.dict() if g.stop_policy else None, "fail_fast": g.fail_fast, "dump_model": g.dump_model, "enqueued_at": time.time()})
+    return {"job_id": job.id}
+
+@app.post("/schedules/{schedule_id}/repair")
+def repair_schedule(schedule_id: int, r: schemas.RepairScheduleReq, db_s: Session = Depends(get_db_session)):
+    sch = crud.get_schedule(db_s, schedule_id)
+    if not sch:
+        raise HTTPException(404, "schedule not found")
+    ids = {e.agent_id for e in r.exceptions} | set(r.removed_agent_ids)
+    found = {a.id for a in db_s.query(models.Agent.id).filter(models.Agent.id.in_(ids), models.Agent.project_id == sch.project_id)}
+    missing = sorted(ids - found)
+    if missing:
+        raise HTTPException(404, f"agents not found in project: {missing}")
+    shift_ids = {s.id for s in crud.get_shifts(db_s, sch.project_id)}
+    for e in r.exceptions:
+        if e.type == "fixed_shift" and e.shift_id not in shift_ids:
+            raise HTTPException(400, f"fixed_shift exception for agent {e.agent_id}: unknown shift {e.shift_id}")
+    delta = {
+        "exceptions": [dict(e.dict(), start_date=e.start_date.isoformat(), end_date=e.end_date.isoformat()) for e in r.exceptions],
+        "removed_agent_ids": r.removed_agent_ids,
+        "per_shift_requirements": {p.shift_id: {"chat_min": p.chat_min, "email_min": p.email_min, "total": p.total} for p in r.per_shift_requirements} if r.per_shift_requirements else None,
+    }
+    job = run_repair_task.apply_async(args=[schedule_id, delta, r.solver_time_limit, r.change_weight], kwargs={"enqueued_at": time.time()})
     return {"job_id": job.id}
 
+@app.post("/schedules/batch")
+def generate_schedules_batch(b: schemas.BatchScheduleReq, db_s: Session = Depends(get_db_session)):
+    ids = {j.project_id for j in b.jobs}
+    found = {p.id for p in db_s.query(models.Project.id).filter(models.Project.id.in_(ids))}
+    missing = sorted(ids - found)
+    if missing:
+        raise HTTPException(404, f"projects not found: {missing}")
+    jobs = []
+    for j in b.jobs:
+        if j.mode not in scheduler_engine.MODES:
+            raise HTTPException(400, "unknown mode")
+        if j.window_days and j.mode != "exact":
+            raise HTTPException(400, "rolling windows require exact mode")
+        jobs.append({
+            "project_id": j.project_id,
+            "priority": j.priority,
+            "start_date": j.start_date.isoformat(),
+            "horizon_days": j.horizon_days,
+            "per_shift_requirements": {p.shift_id: {"chat_min": p.chat_min, "email_min": p.email_min, "total": p.total} for p in j.per_shift_requirements},
+            "solver_time_limit": j.solver_time_limit or 120,
+            "warm_start": j.warm_start,
+            "mode": j.mode,
+            "window_days": j.window_days,
+            "window_overlap_days": j.window_overlap_days,
+            "parallel_windows": j.parallel_windows,
+            "stop_policy": j.stop_policy.dict() if j.stop_policy else None,
+            "fail_fast": j.fail_fast,
+            "dump_model": j.dump_model,
+        })
+    job = run_batch_task.apply_async(args=[jobs, b.core_budget], kwargs={"enqueued_at": time.time()})
+    return {"job_id": job.id, "count": len(jobs)}
+
 from celery.result import AsyncResult
-from .tasks import celery_app
+from .tasks import celery_app, progress_channel, accept_key
+from .cache import get_redis
 
 @app.get("/jobs/{job_id}")
 def get_job_status(job_id: str):
@@ -127,37 +321,305 @@ def get_job_status(job_id: str):
         info = None
     return {"job_id": job_id, "status": status, "result": info}
 
-@app.get("/schedules/{schedule_id}")
-def get_schedule_full(schedule_id: int, db_s: Session = Depends(get_db_session)):
+@app.get("/jobs/{job_id}/events")
+def job_events(job_id: str):
+    # Server-sent events: every improving solution the worker publishes, then
+    # a final "done" event with the job result. Without Redis pub/sub this
+    # falls back to watching the Celery result backend server-side.
+    def events():
+        r = get_redis()
+        pubsub = None
+        if r is not None:
+            pubsub = r.pubsub(ignore_subscribe_messages=True)
+            pubsub.subscribe(progress_channel(job_id))
+        last_meta = None
+        try:
+            while True:
+                res = AsyncResult(job_id, app=celery_app)
+                if res.ready():
+                    info = res.result if res.successful() else {"status": "error", "message": str(res.result)}
+                    yield f"event: done\ndata: {json.dumps(info, default=str)}\n\n"
+                    return
+                if pubsub is not None:
+                    msg = pubsub.get_message(timeout=1.0)
+                    if msg is None:
+                        yield ": keep-alive\n\n"
+                        continue
+                    evt = json.loads(msg["data"])
+                    yield f"event: {evt['event']}\ndata: {json.dumps(evt['data'], default=str)}\n\n"
+                    if evt["event"] == "done":
+                        return
+                else:
+                    if res.state == "PROGRESS" and res.info != last_meta:
+                        last_meta = res.info
+                        yield f"event: progress\ndata: {json.dumps(res.info, default=str)}\n\n"
+                    time.sleep(1.0)
+        finally:
+            if pubsub is not None:
+                pubsub.close()
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.post("/jobs/{job_id}/accept")
+def accept_job(job_id: str):
+    # stop the solve at its current best solution; the worker persists it
+    r = get_redis()
+    if r is None:
+        raise HTTPException(503, "progress channel unavailable")
+    r.set(accept_key(job_id), "1", ex=3600)
+    return {"job_id": job_id, "accepted": True}
+
+@app.get("/schedules/{schedule_id}/coverage")
+def get_schedule_coverage(schedule_id: int, db_s: Session = Depends(get_db_session)):
     sch = crud.get_schedule(db_s, schedule_id)
     if not sch:
         raise HTTPException(404, "schedule not found")
-    shift_map = {s.id: s for s in db_s.query(models.Shift).filter(models.Shift.project_id == sch.project_id).all()}
-    agent_map = {a.id: a for a in db_s.query(models.Agent).filter(models.Agent.project_id == sch.project_id).all()}
-
-    enriched = []
-    for a in sch.assignments:
-        s = shift_map.get(a.shift_id)
-        ag = agent_map.get(a.agent_id)
-        enriched.append({
-            "date": a.date.isoformat(),
-            "shift_id": a.shift_id,
-            "shift_name": s.name if s else None,
-            "shift_start": s.start_time.strftime("%H:%M") if s else None,
-            "shift_end": s.end_time.strftime("%H:%M") if s else None,
-            "shift_crosses_midnight": s.crosses_midnight if s else False,
-            "agent_id": a.agent_id,
-            "agent_name": ag.name if ag else None,
-            "agent_skill": ag.channel_skill if ag else None,
-            "role": a.role
-        })
+    shifts = crud.get_shifts(db_s, sch.project_id)
+    assigned = {(c.date, c.shift_id): c for c in crud.get_coverage(db_s, schedule_id)}
+    reqs = (sch.generation_metadata or {}).get("per_shift_requirements") or {}
+    out = []
+    for day in range((sch.end_date - sch.start_date).days + 1):
+        d = sch.start_date + timedelta(days=day)
+        for s in shifts:
+            req = reqs.get(str(s.id)) or reqs.get(s.id)
+            c = assigned.get((d, s.id))
+            item = {
+                "date": d.isoformat(),
+                "shift_id": s.id,
+                "shift_name": s.name,
+                "assigned": {"chat": c.chat if c else 0, "email": c.email if c else 0, "both": c.both if c else 0, "total": c.total if c else 0}
+            }
+            if req:
+                required = {"chat": req.get("chat_min", 0), "email": req.get("email_min", 0)}
+                if req.get("total") is not None:
+                    required["total"] = req["total"]
+                item["required"] = required
+            out.append(item)
+    return out
+
+def validate_against(db_s: Session, sch, assignments, per_shift_reqs=None):
+    # checks rows against the project's current roster, exceptions and
+    # shifts with the vectorised evaluator; no model is built
+    horizon_days = (sch.end_date - sch.start_date).days + 1
+    inp = load_solver_input(db_s, sch.project_id, sch.start_date, horizon_days, warm_start=False)
+    if per_shift_reqs is None:
+        per_shift_reqs = (sch.generation_metadata or {}).get("per_shift_requirements") or {}
+    with metrics.STAGE_SECONDS.time(stage="validate", mode=""):
+        res = evaluator.evaluate(assignments, inp["agents"], inp["shifts"], inp["exceptions"], per_shift_reqs,
+                                 sch.start_date, horizon_days, inp["previous_metrics"])
+    return dict(res, schedule_id=sch.id)
+
+@app.get("/schedules/{schedule_id}/validate")
+def validate_schedule(schedule_id: int, db_s: Session = Depends(get_db_session)):
+    sch = crud.get_schedule(db_s, schedule_id)
+    if not sch:
+        raise HTTPException(404, "schedule not found")
+    rows = [{"date": r.date, "shift_id": r.shift_id, "agent_id": r.agent_id, "role": r.role}
+            for r in crud.iter_schedule_rows(db_s, schedule_id, enriched=False)]
+    return validate_against(db_s, sch, rows)
+
+@app.post("/schedules/{schedule_id}/validate")
+def validate_edited_schedule(schedule_id: int, v: schemas.ValidateScheduleReq, db_s: Session = Depends(get_db_session)):
+    # an edited version of the schedule, checked in the schedule's context
+    sch = crud.get_schedule(db_s, schedule_id)
+    if not sch:
+        raise HTTPException(404, "schedule not found")
+    reqs = {p.shift_id: {"chat_min": p.chat_min, "email_min": p.email_min, "total": p.total} for p in v.per_shift_requirements} if v.per_shift_requirements is not None else None
+    return validate_against(db_s, sch, [a.dict() for a in v.assignments], reqs)
+
+def enrich_row(r):
     return {
-        "schedule": {
-            "id": sch.id,
-            "project_id": sch.project_id,
-            "start_date": sch.start_date.isoformat(),
-            "end_date": sch.end_date.isoformat(),
-            "generation_metadata": sch.generation_metadata,
-            "assignments": enriched
-        }
+        "date": r.date.isoformat(),
+        "shift_id": r.shift_id,
+        "shift_name": r.shift_name,
+        "shift_start": r.start_time.strftime("%H:%M") if r.start_time else None,
+        "shift_end": r.end_time.strftime("%H:%M") if r.end_time else None,
+        "shift_crosses_midnight": r.crosses_midnight if r.crosses_midnight is not None else False,
+        "agent_id": r.agent_id,
+        "agent_name": r.agent_name,
+        "agent_skill": r.channel_skill,
+        "role": r.role
+    }
+
+def schedule_meta(sch):
+    return {
+        "id": sch.id,
+        "project_id": sch.project_id,
+        "start_date": sch.start_date.isoformat(),
+        "end_date": sch.end_date.isoformat(),
+        "generation_metadata": sch.generation_metadata,
     }
+
+class ColumnarBuilder:
+    # lookup tables once, then integer-indexed columns; dates are day offsets
+    # from the schedule start and roles index into "roles"
+    roles = ["chat", "email"]
+
+    def __init__(self, sch, shifts, agents):
+        self.sch = sch
+        self.shifts = shifts
+        self.agents = agents
+        self.shift_idx = {s["id"]: i for i, s in enumerate(shifts)}
+        self.agent_idx = {a["id"]: i for i, a in enumerate(agents)}
+        self.cols = {"day": [], "shift": [], "agent": [], "role": []}
+        self.last_id = None
+
+    def add(self, r):
+        self.cols["day"].append((r.date - self.sch.start_date).days)
+        self.cols["shift"].append(self.shift_idx.get(r.shift_id, -1))
+        self.cols["agent"].append(self.agent_idx.get(r.agent_id, -1))
+        self.cols["role"].append(self.roles.index(r.role) if r.role in self.roles else -1)
+        self.last_id = r.id
+
+    def body(self, limit):
+        return {
+            "shifts": self.shifts,
+            "agents": self.agents,
+            "roles": self.roles,
+            "columns": self.cols,
+            "next_cursor": self.last_id if limit and len(self.cols["day"]) == limit else None
+        }
+
+def page_body(enriched, last_id, limit):
+    out = {"assignments": enriched}
+    if limit:
+        out["next_cursor"] = last_id if len(enriched) == limit else None
+    return out
+
+# The enriched part of a schedule page (everything except the schedule row,
+# whose generation_metadata is still written after persist) is immutable for
+# a given schedule, format and filters, and only depends on the project's
+# reference data, so it is cached under the project version.
+def schedule_body_key(schedule_id: int, fmt: str, filters: dict) -> str:
+    return f"schedule:{schedule_id}:{fmt}:{canonical_hash(filters)}"
+
+def schedule_response(sch, fmt: str, body: dict):
+    if fmt == "columnar":
+        return dict({"schedule": schedule_meta(sch)}, **body)
+    return {"schedule": dict(schedule_meta(sch), **body)}
+
+def get_schedule_full(schedule_id: int,
+                      start: Optional[date] = None,
+                      end: Optional[date] = None,
+                      agent_id: Optional[List[int]] = Query(None),
+                      cursor: Optional[int] = None,
+                      limit: Optional[int] = Query(None, ge=1, le=50000),
+                      fmt: str = Query("json", alias="format", regex="^(json|ndjson|columnar)$"),
+                      db_s: Session = Depends(get_db_session)):
+    sch = crud.get_schedule(db_s, schedule_id)
+    if not sch:
+        raise HTTPException(404, "schedule not found")
+    filters = {"start": start, "end": end, "agent_ids": agent_id, "after_id": cursor, "limit": limit}
+
+    if fmt == "ndjson":
+        # header line with the schedule, then one assignment per line, read
+        # from a server-side cursor
+        def lines():
+            yield json.dumps({"schedule": schedule_meta(sch)}) + "\n"
+            with metrics.STAGE_SECONDS.time(stage="enrich", mode=fmt):
+                for r in crud.iter_schedule_rows(db_s, schedule_id, **filters):
+                    yield json.dumps(enrich_row(r)) + "\n"
+        return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+    key = schedule_body_key(schedule_id, fmt, filters)
+    body = reference_cache.get(sch.project_id, key)
+    if body is not None:
+        return schedule_response(sch, fmt, body)
+
+    if fmt == "columnar":
+        b = ColumnarBuilder(sch, project_shifts(db_s, sch.project_id), project_agents(db_s, sch.project_id, include_inactive=True))
+        with metrics.STAGE_SECONDS.time(stage="enrich", mode=fmt):
+            for r in crud.iter_schedule_rows(db_s, schedule_id, enriched=False, **filters):
+                b.add(r)
+        body = b.body(limit)
+    else:
+        enriched = []
+        last_id = None
+        with metrics.STAGE_SECONDS.time(stage="enrich", mode=fmt):
+            for r in crud.iter_schedule_rows(db_s, schedule_id, **filters):
+                enriched.append(enrich_row(r))
+                last_id = r.id
+        body = page_body(enriched, last_id, limit)
+    reference_cache.set(sch.project_id, key, body)
+    return schedule_response(sch, fmt, body)
+
+async def get_schedule_full_async(schedule_id: int,
+                                  start: Optional[date] = None,
+                                  end: Optional[date] = None,
+                                  agent_id: Optional[List[int]] = Query(None),
+                                  cursor: Optional[int] = None,
+                                  limit: Optional[int] = Query(None, ge=1, le=50000),
+                                  fmt: str = Query("json", alias="format", regex="^(json|ndjson|columnar)$"),
+                                  db_s = Depends(get_async_db_session)):
+    sch = await crud.get_schedule_async(db_s, schedule_id)
+    if not sch:
+        raise HTTPException(404, "schedule not found")
+    filters = {"start": start, "end": end, "agent_ids": agent_id, "after_id": cursor, "limit": limit}
+
+    if fmt == "ndjson":
+        async def lines():
+            yield json.dumps({"schedule": schedule_meta(sch)}) + "\n"
+            with metrics.STAGE_SECONDS.time(stage="enrich", mode=fmt):
+                async for r in await crud.stream_schedule_rows(db_s, schedule_id, **filters):
+                    yield json.dumps(enrich_row(r)) + "\n"
+        return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+    key = schedule_body_key(schedule_id, fmt, filters)
+    body = await cache_get(sch.project_id, key)
+    if body is not None:
+        return schedule_response(sch, fmt, body)
+
+    if fmt == "columnar":
+        b = ColumnarBuilder(sch, await project_shifts_async(db_s, sch.project_id), await project_agents_async(db_s, sch.project_id, include_inactive=True))
+        with metrics.STAGE_SECONDS.time(stage="enrich", mode=fmt):
+            async for r in await crud.stream_schedule_rows(db_s, schedule_id, enriched=False, **filters):
+                b.add(r)
+        body = b.body(limit)
+    else:
+        enriched = []
+        last_id = None
+        with metrics.STAGE_SECONDS.time(stage="enrich", mode=fmt):
+            async for r in await crud.stream_schedule_rows(db_s, schedule_id, **filters):
+                enriched.append(enrich_row(r))
+                last_id = r.id
+        body = page_body(enriched, last_id, limit)
+    await cache_set(sch.project_id, key, body)
+    return schedule_response(sch, fmt, body)
+
+read_route("/schedules/{schedule_id}")(get_schedule_full, get_schedule_full_async)
+
+@app.get("/schedules/{schedule_id}/export")
+def export_schedule(schedule_id: int,
+                    fmt: str = Query("csv", alias="format", regex="^(csv|xlsx|pdf)$"),
+                    start: Optional[date] = None,
+                    end: Optional[date] = None,
+                    agent_id: Optional[List[int]] = Query(None),
+                    db_s: Session = Depends(get_db_session)):
+    sch = crud.get_schedule(db_s, schedule_id)
+    if not sch:
+        raise HTTPException(404, "schedule not found")
+    try:
+        export.check_available(fmt)
+    except export.ExportUnavailable as e:
+        raise HTTPException(501, str(e))
+    proj = crud.get_project(db_s, sch.project_id)
+    project_name = proj.name if proj else ""
+    filters = {"start": start, "end": end, "agent_ids": sorted(agent_id) if agent_id else None}
+    # assignments are immutable; names come from the project's shifts and
+    # agents, so the reference-data version is part of the key
+    key = f"schedule_{schedule_id}_v{reference_cache.version(sch.project_id)}_{canonical_hash(filters)[:16]}"
+    filename = re.sub(r"[^A-Za-z0-9._-]+", "_", f"schedule_{project_name or 'project'}_{sch.start_date.isoformat()}.{fmt}")
+    headers = {"Content-Disposition": f'attachment; filename="{filename}"'}
+    path = export.cached_artifact(key, fmt)
+    export.EXPORTS.inc(format=fmt, result="hit" if path else "miss")
+    if path:
+        return FileResponse(path, media_type=export.FORMATS[fmt], headers=headers)
+
+    rows = crud.iter_schedule_rows(db_s, schedule_id, **filters)
+    if fmt == "csv":
+        return StreamingResponse(export.stream_csv(rows, project_name, key), media_type=export.FORMATS[fmt], headers=headers)
+    with metrics.STAGE_SECONDS.time(stage="export", mode=fmt):
+        if fmt == "xlsx":
+            path = export.write_xlsx(rows, project_name, key)
+        else:
+            path = export.write_pdf(rows, project_name, key, title=f"Schedule {sch.start_date.isoformat()} – {sch.end_date.isoformat()}")
+    return FileResponse(path, media_type=export.FORMATS[fmt], headers=headers)
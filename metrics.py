@@ -0,0 +1,199 @@
+import os, threading, time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Optional, Sequence, Tuple
+
+# Minimal Prometheus text-format metrics: counters, gauges and histograms
+# with labels, one registry per process. The API serves it on /metrics, the
+# Celery worker processes through a small HTTP exporter (start_exporter).
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labels_names = tuple(labels)
+        self._values: Dict[Tuple[str, ...], object] = {}
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def _key(self, labels: dict) -> Tuple[str, ...]:
+        return tuple(str(labels.get(n, "")) for n in self.labels_names)
+
+    def _fmt(self, key: Tuple[str, ...], extra: dict = None) -> str:
+        pairs = list(zip(self.labels_names, key)) + list((extra or {}).items())
+        if not pairs:
+            return ""
+        return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} {self.kind}"
+        with self._lock:
+            items = list(self._values.items())
+        for key, value in items:
+            yield from self._render_value(key, value)
+
+    def _render_value(self, key, value):
+        yield f"{self.name}{self._fmt(key)} {_num(value)}"
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        if value is None:
+            return
+        key = self._key(labels)
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * (len(self.buckets) + 1), 0.0))
+            counts[bisect_left(self.buckets, value)] += 1
+            self._values[key] = (counts, total + value)
+
+    @contextmanager
+    def time(self, **labels):
+        t = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - t, **labels)
+
+    def _render_value(self, key, value):
+        counts, total = value
+        running = 0
+        for bound, c in zip(self.buckets, counts):
+            running += c
+            yield f"{self.name}_bucket{self._fmt(key, {'le': _num(bound)})} {running}"
+        running += counts[-1]
+        yield f"{self.name}_bucket{self._fmt(key, {'le': '+Inf'})} {running}"
+        yield f"{self.name}_sum{self._fmt(key)} {_num(total)}"
+        yield f"{self.name}_count{self._fmt(key)} {running}"
+
+def _escape(v) -> str:
+    return str(v).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _num(v) -> str:
+    return repr(float(v)) if not float(v).is_integer() else str(int(v))
+
+REGISTRY = []
+
+def render() -> str:
+    return "\n".join(line for m in REGISTRY for line in m.render()) + "\n"
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+HTTP_SECONDS = Histogram("scheduler_http_request_seconds", "API request duration", ["method", "route", "status"])
+HTTP_DB_QUERIES = Histogram("scheduler_http_db_queries", "DB queries per API request", ["route"],
+                            buckets=(1, 2, 5, 10, 20, 50, 100, 500, 1000))
+STAGE_SECONDS = Histogram("scheduler_stage_seconds", "Time per pipeline stage", ["stage", "mode"])
+QUEUE_WAIT_SECONDS = Histogram("scheduler_queue_wait_seconds", "Time from enqueue to task start", ["task"])
+JOB_DB_QUERIES = Histogram("scheduler_job_db_queries", "DB queries per worker job", ["task"],
+                           buckets=(1, 2, 5, 10, 20, 50, 100, 500, 1000))
+SOLVER_STATUS = Counter("scheduler_solver_status_total", "Solver outcomes", ["status", "mode"])
+JOBS = Counter("scheduler_jobs_total", "Finished worker jobs", ["task", "outcome"])
+MODEL_VARS = Gauge("scheduler_model_vars", "Variables in the last built model", ["mode"])
+MODEL_CONSTRAINTS = Gauge("scheduler_model_constraints", "Constraints in the last built model", ["mode"])
+JOBS_RUNNING = Gauge("scheduler_jobs_running", "Jobs currently running in this process", ["task"])
+MODEL_TEMPLATE_LOOKUPS = Counter("scheduler_model_template_lookups_total", "Compiled model template cache lookups", ["result"])
+
+# DB query counting: a mutable counter in a context variable, bumped by an
+# engine event; whoever opens a scope (request middleware, task) reads it
+_query_count: ContextVar[Optional[list]] = ContextVar("scheduler_query_count", default=None)
+
+def _on_query(*args, **kwargs):
+    c = _query_count.get()
+    if c is not None:
+        c[0] += 1
+
+def instrument_engine(engine):
+    from sqlalchemy import event
+    if not event.contains(engine, "before_cursor_execute", _on_query):
+        event.listen(engine, "before_cursor_execute", _on_query)
+
+@contextmanager
+def count_queries():
+    counter = [0]
+    token = _query_count.set(counter)
+    try:
+        yield counter
+    finally:
+        _query_count.reset(token)
+
+def observe_solve(metrics: dict):
+    # engine metrics -> stage histograms, model size gauges and status counter
+    mode = metrics.get("mode") or "exact"
+    STAGE_SECONDS.observe(metrics.get("build_time"), stage="build", mode=mode)
+    STAGE_SECONDS.observe(metrics.get("solve_time"), stage="solve", mode=mode)
+    STAGE_SECONDS.observe(metrics.get("disaggregation_time"), stage="disaggregate", mode=mode)
+    if metrics.get("num_vars") is not None:
+        MODEL_VARS.set(metrics["num_vars"], mode=mode)
+    if metrics.get("num_constraints") is not None:
+        MODEL_CONSTRAINTS.set(metrics["num_constraints"], mode=mode)
+    SOLVER_STATUS.inc(status=metrics.get("status", "UNKNOWN"), mode=mode)
+    if metrics.get("template"):
+        MODEL_TEMPLATE_LOOKUPS.inc(result=metrics["template"])
+
+_exporter = None
+_exporter_pid = None
+
+def start_exporter(port: int = None, tries: int = 32):
+    # serves render() on the first free port from SCHEDULER_METRICS_PORT on;
+    # each prefork worker child gets its own port (a forked child does not
+    # inherit the parent's server thread, hence the pid check)
+    global _exporter, _exporter_pid
+    if _exporter is not None and _exporter_pid == os.getpid():
+        return _exporter.server_address[1]
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            body = render().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", CONTENT_TYPE)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    base = port or int(os.environ.get("SCHEDULER_METRICS_PORT", 9100))
+    for p in range(base, base + tries):
+        try:
+            _exporter = ThreadingHTTPServer(("0.0.0.0", p), Handler)
+        except OSError:
+            continue
+        _exporter_pid = os.getpid()
+        threading.Thread(target=_exporter.serve_forever, daemon=True).start()
+        return p
+    return None
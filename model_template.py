@@ -0,0 +1,282 @@
+import argparse, json, os, tempfile, threading, uuid
+import numpy as np
+from collections import OrderedDict
+from datetime import date, datetime
+from typing import Any, Dict, List, Tuple
+from google.protobuf import text_format
+from ortools.sat.python import cp_model
+from .schedule_matrix import ROLES
+
+# Compiled exact-mode models. Everything in build_schedule's model that only
+# depends on the roster (agent ids and skills), the shifts and the horizon is
+# built once: a variable for every agent/day/shift/role the agent's skills
+# allow, the one-shift-a-day rows, conflict cliques, night counters and the
+# coverage rows with their unmet variables. A job copies the template's proto
+# and patches in what is specific to it: exception and boundary fixings
+# become variable domains, fixed shifts, demand and presolve cuts become
+# constraint bounds, night weights and minimal-change terms objective
+# coefficients. Shift windows only depend on the time of day, so a template
+# serves every cycle of a project until its roster or shifts change.
+#
+# Templates are kept per process in an LRU of SCHEDULER_MODEL_TEMPLATES
+# entries (0 turns them off).
+#
+# Any solve can also be dumped (model proto with its hints, solver
+# parameters, job metadata) and replayed offline:
+#
+#   python -m app.model_template replay /tmp/scheduler_models/12_20261018T101500_ab12cd34 --log
+
+MODEL_TEMPLATES = int(os.environ.get("SCHEDULER_MODEL_TEMPLATES", 4))
+MODEL_DUMP_DIR = os.environ.get("SCHEDULER_MODEL_DUMP_DIR") or os.path.join(tempfile.gettempdir(), "scheduler_models")
+COVERAGE_KINDS = ('chat_min', 'email_min', 'total')
+
+class ModelTemplate:
+    def __init__(self, agents: List[Dict[str,Any]], shifts: List[Dict[str,Any]], horizon_days: int, cliques: List[List[Any]]):
+        from .scheduler_engine import COVERAGE_PENALTY, roles_for_skill
+        model = cp_model.CpModel()
+        A, D, S = len(agents), horizon_days, len(shifts)
+        self.agent_pos = {a['id']: i for i, a in enumerate(agents)}
+        self.shift_pos = {s['id']: i for i, s in enumerate(shifts)}
+        self.night = np.array([s['name'].lower().startswith('night') for s in shifts], dtype=bool)
+        # var[a, d, s, r]: proto index of the assignment variable, -1 where
+        # the agent's skills rule the role out
+        self.var = np.full((A, D, S, len(ROLES)), -1, dtype=np.int64)
+        self.day_rows = np.zeros((A, D), dtype=np.int64)
+        vs = []
+        for ai, a in enumerate(agents):
+            roles = [ROLES.index(r) for r in roles_for_skill(a['channel_skill'])]
+            for day in range(D):
+                first = len(vs)
+                for si, s in enumerate(shifts):
+                    for ri in roles:
+                        v = model.NewBoolVar(f"a{a['id']}_d{day}_s{s['id']}_r{ROLES[ri]}")
+                        self.var[ai, day, si, ri] = v.Index()
+                        vs.append(v)
+                self.day_rows[ai, day] = model.AddLinearConstraint(sum(vs[first:]), 0, 1).Index()
+        ai, day, si, ri = np.nonzero(self.var >= 0)
+        # (variable index, agent position, day, cell code), as build_schedule reads solutions back
+        self.cells = np.stack([self.var[ai, day, si, ri], ai, day, si * 2 + ri], axis=1)
+
+        # coverage rows sum(vars) + unmet >= floor, floor patched per job
+        self.unmet = np.zeros((D, S, len(COVERAGE_KINDS)), dtype=np.int64)
+        self.cover_rows = np.zeros((D, S, len(COVERAGE_KINDS)), dtype=np.int64)
+        self.cut_rows = np.zeros(D, dtype=np.int64)
+        for day in range(D):
+            day_unmet = []
+            for si, s in enumerate(shifts):
+                by_role = [[vs[i] for i in self.var[:, day, si, r] if i >= 0] for r in range(len(ROLES))]
+                for k, (kind, role_vars) in enumerate(zip(COVERAGE_KINDS, (by_role[0], by_role[1], by_role[0] + by_role[1]))):
+                    u = model.NewIntVar(0, A, f"unmet_{kind.split('_')[0]}_{day}_{s['id']}")
+                    self.unmet[day, si, k] = u.Index()
+                    self.cover_rows[day, si, k] = model.Add(sum(role_vars) + u >= 0).Index()
+                    day_unmet.append(u)
+            # presolve cut, lower bound patched per job
+            self.cut_rows[day] = model.Add(sum(day_unmet) >= 0).Index()
+
+        for clique in cliques:
+            keys = [(d, self.shift_pos[sid]) for d, sid in clique]
+            for ai in range(A):
+                members = [int(i) for d, si in keys for i in self.var[ai, d, si] if i >= 0]
+                if len(members) >= 2:
+                    model.AddAtMostOne([vs[i] for i in members])
+
+        self.nights = np.zeros(A, dtype=np.int64)
+        for ai, a in enumerate(agents):
+            nvar = model.NewIntVar(0, D, f"n_a{a['id']}")
+            self.nights[ai] = nvar.Index()
+            night_vars = [vs[i] for i in self.var[ai][:, self.night].ravel() if i >= 0]
+            if night_vars:
+                model.Add(nvar == sum(night_vars))
+            else:
+                model.Add(nvar == 0)
+
+        # objective: coverage penalties, then one night weight per agent
+        obj = model.Proto().objective
+        obj.vars.extend(self.unmet.ravel().tolist() + self.nights.tolist())
+        obj.coeffs.extend([COVERAGE_PENALTY] * self.unmet.size + [1] * A)
+        self.model = model
+        self.num_cliques = len(cliques)
+
+    def instantiate(self, agents: List[Dict[str,Any]], allowed: Dict[Tuple[int,int], set], exceptions: List[Dict[str,Any]],
+                    per_shift_requirements: Dict[int, Dict[str,Any]], short_days: Dict[int,int], previous_metrics: Dict[int, Dict[str,int]],
+                    start_date: date, hint_assignments: List[Dict[str,Any]] = None, baseline_assignments: List[Dict[str,Any]] = None,
+                    change_weight: int = 100) -> Dict[str,Any]:
+        from .scheduler_engine import NIGHT_ALPHA, exception_days, parse_date_obj
+        model = cp_model.CpModel()
+        proto = model.Proto()
+        proto.CopyFrom(self.model.Proto())
+        A, D, S, R = self.var.shape
+        variables, constraints = proto.variables, proto.constraints
+
+        # unavailable shifts are fixed to 0, not pruned as in _build_model:
+        # the variables stay in the proto and presolve drops them
+        blocked = np.zeros((A, D, S), dtype=bool)
+        for (agent_id, day), free in allowed.items():
+            ai = self.agent_pos.get(agent_id)
+            if ai is not None:
+                blocked[ai, day, :] = True
+                blocked[ai, day, [self.shift_pos[s] for s in free if s in self.shift_pos]] = False
+        fixed_zero = self.var[blocked]
+        fixed_zero = fixed_zero[fixed_zero >= 0]
+        for i in fixed_zero.tolist():
+            variables[i].domain[1] = 0
+        # a fixed_shift day has only the fixed shift left, which has to be worked
+        for ex in exceptions:
+            ai, si = self.agent_pos.get(ex['agent_id']), self.shift_pos.get(ex.get('shift_id'))
+            if ex['type'] != 'fixed_shift' or ai is None or si is None:
+                continue
+            for day in exception_days(ex, start_date, D):
+                if not blocked[ai, day, si]:
+                    constraints[int(self.day_rows[ai, day])].linear.domain[0] = 1
+
+        # demand: the row floors, and no slack where nothing is required
+        live_unmet = np.full(self.unmet.shape, -1, dtype=np.int64)
+        for si, sid in enumerate(self.shift_pos):
+            req = per_shift_requirements.get(sid, {})
+            for k, kind in enumerate(COVERAGE_KINDS):
+                floor = req.get(kind) or 0
+                for day in range(D):
+                    u = int(self.unmet[day, si, k])
+                    if floor > 0:
+                        constraints[int(self.cover_rows[day, si, k])].linear.domain[0] = floor
+                        live_unmet[day, si, k] = u
+                    else:
+                        variables[u].domain[1] = 0
+        for day, n in short_days.items():
+            constraints[int(self.cut_rows[day])].linear.domain[0] = n
+
+        obj = proto.objective
+        n_unmet = self.unmet.size
+        weights = [1 + NIGHT_ALPHA * previous_metrics.get(a['id'], {}).get('nights', 0) for a in agents]
+        del obj.coeffs[n_unmet:]
+        obj.coeffs.extend(weights)
+
+        def keys_to_vars(rows):
+            # (agent_id, day, shift_id, role) -> proto index, for the rows whose
+            # variable exists and is not fixed to 0
+            found = {}
+            for r in rows:
+                ai, si = self.agent_pos.get(r['agent_id']), self.shift_pos.get(r['shift_id'])
+                day = (parse_date_obj(r['date']) - start_date).days
+                if ai is None or si is None or not 0 <= day < D or r['role'] not in ROLES or blocked[ai, day, si]:
+                    continue
+                i = int(self.var[ai, day, si, ROLES.index(r['role'])])
+                if i >= 0:
+                    found[(r['agent_id'], day, r['shift_id'], r['role'])] = i
+            return found
+
+        live = self.cells[:, 0][~blocked[self.cells[:, 1], self.cells[:, 2], self.cells[:, 3] >> 1]]
+        baseline = None
+        if baseline_assignments is not None:
+            # change_weight * (1 - v) for baseline variables, change_weight * v for the rest
+            baseline = keys_to_vars(baseline_assignments)
+            obj.vars.extend(live.tolist())
+            in_baseline = set(baseline.values())
+            obj.coeffs.extend([-change_weight if i in in_baseline else change_weight for i in live.tolist()])
+            obj.offset = change_weight * len(baseline)
+
+        hinted = 0
+        if hint_assignments:
+            on = keys_to_vars(hint_assignments)
+            values = np.zeros(len(variables), dtype=np.int64)
+            values[list(on.values())] = 1
+            proto.solution_hint.vars.extend(live.tolist())
+            proto.solution_hint.values.extend(values[live].tolist())
+            # the coverage and night counters too, so a feasible hint is a
+            # complete first solution rather than a search direction
+            x = np.where(self.var >= 0, values[np.maximum(self.var, 0)], 0)
+            served = x.sum(axis=0)
+            served = np.stack([served[..., 0], served[..., 1], served.sum(axis=2)], axis=2)
+            floors = np.array([[per_shift_requirements.get(sid, {}).get(kind) or 0 for kind in COVERAGE_KINDS] for sid in self.shift_pos],
+                              dtype=np.int64).reshape(S, len(COVERAGE_KINDS))
+            unmet_hint = np.maximum(0, floors[None, :, :] - served)
+            proto.solution_hint.vars.extend(self.unmet.ravel().tolist() + self.nights.tolist())
+            proto.solution_hint.values.extend(unmet_hint.ravel().tolist() + x[:, :, self.night, :].sum(axis=(1, 2, 3)).tolist())
+            hinted = len(on)
+        # the proto keeps every variable of the template: num_vars and
+        # num_constraints are its real size, live_vars the variables not
+        # fixed to 0 (what CP-SAT is left with after presolve)
+        # unmet: (chat, email, total) proto indices per day/shift with demand, -1 for no row
+        return {'model': model, 'unmet': live_unmet[(live_unmet >= 0).any(axis=2)].tolist(), 'pruned': 0, 'fixed': len(fixed_zero),
+                'hinted': hinted, 'baseline': set(baseline) if baseline is not None else None, 'num_vars': len(variables),
+                'num_constraints': len(constraints), 'live_vars': len(live) + int((live_unmet >= 0).sum()) + A}
+
+_templates = OrderedDict()
+_templates_lock = threading.Lock()
+
+def template_key(agents: List[Dict[str,Any]], shifts: List[Dict[str,Any]], horizon_days: int) -> tuple:
+    return (tuple((a['id'], a['channel_skill']) for a in agents),
+            tuple((s['id'], s['name'].lower().startswith('night'), str(s['start_time']), str(s['end_time']), bool(s.get('crosses_midnight')))
+                  for s in shifts),
+            horizon_days)
+
+def get_template(agents: List[Dict[str,Any]], shifts: List[Dict[str,Any]], horizon_days: int, windows) -> Tuple[ModelTemplate, bool]:
+    # (template, True on a cache hit); two jobs missing on the same key at
+    # once both compile, the later one wins the slot
+    from .scheduler_engine import shift_conflict_cliques
+    key = template_key(agents, shifts, horizon_days)
+    with _templates_lock:
+        t = _templates.get(key)
+        if t is not None:
+            _templates.move_to_end(key)
+            return t, True
+    t = ModelTemplate(agents, shifts, horizon_days, shift_conflict_cliques(windows))
+    with _templates_lock:
+        _templates[key] = t
+        while len(_templates) > MODEL_TEMPLATES:
+            _templates.popitem(last=False)
+    return t, False
+
+def clear_templates():
+    with _templates_lock:
+        _templates.clear()
+
+def dump_model(model: cp_model.CpModel, solver: cp_model.CpSolver, meta: Dict[str,Any], directory: str = None) -> str:
+    # <stem>.model.pb (CpModelProto, hints included), <stem>.params.pbtxt
+    # (SatParameters) and <stem>.json; returns the stem
+    directory = directory or MODEL_DUMP_DIR
+    os.makedirs(directory, exist_ok=True)
+    stem = os.path.join(directory, f"{meta.get('project_id', 'x')}_{datetime.utcnow():%Y%m%dT%H%M%S}_{uuid.uuid4().hex[:8]}")
+    with open(stem + ".model.pb", "wb") as f:
+        f.write(model.Proto().SerializeToString())
+    with open(stem + ".params.pbtxt", "w") as f:
+        f.write(text_format.MessageToString(solver.parameters))
+    with open(stem + ".json", "w") as f:
+        json.dump(meta, f, default=str, indent=1)
+    return stem
+
+def replay(stem: str, time_limit: float = None, num_workers: int = None, log: bool = False) -> Dict[str,Any]:
+    model = cp_model.CpModel()
+    with open(stem + ".model.pb", "rb") as f:
+        model.Proto().ParseFromString(f.read())
+    solver = cp_model.CpSolver()
+    with open(stem + ".params.pbtxt") as f:
+        text_format.Parse(f.read(), solver.parameters)
+    if time_limit is not None:
+        solver.parameters.max_time_in_seconds = time_limit
+    if num_workers is not None:
+        solver.parameters.num_search_workers = num_workers
+    solver.parameters.log_search_progress = log
+    recorded = {}
+    if os.path.exists(stem + ".json"):
+        with open(stem + ".json") as f:
+            recorded = json.load(f)
+    status = solver.StatusName(solver.Solve(model))
+    solved = status in ('OPTIMAL', 'FEASIBLE')
+    return {'status': status, 'objective': solver.ObjectiveValue() if solved else None,
+            'bound': solver.BestObjectiveBound() if solved else None, 'wall_time': round(solver.WallTime(), 4),
+            'num_vars': len(model.Proto().variables), 'num_constraints': len(model.Proto().constraints),
+            'time_limit': solver.parameters.max_time_in_seconds, 'num_workers': solver.parameters.num_search_workers,
+            'recorded': recorded}
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    rp = sub.add_parser("replay", help="re-solve a dumped model")
+    rp.add_argument("stem", help="path of the dump without its .model.pb suffix")
+    rp.add_argument("--time-limit", type=float, default=None)
+    rp.add_argument("--workers", type=int, default=None)
+    rp.add_argument("--log", action="store_true", help="CP-SAT search log on stdout")
+    args = ap.parse_args()
+    stem = args.stem[:-len(".model.pb")] if args.stem.endswith(".model.pb") else args.stem
+    print(json.dumps(replay(stem, args.time_limit, args.workers, args.log), indent=2, default=str))
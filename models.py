@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Boolean, Date, DateTime, ForeignKey, Text, JSON, Time
+from sqlalchemy import Column, Integer, String, Boolean, Date, DateTime, ForeignKey, Text, JSON, Time, Index
 from sqlalchemy.orm import relationship
 from datetime import datetime
 from .db import Base
@@ -50,6 +50,7 @@ class Schedule(Base):
 
     project = relationship("Project", back_populates="schedules")
     assignments = relationship("ScheduleAssignment", back_populates="schedule", cascade="all,delete")
+    coverage = relationship("ScheduleCoverage", back_populates="schedule", cascade="all,delete")
 
 class ScheduleAssignment(Base):
     __tablename__ = "schedule_assignments"
@@ -64,6 +65,19 @@ class ScheduleAssignment(Base):
 
     schedule = relationship("Schedule", back_populates="assignments")
 
+class ScheduleCoverage(Base):
+    __tablename__ = "schedule_coverage"
+    id = Column(Integer, primary_key=True, index=True)
+    schedule_id = Column(Integer, ForeignKey("schedules.id", ondelete="CASCADE"), index=True)
+    date = Column(Date, nullable=False)
+    shift_id = Column(Integer, ForeignKey("shifts.id", ondelete="CASCADE"))
+    chat = Column(Integer, default=0)
+    email = Column(Integer, default=0)
+    both = Column(Integer, default=0)
+    total = Column(Integer, default=0)
+
+    schedule = relationship("Schedule", back_populates="coverage")
+
 class ExceptionRow(Base):
     __tablename__ = "exceptions"
     id = Column(Integer, primary_key=True, index=True)
@@ -74,3 +88,18 @@ class ExceptionRow(Base):
     shift_id = Column(Integer, nullable=True)
 
     agent = relationship("Agent", back_populates="exceptions")
+
+class FairnessLedger(Base):
+    # per agent and cycle: nights, weekend days and shifts worked, written with
+    # the schedule so fairness state never has to be recounted from assignments
+    __tablename__ = "fairness_ledger"
+    __table_args__ = (Index("ix_fairness_ledger_project_cycle_end", "project_id", "cycle_end"),)
+    id = Column(Integer, primary_key=True, index=True)
+    project_id = Column(Integer, ForeignKey("projects.id", ondelete="CASCADE"), nullable=False)
+    schedule_id = Column(Integer, ForeignKey("schedules.id", ondelete="CASCADE"), nullable=False)
+    agent_id = Column(Integer, ForeignKey("agents.id", ondelete="CASCADE"), nullable=False)
+    cycle_start = Column(Date, nullable=False)
+    cycle_end = Column(Date, nullable=False)
+    nights = Column(Integer, default=0)
+    weekends = Column(Integer, default=0)
+    shifts = Column(Integer, default=0)
@@ -0,0 +1,85 @@
+import base64
+import numpy as np
+from datetime import date, timedelta
+from typing import Any, Dict, Iterator, List, Sequence
+
+ROLES = ('chat', 'email')
+OFF = -1
+
+class ScheduleMatrix:
+    # Agent x day grid of int16 codes, OFF or shift_index * 2 + role_index.
+    # This is what the engine produces and persist_schedule consumes; rows of
+    # dicts are only built at the edges (API, rolling/repair glue).
+    __slots__ = ('start_date', 'agent_ids', 'shift_ids', 'codes')
+
+    def __init__(self, start_date: date, agent_ids: Sequence[int], shift_ids: Sequence[int], codes: np.ndarray = None):
+        self.start_date = start_date
+        self.agent_ids = np.asarray(agent_ids, dtype=np.int64)
+        self.shift_ids = np.asarray(shift_ids, dtype=np.int64)
+        self.codes = codes
+
+    @classmethod
+    def empty(cls, start_date: date, horizon_days: int, agent_ids: Sequence[int], shift_ids: Sequence[int]) -> 'ScheduleMatrix':
+        return cls(start_date, agent_ids, shift_ids, np.full((len(agent_ids), horizon_days), OFF, dtype=np.int16))
+
+    @classmethod
+    def from_rows(cls, rows: List[Dict[str,Any]], start_date: date, horizon_days: int,
+                  agent_ids: Sequence[int], shift_ids: Sequence[int]) -> 'ScheduleMatrix':
+        m = cls.empty(start_date, horizon_days, agent_ids, shift_ids)
+        agent_pos = {a: i for i, a in enumerate(agent_ids)}
+        shift_pos = {s: i for i, s in enumerate(shift_ids)}
+        for r in rows:
+            d = r['date']
+            day = ((date.fromisoformat(d) if isinstance(d, str) else d) - start_date).days
+            m.codes[agent_pos[r['agent_id']], day] = shift_pos[r['shift_id']] * 2 + ROLES.index(r['role'])
+        return m
+
+    @property
+    def horizon_days(self) -> int:
+        return self.codes.shape[1]
+
+    def __len__(self) -> int:
+        return int(np.count_nonzero(self.codes != OFF))
+
+    def _cells(self):
+        # assigned cells ordered by day, shift, agent position, role (the
+        # order build_schedule has always returned rows in)
+        agent_idx, day = np.nonzero(self.codes != OFF)
+        code = self.codes[agent_idx, day]
+        order = np.lexsort((code % 2, agent_idx, code // 2, day))
+        return agent_idx[order], day[order], code[order]
+
+    def iter_rows(self, iso: bool = True) -> Iterator[Dict[str,Any]]:
+        agent_idx, day, code = self._cells()
+        dates = [self.start_date + timedelta(days=d) for d in range(self.horizon_days)]
+        if iso:
+            dates = [d.isoformat() for d in dates]
+        agent_ids = self.agent_ids.tolist()
+        shift_ids = self.shift_ids.tolist()
+        for a, d, c in zip(agent_idx.tolist(), day.tolist(), code.tolist()):
+            yield {'date': dates[d], 'shift_id': shift_ids[c >> 1], 'agent_id': agent_ids[a], 'role': ROLES[c & 1]}
+
+    def to_rows(self, iso: bool = True) -> List[Dict[str,Any]]:
+        return list(self.iter_rows(iso))
+
+    def db_rows(self, schedule_id: int) -> List[Dict[str,Any]]:
+        # executemany parameters for schedule_assignments, with date objects
+        return [dict(r, schedule_id=schedule_id) for r in self.iter_rows(iso=False)]
+
+    def fairness_counts(self, night_shift_ids) -> Dict[int, List[int]]:
+        # agent_id -> [nights, weekend days, shifts], agents without shifts left out
+        worked = self.codes != OFF
+        night = np.isin(self.shift_ids, list(night_shift_ids))[np.maximum(self.codes, 0) >> 1] & worked
+        weekend = np.array([(self.start_date + timedelta(days=d)).weekday() >= 5 for d in range(self.horizon_days)], dtype=bool)
+        totals = np.stack([night.sum(axis=1), (worked & weekend[None, :]).sum(axis=1), worked.sum(axis=1)], axis=1)
+        return {a: t for a, t in zip(self.agent_ids.tolist(), totals.tolist()) if t[2]}
+
+    def to_payload(self) -> Dict[str,Any]:
+        # JSON-safe and compact: the code grid travels as base64 int16
+        return {'start_date': self.start_date.isoformat(), 'agent_ids': self.agent_ids.tolist(), 'shift_ids': self.shift_ids.tolist(),
+                'shape': list(self.codes.shape), 'codes': base64.b64encode(self.codes.astype('<i2').tobytes()).decode('ascii')}
+
+    @classmethod
+    def from_payload(cls, payload: Dict[str,Any]) -> 'ScheduleMatrix':
+        codes = np.frombuffer(base64.b64decode(payload['codes']), dtype='<i2').astype(np.int16).reshape(payload['shape'])
+        return cls(date.fromisoformat(payload['start_date']), payload['agent_ids'], payload['shift_ids'], codes)
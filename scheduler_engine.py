@@ -1,6 +1,18 @@
+import os, threading
 from ortools.sat.python import cp_model
 from datetime import datetime, date, time, timedelta
-from typing import List, Dict, Any, Tuple
+from typing import List, Dict, Any, Tuple, Callable
+from collections import Counter, defaultdict
+from time import perf_counter, monotonic
+import numpy as np
+from .schedule_matrix import ScheduleMatrix, ROLES
+from . import model_template
+
+# objective weights: every unmet coverage slot costs COVERAGE_PENALTY, every
+# night 1 + NIGHT_ALPHA * the agent's previous nights. The evaluator, the
+# heuristic and the model templates score with these too.
+COVERAGE_PENALTY = 10000
+NIGHT_ALPHA = 2
 
 def parse_time_obj(tobj):
     if isinstance(tobj, str):
@@ -8,6 +20,11 @@ def parse_time_obj(tobj):
         return time(h,m)
     return tobj
 
+def parse_date_obj(dobj):
+    if isinstance(dobj, str):
+        return date.fromisoformat(dobj)
+    return dobj
+
 def shift_window_for_date(d: date, shift: Dict[str,Any]) -> Tuple[datetime, datetime]:
     st = parse_time_obj(shift['start_time'])
     et = parse_time_obj(shift['end_time'])
@@ -17,133 +34,459 @@ def shift_window_for_date(d: date, shift: Dict[str,Any]) -> Tuple[datetime, date
         end_dt += timedelta(days=1)
     return start_dt, end_dt
 
-def build_schedule(project_id: int,
-                   start_date: date,
-                   horizon_days: int,
-                   agents: List[Dict[str,Any]],
-                   shifts: List[Dict[str,Any]],
-                   exceptions: List[Dict[str,Any]],
-                   per_shift_requirements: Dict[int, Dict[str,Any]],
-                   previous_metrics: Dict[int, Dict[str,int]] = None,
-                   solver_time_limit: int = 60) -> Dict[str,Any]:
-    if previous_metrics is None:
-        previous_metrics = {}
+def roles_for_skill(skill: str) -> List[str]:
+    if skill == 'chat': return ['chat']
+    if skill == 'email': return ['email']
+    return ['chat','email']
+
+def exception_days(ex: Dict[str,Any], start_date: date, horizon_days: int) -> range:
+    first = max(0, (parse_date_obj(ex['start_date']) - start_date).days)
+    last = min(horizon_days - 1, (parse_date_obj(ex['end_date']) - start_date).days)
+    return range(first, last + 1)
+
+def shift_windows(start_date: date, horizon_days: int, shifts: List[Dict[str,Any]]) -> Dict[Tuple[int,int], Tuple[datetime, datetime]]:
+    windows = {}
+    for day in range(horizon_days):
+        d = start_date + timedelta(days=day)
+        for s in shifts:
+            windows[(day, s['id'])] = shift_window_for_date(d, s)
+    return windows
+
+def shift_conflict_cliques(windows: Dict[Any, Tuple[datetime, datetime]]) -> List[List[Any]]:
+    # windows form an interval graph, so its maximal cliques fall out of a
+    # single sweep over the windows sorted by start time: the active set is a
+    # maximal clique whenever it is about to shrink after having grown
+    cliques = []
+    active = []
+    grew = False
+    for key, (st, ed) in sorted(windows.items(), key=lambda kv: kv[1]):
+        still_open = [k for k in active if windows[k][1] > st]
+        if len(still_open) < len(active):
+            if grew and len(active) > 1:
+                cliques.append(active)
+            grew = False
+        active = still_open + [key]
+        grew = True
+    if grew and len(active) > 1:
+        cliques.append(active)
+    return cliques
+
+def hint_from_previous(prev_assignments: List[Dict[str,Any]],
+                       prev_start: date,
+                       prev_end: date,
+                       start_date: date,
+                       horizon_days: int) -> List[Dict[str,Any]]:
+    # days the previous schedule already covers (rolling-horizon overlap) are
+    # hinted as-is; the rest are copied from the previous cycle shifted by whole
+    # weeks so weekday patterns stay aligned
+    by_date = defaultdict(list)
+    for a in prev_assignments:
+        by_date[parse_date_obj(a['date'])].append(a)
+    span = (prev_end - prev_start).days + 1
+    period = max(7, span - span % 7)
+    hint = []
+    for day in range(horizon_days):
+        d = start_date + timedelta(days=day)
+        src = d
+        if not (prev_start <= src <= prev_end):
+            src = prev_start + timedelta(days=(d - prev_start).days % period)
+        for a in by_date.get(src, []):
+            hint.append({'date': d, 'shift_id': a['shift_id'], 'agent_id': a['agent_id'], 'role': a['role']})
+    return hint
+
+def availability(agents: List[Dict[str,Any]],
+                 shifts: List[Dict[str,Any]],
+                 exceptions: List[Dict[str,Any]],
+                 start_date: date,
+                 horizon_days: int,
+                 windows: Dict[Tuple[int,int], Tuple[datetime, datetime]] = None,
+                 boundary_assignments: List[Dict[str,Any]] = None) -> Dict[Tuple[int,int], set]:
+    # shifts each agent can still take per day, only for the (agent, day)
+    # pairs that exceptions or boundary rows restrict; a fixed_off day (e.g. a
+    # sick call) overrides a fixed_shift on that day
+    shift_ids = {s['id'] for s in shifts}
+    allowed = {}
+    for ex in exceptions:
+        if ex['type'] != 'fixed_shift':
+            continue
+        for day in exception_days(ex, start_date, horizon_days):
+            allowed[(ex['agent_id'], day)] = {ex['shift_id']} & shift_ids
+    for ex in exceptions:
+        if ex['type'] != 'fixed_off':
+            continue
+        for day in exception_days(ex, start_date, horizon_days):
+            allowed[(ex['agent_id'], day)] = set()
+    # assignments just outside the horizon (a neighbouring window or schedule)
+    # rule out any shift of the same agent whose window overlaps theirs
+    if boundary_assignments:
+        windows = windows or shift_windows(start_date, horizon_days, shifts)
+        shift_by_id = {s['id']: s for s in shifts}
+        for b in boundary_assignments:
+            s = shift_by_id.get(b['shift_id'])
+            if s is None: continue
+            b_date = parse_date_obj(b['date'])
+            bst, bed = shift_window_for_date(b_date, s)
+            near = (b_date - start_date).days
+            for day in range(max(0, near - 2), min(horizon_days, near + 3)):
+                for sid in shift_ids:
+                    st, ed = windows[(day, sid)]
+                    if not (ed <= bst or bed <= st):
+                        allowed.setdefault((b['agent_id'], day), set(shift_ids)).discard(sid)
+    return allowed
+
+def presolve(agents: List[Dict[str,Any]],
+             shifts: List[Dict[str,Any]],
+             per_shift_requirements: Dict[int, Dict[str,Any]],
+             horizon_days: int,
+             allowed: Dict[Tuple[int,int], set],
+             start_date: date = None,
+             max_samples: int = 20) -> Dict[str,Any]:
+    # Analytic lower bound on the coverage shortfall, before any model is
+    # built. Per day/shift/channel it compares demand with the agents able
+    # to serve it; per day it matches demand units to available agents (one
+    # shift per agent and day), so demand that competes for the same agents
+    # is counted once. Slots are chat_min, email_min and the rest of `total`
+    # (any role). Unmatched slots are unavoidable whatever the solver does.
+    started = perf_counter()
+    shift_ids = [s['id'] for s in shifts]
+    all_shifts = set(shift_ids)
+    gaps = []
+    short_days = {}
+    for day in range(horizon_days):
+        free = {a['id']: allowed.get((a['id'], day), all_shifts) for a in agents}
+        slots = []
+        for sid in shift_ids:
+            req = per_shift_requirements.get(sid, {})
+            chat_min = req.get('chat_min', 0) or 0
+            email_min = req.get('email_min', 0) or 0
+            total = req.get('total', None)
+            extra = max(0, total - chat_min - email_min) if total is not None else 0
+            able = {'chat': [], 'email': [], None: []}
+            for a in agents:
+                if sid not in free[a['id']]:
+                    continue
+                able[None].append(a['id'])
+                for r in roles_for_skill(a['channel_skill']):
+                    able[r].append(a['id'])
+            for channel, need in (('chat', chat_min), ('email', email_min), ('total', max(total or 0, chat_min + email_min))):
+                have = len(able[None] if channel == 'total' else able[channel])
+                if need > have:
+                    gaps.append({'day': day, 'shift_id': sid, 'channel': channel, 'required': need, 'available': have})
+            slots += [able['chat']] * chat_min + [able['email']] * email_min + [able[None]] * extra
+        if not slots:
+            continue
+        # scarce slots first so the matching rarely has to backtrack
+        slots.sort(key=len)
+        matched = {}
+
+        def place(i, seen):
+            for a in slots[i]:
+                if a not in matched:
+                    matched[a] = i
+                    return True
+            for a in slots[i]:
+                if a in seen:
+                    continue
+                seen.add(a)
+                if place(matched[a], seen):
+                    matched[a] = i
+                    return True
+            return False
+
+        unmatched = sum(1 for i in range(len(slots)) if not place(i, set()))
+        if unmatched:
+            short_days[day] = unmatched
+    label = (lambda day: (start_date + timedelta(days=day)).isoformat()) if start_date else (lambda day: day)
+    return {'shortfall_lower_bound': sum(short_days.values()),
+            'short_days': {label(d): n for d, n in sorted(short_days.items())},
+            'capacity_gaps': len(gaps),
+            'capacity_gap_samples': [dict(g, day=label(g['day'])) for g in gaps[:max_samples]],
+            'time': round(perf_counter() - started, 4)}
+
+def default_num_workers() -> int:
+    env = os.environ.get("SCHEDULER_SOLVER_WORKERS")
+    if env:
+        return max(1, int(env))
+    return max(1, min(8, os.cpu_count() or 1))
 
+# Stop policy keys (all optional):
+#   relative_gap        stop once (objective - bound) / objective is below this;
+#                       off by default, since with any shortfall 1% of the
+#                       coverage penalty outweighs the whole night term
+#   stall_seconds       stop when no improving solution arrived for this long
+#   stop_when_covered   lexicographic mode: stop at the first solution with no
+#                       unmet demand, leaving the night weights as they are
+#   adaptive_time       cap the time limit by model size: min_time plus
+#                       seconds_per_1k_vars for every thousand variables
+DEFAULT_STOP_POLICY = {'relative_gap': None, 'stall_seconds': 15, 'stop_when_covered': False,
+                       'adaptive_time': True, 'min_time': 5, 'seconds_per_1k_vars': 2.0}
+
+def adaptive_time_limit(num_vars: int, solver_time_limit: float, stop_policy: Dict[str,Any]) -> float:
+    if not stop_policy or not stop_policy.get('adaptive_time'):
+        return solver_time_limit
+    budget = stop_policy.get('min_time', 5) + stop_policy.get('seconds_per_1k_vars', 2.0) * num_vars / 1000
+    return min(solver_time_limit, budget)
+
+def _configure_solver(model: cp_model.CpModel,
+                      solver_time_limit: float,
+                      num_workers: int = None,
+                      stop_policy: Dict[str,Any] = None,
+                      repair_hint: bool = False,
+                      num_vars: int = None) -> cp_model.CpSolver:
+    # num_vars: live model size for the adaptive time limit when the proto
+    # holds variables fixed to 0 (template models)
+    solver = cp_model.CpSolver()
+    solver.parameters.max_time_in_seconds = adaptive_time_limit(num_vars or len(model.Proto().variables), solver_time_limit, stop_policy)
+    solver.parameters.num_search_workers = num_workers or default_num_workers()
+    if stop_policy and stop_policy.get('relative_gap'):
+        solver.parameters.relative_gap_limit = stop_policy['relative_gap']
+    if repair_hint:
+        solver.parameters.repair_hint = True
+    return solver
+
+def slot_shortfall(value: Callable[[Any], int], unmet_vars: List[Tuple[Any,Any,Any]]) -> int:
+    # Demand slots a solution leaves open, in presolve's units. unmet_vars
+    # holds the (chat, email, total) unmet variables of each day/shift, None
+    # where there is no such row. A missing chat agent shows up in both the
+    # chat and the total row, so summing the rows would count it twice; the
+    # total row only adds what is short beyond the channel minimums.
+    n = 0
+    for c, e, t in unmet_vars:
+        vc = value(c) if c is not None else 0
+        ve = value(e) if e is not None else 0
+        n += vc + ve + (max(0, value(t) - vc - ve) if t is not None else 0)
+    return n
+
+class _ProgressCallback(cp_model.CpSolverSolutionCallback):
+    def __init__(self, on_progress: Callable[[Dict[str,Any]], None] = None, unmet_vars: List[Tuple[Any,Any,Any]] = None,
+                 unmet_floor: int = 0):
+        super().__init__()
+        self.on_progress = on_progress
+        self.unmet_vars = unmet_vars
+        self.unmet_floor = unmet_floor
+        self.first_solution_time = None
+        self.last_improvement = None
+        self.solutions = 0
+        self.stopped_early = False
+        self.stop_reason = None
+
+    def on_solution_callback(self):
+        if self.first_solution_time is None:
+            self.first_solution_time = self.WallTime()
+        self.last_improvement = monotonic()
+        self.solutions += 1
+        if self.on_progress is not None:
+            obj = self.ObjectiveValue()
+            bound = self.BestObjectiveBound()
+            self.on_progress({'objective': obj, 'bound': bound, 'gap': abs(obj - bound) / max(1.0, abs(obj)),
+                              'elapsed': round(self.WallTime(), 3), 'solutions': self.solutions})
+        # covered as far as possible: the open slots are down to the presolve bound
+        if self.unmet_vars is not None and slot_shortfall(self.Value, self.unmet_vars) <= self.unmet_floor:
+            self.stop_reason = 'covered'
+            self.StopSearch()
+
+def _solve(model: cp_model.CpModel,
+           solver: cp_model.CpSolver,
+           on_progress: Callable[[Dict[str,Any]], None] = None,
+           should_stop: Callable[[], bool] = None,
+           stop_policy: Dict[str,Any] = None,
+           unmet_vars: List[Tuple[Any,Any,Any]] = None,
+           unmet_floor: int = 0) -> Tuple[int, _ProgressCallback]:
+    # should_stop and the stall window are polled from a watchdog thread, so
+    # they also land while the search is between improving solutions; both
+    # only take effect once there is a solution to keep
+    stop_policy = stop_policy or {}
+    cb = _ProgressCallback(on_progress, unmet_vars if stop_policy.get('stop_when_covered') else None, unmet_floor)
+    stall = stop_policy.get('stall_seconds')
+    done = threading.Event()
+    if should_stop is not None or stall:
+        def watch():
+            while not done.wait(0.5):
+                if not cb.solutions:
+                    continue
+                if should_stop is not None and should_stop():
+                    cb.stopped_early = True
+                    cb.stop_reason = 'accepted'
+                elif stall and monotonic() - cb.last_improvement > stall:
+                    cb.stop_reason = 'stall'
+                else:
+                    continue
+                solver.StopSearch()
+                return
+        threading.Thread(target=watch, daemon=True).start()
+    try:
+        status = solver.Solve(model, cb)
+    finally:
+        done.set()
+    return status, cb
+
+# Model dump policy keys (all optional):
+#   dir                 where dumps go (model_template.MODEL_DUMP_DIR)
+#   min_solve_time      only dump solves that took at least this long
+def _dump_model(model: cp_model.CpModel, solver: cp_model.CpSolver, model_dump: Dict[str,Any], project_id: int,
+                start_date: date, horizon_days: int, metrics: Dict[str,Any]) -> str:
+    if model_dump is None or solver.WallTime() < (model_dump.get('min_solve_time') or 0):
+        return None
+    meta = {'project_id': project_id, 'start_date': start_date, 'horizon_days': horizon_days,
+            **{k: metrics.get(k) for k in ('mode', 'status', 'objective', 'solve_time', 'num_vars', 'num_constraints', 'template')}}
+    return model_template.dump_model(model, solver, meta, model_dump.get('dir'))
+
+# exact: CP-SAT over every assignment; aggregate: CP-SAT over agent classes;
+# heuristic: greedy + LNS draft, no CP-SAT; hybrid: CP-SAT started from the
+# heuristic draft
+MODES = ('exact', 'aggregate', 'heuristic', 'hybrid')
+
+# Fairness carry-over from earlier cycles as (max age in days, weight)
+# windows, a cycle's age being the days from its last day to the new start:
+# the cycle just before counts in full, older ones fade out and anything past
+# the last window is forgotten. SCHEDULER_FAIRNESS_DECAY="14:1,28:0.5,56:0.25"
+FAIRNESS_DECAY = ((14, 1.0), (28, 0.5), (56, 0.25))
+
+def parse_fairness_decay(spec: str) -> Tuple[Tuple[int, float], ...]:
+    if not spec:
+        return FAIRNESS_DECAY
+    windows = []
+    for part in spec.split(','):
+        days, weight = part.split(':')
+        windows.append((int(days), float(weight)))
+    return tuple(sorted(windows))
+
+def fairness_metrics(history: List[Dict[str,Any]], start_date: date, decay: Tuple[Tuple[int, float], ...] = None) -> Dict[int, Dict[str,int]]:
+    # history: ledger rows {agent_id, cycle_end, nights, weekends, shifts};
+    # decayed sums are rounded since they become CP-SAT coefficients
+    decay = decay or FAIRNESS_DECAY
+    totals = defaultdict(lambda: [0.0, 0.0, 0.0])
+    for r in history:
+        age = (start_date - r['cycle_end']).days
+        weight = next((w for days, w in decay if age <= days), 0)
+        if weight:
+            t = totals[r['agent_id']]
+            t[0] += weight * r['nights']
+            t[1] += weight * r['weekends']
+            t[2] += weight * r['shifts']
+    return {a: {'nights': int(n + 0.5), 'weekends': int(w + 0.5), 'shifts': int(t + 0.5)} for a, (n, w, t) in totals.items()}
+
+def _build_model(agents: List[Dict[str,Any]],
+                 shifts: List[Dict[str,Any]],
+                 exceptions: List[Dict[str,Any]],
+                 per_shift_requirements: Dict[int, Dict[str,Any]],
+                 previous_metrics: Dict[int, Dict[str,int]],
+                 start_date: date,
+                 horizon_days: int,
+                 windows: Dict[Tuple[int,int], Tuple[datetime, datetime]],
+                 allowed: Dict[Tuple[int,int], set],
+                 short_days: Dict[int,int],
+                 hint_assignments: List[Dict[str,Any]] = None,
+                 baseline_assignments: List[Dict[str,Any]] = None,
+                 change_weight: int = 100) -> Dict[str,Any]:
+    # the exact model built from scratch; same result shape as
+    # ModelTemplate.instantiate
     model = cp_model.CpModel()
     agent_ids = [a['id'] for a in agents]
-    shift_ids = [s['id'] for s in shifts]
-    roles = ['chat','email']
+    all_shifts = {s['id'] for s in shifts}
+    night_shift_ids = {s['id'] for s in shifts if s['name'].lower().startswith('night')}
 
+    # dense indexes over the decision variables; every constraint family below
+    # is built from these instead of scanning `assign`. Variables that
+    # exceptions or boundary rows rule out are never created.
     assign = {}
-    for a in agents:
+    pruned = 0
+    # (variable index, agent position, day, cell code) per variable, so the
+    # solution is read back with one vectorised gather
+    cells = []
+    by_agent_day = defaultdict(list)
+    by_agent_day_shift = defaultdict(list)
+    by_day_shift_role = defaultdict(list)
+    by_agent_night = defaultdict(list)
+    for ai, a in enumerate(agents):
+        agent_roles = roles_for_skill(a['channel_skill'])
         for day in range(horizon_days):
-            for s in shifts:
-                for r in roles:
-                    skill = a['channel_skill']
-                    if skill == 'chat' and r == 'email': continue
-                    if skill == 'email' and r == 'chat': continue
-                    assign[(a['id'], day, s['id'], r)] = model.NewBoolVar(f"a{a['id']}_d{day}_s{s['id']}_r{r}")
+            free = allowed.get((a['id'], day), all_shifts)
+            for si, s in enumerate(shifts):
+                if s['id'] not in free:
+                    pruned += len(agent_roles)
+                    continue
+                for r in agent_roles:
+                    v = model.NewBoolVar(f"a{a['id']}_d{day}_s{s['id']}_r{r}")
+                    assign[(a['id'], day, s['id'], r)] = v
+                    cells.append((v.Index(), ai, day, si * 2 + ROLES.index(r)))
+                    by_agent_day[(a['id'], day)].append(v)
+                    by_agent_day_shift[(a['id'], day, s['id'])].append(v)
+                    by_day_shift_role[(day, s['id'], r)].append(v)
+                    if s['id'] in night_shift_ids:
+                        by_agent_night[a['id']].append(v)
 
     for a in agent_ids:
         for day in range(horizon_days):
-            vars_day = [v for k,v in assign.items() if k[0]==a and k[1]==day]
+            vars_day = by_agent_day.get((a, day))
             if vars_day:
                 model.Add(sum(vars_day) <= 1)
 
+    # fixed_shift days only have the fixed shift's variables left (none when
+    # a fixed_off overrides it), so it just has to be worked
     for ex in exceptions:
-        if ex['type'] == 'fixed_off':
-            a = ex['agent_id']; s_date = ex['start_date']; e_date = ex['end_date']
-            for day in range(horizon_days):
-                d = start_date + timedelta(days=day)
-                if s_date <= d <= e_date:
-                    for sid in shift_ids:
-                        for r in roles:
-                            var = assign.get((a, day, sid, r))
-                            if var is not None: model.Add(var == 0)
-        elif ex['type'] == 'fixed_shift':
-            a = ex['agent_id']; sid_fixed = ex['shift_id']; s_date = ex['start_date']; e_date = ex['end_date']
-            for day in range(horizon_days):
-                d = start_date + timedelta(days=day)
-                if s_date <= d <= e_date:
-                    allowed = []
-                    for r in roles:
-                        v = assign.get((a, day, sid_fixed, r))
-                        if v is not None:
-                            allowed.append(v)
-                    if allowed:
-                        model.Add(sum(allowed) == 1)
-                    for sid in shift_ids:
-                        if sid == sid_fixed: continue
-                        for r in roles:
-                            v = assign.get((a, day, sid, r))
-                            if v is not None: model.Add(v == 0)
+        if ex['type'] != 'fixed_shift':
+            continue
+        for day in exception_days(ex, start_date, horizon_days):
+            fixed = by_agent_day_shift.get((ex['agent_id'], day, ex['shift_id']))
+            if fixed:
+                model.Add(sum(fixed) == 1)
 
     unmet_vars = []
-    big_penalty = 10000
+    unmet_by_day = defaultdict(list)
+    # (unmet var, the vars it tops up, floor), to complete a hint
+    unmet_terms = []
+    # (chat, email, total) unmet vars per day/shift, for stop_when_covered
+    unmet_groups = []
     for day in range(horizon_days):
         for s in shifts:
             sid = s['id']
-            chat_vars = []
-            email_vars = []
-            for a in agent_ids:
-                vch = assign.get((a, day, sid, 'chat'))
-                if vch is not None: chat_vars.append(vch)
-                vem = assign.get((a, day, sid, 'email'))
-                if vem is not None: email_vars.append(vem)
+            chat_vars = by_day_shift_role.get((day, sid, 'chat'), [])
+            email_vars = by_day_shift_role.get((day, sid, 'email'), [])
             req = per_shift_requirements.get(sid, {})
             chat_min = req.get('chat_min', 0)
             email_min = req.get('email_min', 0)
             total_target = req.get('total', None)
+            group = {}
             if chat_min > 0:
-                u = model.NewIntVar(0, len(agent_ids), f"unmet_chat_{day}_{sid}")
+                u = group['chat'] = model.NewIntVar(0, len(agent_ids), f"unmet_chat_{day}_{sid}")
                 model.Add(sum(chat_vars) + u >= chat_min)
-                unmet_vars.append((u, big_penalty))
+                unmet_vars.append((u, COVERAGE_PENALTY))
+                unmet_by_day[day].append(u)
+                unmet_terms.append((u, chat_vars, chat_min))
             if email_min > 0:
-                u = model.NewIntVar(0, len(agent_ids), f"unmet_email_{day}_{sid}")
+                u = group['email'] = model.NewIntVar(0, len(agent_ids), f"unmet_email_{day}_{sid}")
                 model.Add(sum(email_vars) + u >= email_min)
-                unmet_vars.append((u, big_penalty))
+                unmet_vars.append((u, COVERAGE_PENALTY))
+                unmet_by_day[day].append(u)
+                unmet_terms.append((u, email_vars, email_min))
             if total_target is not None:
-                u = model.NewIntVar(0, len(agent_ids), f"unmet_total_{day}_{sid}")
+                u = group['total'] = model.NewIntVar(0, len(agent_ids), f"unmet_total_{day}_{sid}")
                 model.Add(sum(chat_vars + email_vars) + u >= total_target)
-                unmet_vars.append((u, big_penalty))
+                unmet_vars.append((u, COVERAGE_PENALTY))
+                unmet_by_day[day].append(u)
+                unmet_terms.append((u, chat_vars + email_vars, total_target))
+            if group:
+                unmet_groups.append((group.get('chat'), group.get('email'), group.get('total')))
 
-    windows = {}
-    for day in range(horizon_days):
-        d = start_date + timedelta(days=day)
-        for s in shifts:
-            windows[(day, s['id'])] = shift_window_for_date(d, s)
+    # the presolve shortfall is a valid cut: it gives CP-SAT the coverage
+    # part of the lower bound up front
+    for day, n in short_days.items():
+        if unmet_by_day.get(day):
+            model.Add(sum(unmet_by_day[day]) >= n)
+
+    conflict_cliques = shift_conflict_cliques(windows)
+    for clique in conflict_cliques:
+        for a in agent_ids:
+            clique_vars = [v for key in clique for v in by_agent_day_shift.get((a,) + key, [])]
+            if len(clique_vars) >= 2:
+                model.AddAtMostOne(clique_vars)
 
-    for day1 in range(horizon_days):
-        for s1 in shifts:
-            sid1 = s1['id']; st1, ed1 = windows[(day1, sid1)]
-            for day2 in range(horizon_days):
-                for s2 in shifts:
-                    sid2 = s2['id']
-                    if (day2, sid2) <= (day1, sid1): continue
-                    st2, ed2 = windows[(day2, sid2)]
-                    overlap = not (ed1 <= st2 or ed2 <= st1)
-                    if overlap:
-                        for a in agent_ids:
-                            vars_pair = []
-                            for r in roles:
-                                v1 = assign.get((a, day1, sid1, r))
-                                if v1 is not None: vars_pair.append(v1)
-                                v2 = assign.get((a, day2, sid2, r))
-                                if v2 is not None: vars_pair.append(v2)
-                            if len(vars_pair) >= 2:
-                                model.Add(sum(vars_pair) <= 1)
-
-    night_shift_ids = [s['id'] for s in shifts if s['name'].lower().startswith('night')]
     night_count_vars = {}
     for a in agent_ids:
         nvar = model.NewIntVar(0, horizon_days, f"n_a{a}")
         night_count_vars[a] = nvar
-        night_vars = []
-        for day in range(horizon_days):
-            for sid in night_shift_ids:
-                for r in roles:
-                    v = assign.get((a, day, sid, r))
-                    if v is not None: night_vars.append(v)
+        night_vars = by_agent_night.get(a)
         if night_vars:
             model.Add(nvar == sum(night_vars))
         else:
@@ -155,26 +498,646 @@ def build_schedule(project_id: int,
 
     for a in agent_ids:
         prev_n = previous_metrics.get(a, {}).get('nights', 0)
-        alpha = 2
-        weight = 1 + alpha * prev_n
+        weight = 1 + NIGHT_ALPHA * prev_n
         obj_terms.append(night_count_vars[a] * weight)
 
+    # minimal-change objective against an existing schedule: every dropped or
+    # added assignment costs change_weight, which sits between the coverage
+    # penalty and the night weights
+    baseline_keys = None
+    if baseline_assignments is not None:
+        baseline_keys = {(b['agent_id'], (parse_date_obj(b['date']) - start_date).days, b['shift_id'], b['role']) for b in baseline_assignments}
+        for key, v in assign.items():
+            obj_terms.append(change_weight * (1 - v) if key in baseline_keys else change_weight * v)
+
     model.Minimize(sum(obj_terms))
 
-    solver = cp_model.CpSolver()
-    solver.parameters.max_time_in_seconds = solver_time_limit
-    solver.parameters.num_search_workers = 8
+    hinted = 0
+    if hint_assignments:
+        hinted_keys = set()
+        for h in hint_assignments:
+            key = (h['agent_id'], (parse_date_obj(h['date']) - start_date).days, h['shift_id'], h['role'])
+            if key in assign:
+                hinted_keys.add(key)
+        for key, v in assign.items():
+            model.AddHint(v, 1 if key in hinted_keys else 0)
+        # hint the coverage and night counters too, so a feasible hint is a
+        # complete first solution rather than a search direction
+        on = {assign[key].Index() for key in hinted_keys}
+        for u, vs, floor in unmet_terms:
+            model.AddHint(u, max(0, floor - sum(1 for v in vs if v.Index() in on)))
+        for a, nvar in night_count_vars.items():
+            model.AddHint(nvar, sum(1 for v in by_agent_night.get(a, []) if v.Index() in on))
+        hinted = len(hinted_keys)
+    baseline = baseline_keys & set(assign) if baseline_keys is not None else None
+    return {'model': model, 'cells': np.array(cells, dtype=np.int64).reshape(-1, 4), 'unmet': unmet_groups,
+            'pruned': pruned, 'fixed': 0, 'hinted': hinted, 'baseline': baseline, 'num_vars': len(model.Proto().variables),
+            'num_constraints': len(model.Proto().constraints), 'live_vars': len(model.Proto().variables),
+            'num_cliques': len(conflict_cliques)}
+
+def build_schedule(project_id: int,
+                   start_date: date,
+                   horizon_days: int,
+                   agents: List[Dict[str,Any]],
+                   shifts: List[Dict[str,Any]],
+                   exceptions: List[Dict[str,Any]],
+                   per_shift_requirements: Dict[int, Dict[str,Any]],
+                   previous_metrics: Dict[int, Dict[str,int]] = None,
+                   solver_time_limit: int = 60,
+                   hint_assignments: List[Dict[str,Any]] = None,
+                   repair_hint: bool = False,
+                   mode: str = 'exact',
+                   boundary_assignments: List[Dict[str,Any]] = None,
+                   num_workers: int = None,
+                   progress_callback: Callable[[Dict[str,Any]], None] = None,
+                   should_stop: Callable[[], bool] = None,
+                   stop_policy: Dict[str,Any] = None,
+                   baseline_assignments: List[Dict[str,Any]] = None,
+                   change_weight: int = 100,
+                   fail_fast: bool = False,
+                   model_dump: Dict[str,Any] = None,
+                   output: str = 'rows') -> Dict[str,Any]:
+    # output='matrix' returns a ScheduleMatrix under 'matrix' instead of
+    # 'assignments' rows
+    if previous_metrics is None:
+        previous_metrics = {}
+    build_started = perf_counter()
+    windows = shift_windows(start_date, horizon_days, shifts)
+    allowed = availability(agents, shifts, exceptions, start_date, horizon_days, windows, boundary_assignments)
+    pre = presolve(agents, shifts, per_shift_requirements, horizon_days, allowed, start_date)
+    if fail_fast and pre['shortfall_lower_bound']:
+        res = {'assignments': [], 'metrics': {'status': 'INSUFFICIENT_CAPACITY', 'objective': None, 'presolve': pre,
+                                              'build_time': round(perf_counter() - build_started, 4), 'solve_time': 0, 'mode': mode}}
+        return _shape_output(res, output, start_date, horizon_days, agents, shifts)
+    draft = None
+    if mode in ('heuristic', 'hybrid'):
+        from .heuristic import build_schedule_heuristic, HEURISTIC_TIME_LIMIT
+        draft = build_schedule_heuristic(project_id, start_date, horizon_days, agents, shifts, exceptions, per_shift_requirements,
+                                         previous_metrics, min(solver_time_limit, HEURISTIC_TIME_LIMIT), allowed,
+                                         boundary_assignments, should_stop)
+        draft['metrics']['presolve'] = pre
+        if mode == 'heuristic':
+            return draft if output == 'matrix' else {'assignments': draft['matrix'].to_rows(), 'metrics': draft['metrics']}
+        # hybrid: the draft is CP-SAT's starting point, and the answer if
+        # CP-SAT finds nothing in the time that is left
+        hint_assignments = draft['matrix'].to_rows(iso=False)
+        solver_time_limit = max(1, solver_time_limit - (perf_counter() - build_started))
+    if mode == 'aggregate':
+        res = build_schedule_aggregated(project_id, start_date, horizon_days, agents, shifts, exceptions,
+                                        per_shift_requirements, previous_metrics, solver_time_limit,
+                                        hint_assignments, repair_hint, num_workers, progress_callback, should_stop,
+                                        stop_policy, model_dump, pre['shortfall_lower_bound'])
+        res['metrics']['presolve'] = pre
+        return _shape_output(res, output, start_date, horizon_days, agents, shifts)
 
-    status = solver.Solve(model)
+    agent_ids = [a['id'] for a in agents]
+    shift_ids = [s['id'] for s in shifts]
+    short_days = {(parse_date_obj(d) - start_date).days: n for d, n in pre['short_days'].items()}
+    template_hit = None
+    if model_template.MODEL_TEMPLATES > 0:
+        # structure compiled once per roster/shifts/horizon, this job's
+        # exceptions, demand and weights patched into a copy
+        template, template_hit = model_template.get_template(agents, shifts, horizon_days, windows)
+        built = template.instantiate(agents, allowed, exceptions, per_shift_requirements, short_days, previous_metrics, start_date,
+                                     hint_assignments, baseline_assignments, change_weight)
+        built.update(cells=template.cells, num_cliques=template.num_cliques,
+                     unmet=[tuple(built['model'].GetIntVarFromProtoIndex(i) if i >= 0 else None for i in g) for g in built['unmet']])
+    else:
+        built = _build_model(agents, shifts, exceptions, per_shift_requirements, previous_metrics, start_date, horizon_days,
+                             windows, allowed, short_days, hint_assignments, baseline_assignments, change_weight)
+    model, cells, hinted = built['model'], built['cells'], built['hinted']
+    build_time = perf_counter() - build_started
+
+    solver = _configure_solver(model, solver_time_limit, num_workers, stop_policy, bool(hinted and repair_hint), built['live_vars'])
+    status, timer = _solve(model, solver, progress_callback, should_stop, stop_policy, built['unmet'],
+                           pre['shortfall_lower_bound'])
     st_name = solver.StatusName(status)
-    assignments = []
-    if st_name in ('OPTIMAL','FEASIBLE'):
+    matrix = ScheduleMatrix.empty(start_date, horizon_days, agent_ids, shift_ids)
+    if st_name in ('OPTIMAL','FEASIBLE') and len(cells):
+        values = np.array(solver.ResponseProto().solution, dtype=np.int64)[cells[:, 0]]
+        chosen = cells[values == 1]
+        matrix.codes[chosen[:, 1], chosen[:, 2]] = chosen[:, 3]
+    metrics = {'status': st_name, 'objective': solver.ObjectiveValue() if st_name in ('OPTIMAL','FEASIBLE') else None,
+               'build_time': round(build_time, 4), 'solve_time': round(solver.WallTime(), 4),
+               'num_vars': built['num_vars'], 'num_constraints': built['num_constraints'], 'live_vars': built['live_vars'],
+               'conflict_cliques': built['num_cliques'],
+               'first_solution_time': round(timer.first_solution_time, 4) if timer.first_solution_time is not None else None,
+               'solutions': timer.solutions, 'stopped_early': timer.stopped_early, 'stop_reason': timer.stop_reason,
+               'time_limit': round(solver.parameters.max_time_in_seconds, 2), 'num_workers': solver.parameters.num_search_workers,
+               'warm_start': hinted > 0, 'hinted_assignments': hinted, 'repair_hint': bool(hinted and repair_hint),
+               'mode': 'exact', 'presolve': pre, 'pruned_vars': built['pruned'], 'fixed_vars': built['fixed']}
+    if template_hit is not None:
+        metrics['template'] = 'hit' if template_hit else 'miss'
+    dumped = _dump_model(model, solver, model_dump, project_id, start_date, horizon_days, metrics)
+    if dumped:
+        metrics['model_dump'] = dumped
+    if draft is not None:
+        metrics['mode'] = 'hybrid'
+        metrics['heuristic'] = {k: draft['metrics'][k] for k in ('status', 'objective', 'solve_time', 'lns_iterations')}
+        solved = st_name in ('OPTIMAL', 'FEASIBLE')
+        if draft['metrics']['status'] == 'FEASIBLE' and (not solved or draft['metrics']['objective'] < metrics['objective']):
+            matrix = draft['matrix']
+            metrics.update(status='FEASIBLE', objective=draft['metrics']['objective'], fallback='heuristic', solver_status=st_name)
+    if built['baseline'] is not None:
+        picked = {(a['agent_id'], (parse_date_obj(a['date']) - start_date).days, a['shift_id'], a['role']) for a in matrix.iter_rows(iso=False)}
+        metrics['changes'] = len(picked ^ built['baseline']) if picked else None
+    if output == 'matrix':
+        return {'matrix': matrix, 'metrics': metrics}
+    return {'assignments': matrix.to_rows(), 'metrics': metrics}
+
+def _shape_output(res: Dict[str,Any], output: str, start_date: date, horizon_days: int,
+                  agents: List[Dict[str,Any]], shifts: List[Dict[str,Any]]) -> Dict[str,Any]:
+    if output != 'matrix':
+        return res
+    matrix = ScheduleMatrix.from_rows(res.pop('assignments'), start_date, horizon_days,
+                                      [a['id'] for a in agents], [s['id'] for s in shifts])
+    return dict(res, matrix=matrix)
+
+def agent_classes(agents: List[Dict[str,Any]],
+                  exceptions: List[Dict[str,Any]],
+                  start_date: date,
+                  horizon_days: int,
+                  previous_metrics: Dict[int, Dict[str,int]] = None) -> List[Dict[str,Any]]:
+    # agents sharing a skill and the same in-horizon exceptions are
+    # interchangeable; their night weights are not, so each class keeps them
+    # as tiers of (weight, agents), cheapest first
+    previous_metrics = previous_metrics or {}
+    profiles = defaultdict(list)
+    for ex in exceptions:
+        days = exception_days(ex, start_date, horizon_days)
+        if len(days):
+            profiles[ex['agent_id']].append((ex['type'], days.start, days.stop, ex.get('shift_id')))
+    classes = {}
+    for a in agents:
+        key = (a['channel_skill'], tuple(sorted(profiles.get(a['id'], []), key=repr)))
+        if key not in classes:
+            classes[key] = {'skill': a['channel_skill'], 'exceptions': key[1], 'agent_ids': []}
+        classes[key]['agent_ids'].append(a['id'])
+    for c in classes.values():
+        weights = Counter(1 + NIGHT_ALPHA * previous_metrics.get(a, {}).get('nights', 0) for a in c['agent_ids'])
+        c['night_tiers'] = sorted(weights.items())
+    return list(classes.values())
+
+def build_schedule_aggregated(project_id: int,
+                              start_date: date,
+                              horizon_days: int,
+                              agents: List[Dict[str,Any]],
+                              shifts: List[Dict[str,Any]],
+                              exceptions: List[Dict[str,Any]],
+                              per_shift_requirements: Dict[int, Dict[str,Any]],
+                              previous_metrics: Dict[int, Dict[str,int]] = None,
+                              solver_time_limit: int = 60,
+                              hint_assignments: List[Dict[str,Any]] = None,
+                              repair_hint: bool = False,
+                              num_workers: int = None,
+                              progress_callback: Callable[[Dict[str,Any]], None] = None,
+                              should_stop: Callable[[], bool] = None,
+                              stop_policy: Dict[str,Any] = None,
+                              model_dump: Dict[str,Any] = None,
+                              shortfall_floor: int = 0) -> Dict[str,Any]:
+    # shortfall_floor: presolve's lower bound on open demand slots, where
+    # stop_when_covered may stop
+    if previous_metrics is None:
+        previous_metrics = {}
+
+    build_started = perf_counter()
+    model = cp_model.CpModel()
+    classes = agent_classes(agents, exceptions, start_date, horizon_days, previous_metrics)
+    night_shift_ids = {s['id'] for s in shifts if s['name'].lower().startswith('night')}
+
+    # one integer count per class/day/shift/role instead of one Bool per agent
+    count = {}
+    by_class_day = defaultdict(list)
+    by_class_day_shift = defaultdict(list)
+    by_day_shift_role = defaultdict(list)
+    by_class_day_night = defaultdict(list)
+    for ci, c in enumerate(classes):
+        size = len(c['agent_ids'])
+        off_days = set()
+        fixed_days = {}
+        for ex_type, first, stop, sid in c['exceptions']:
+            for day in range(first, stop):
+                if ex_type == 'fixed_off':
+                    off_days.add(day)
+                elif ex_type == 'fixed_shift':
+                    fixed_days[day] = sid
         for day in range(horizon_days):
+            if day in off_days:
+                continue
             for s in shifts:
-                for a in agents:
-                    for r in roles:
-                        v = assign.get((a['id'], day, s['id'], r))
-                        if v is not None and solver.Value(v) == 1:
-                            assignments.append({'date': (start_date + timedelta(days=day)).isoformat(), 'shift_id': s['id'], 'agent_id': a['id'], 'role': r})
-    metrics = {'status': st_name, 'objective': solver.ObjectiveValue() if st_name in ('OPTIMAL','FEASIBLE') else None}
+                if day in fixed_days and s['id'] != fixed_days[day]:
+                    continue
+                for r in roles_for_skill(c['skill']):
+                    v = model.NewIntVar(0, size, f"c{ci}_d{day}_s{s['id']}_r{r}")
+                    count[(ci, day, s['id'], r)] = v
+                    by_class_day[(ci, day)].append(v)
+                    by_class_day_shift[(ci, day, s['id'])].append(v)
+                    by_day_shift_role[(day, s['id'], r)].append(v)
+                    if s['id'] in night_shift_ids:
+                        by_class_day_night[(ci, day)].append(v)
+        for day in range(horizon_days):
+            vars_day = by_class_day.get((ci, day))
+            if not vars_day:
+                continue
+            if day in fixed_days:
+                model.Add(sum(vars_day) == size)
+            else:
+                model.Add(sum(vars_day) <= size)
+
+    windows = shift_windows(start_date, horizon_days, shifts)
+    conflict_cliques = shift_conflict_cliques(windows)
+    for clique in conflict_cliques:
+        for ci, c in enumerate(classes):
+            clique_vars = [v for key in clique for v in by_class_day_shift.get((ci,) + key, [])]
+            if len(clique_vars) >= 2:
+                model.Add(sum(clique_vars) <= len(c['agent_ids']))
+
+    unmet_vars = []
+    unmet_groups = []
+    for day in range(horizon_days):
+        for s in shifts:
+            sid = s['id']
+            chat_vars = by_day_shift_role.get((day, sid, 'chat'), [])
+            email_vars = by_day_shift_role.get((day, sid, 'email'), [])
+            req = per_shift_requirements.get(sid, {})
+            chat_min = req.get('chat_min', 0)
+            email_min = req.get('email_min', 0)
+            total_target = req.get('total', None)
+            group = {}
+            if chat_min > 0:
+                u = group['chat'] = model.NewIntVar(0, len(agents), f"unmet_chat_{day}_{sid}")
+                model.Add(sum(chat_vars) + u >= chat_min)
+                unmet_vars.append((u, COVERAGE_PENALTY))
+            if email_min > 0:
+                u = group['email'] = model.NewIntVar(0, len(agents), f"unmet_email_{day}_{sid}")
+                model.Add(sum(email_vars) + u >= email_min)
+                unmet_vars.append((u, COVERAGE_PENALTY))
+            if total_target is not None:
+                u = group['total'] = model.NewIntVar(0, len(agents), f"unmet_total_{day}_{sid}")
+                model.Add(sum(chat_vars + email_vars) + u >= total_target)
+                unmet_vars.append((u, COVERAGE_PENALTY))
+            if group:
+                unmet_groups.append((group.get('chat'), group.get('email'), group.get('total')))
+
+    # a day's nights cost least on the class's lowest-weight members, which
+    # is where disaggregate_counts puts them: a convex cost, one count per
+    # weight tier
+    obj_terms = [u * pen for u, pen in unmet_vars]
+    for (ci, day), night_vars in by_class_day_night.items():
+        tiers = classes[ci]['night_tiers']
+        if len(tiers) == 1:
+            obj_terms.append(sum(night_vars) * tiers[0][0])
+            continue
+        tier_vars = [model.NewIntVar(0, n, f"n{ci}_d{day}_t{t}") for t, (w, n) in enumerate(tiers)]
+        model.Add(sum(tier_vars) == sum(night_vars))
+        obj_terms.extend(v * w for v, (w, n) in zip(tier_vars, tiers))
+    model.Minimize(sum(obj_terms))
+
+    hinted = 0
+    if hint_assignments:
+        class_of = {a: ci for ci, c in enumerate(classes) for a in c['agent_ids']}
+        hint_counts = defaultdict(int)
+        for h in hint_assignments:
+            ci = class_of.get(h['agent_id'])
+            key = (ci, (parse_date_obj(h['date']) - start_date).days, h['shift_id'], h['role'])
+            if key in count:
+                hint_counts[key] += 1
+                hinted += 1
+        for key, v in count.items():
+            model.AddHint(v, hint_counts.get(key, 0))
+    build_time = perf_counter() - build_started
+
+    solver = _configure_solver(model, solver_time_limit, num_workers, stop_policy, bool(hinted and repair_hint))
+    status, timer = _solve(model, solver, progress_callback, should_stop, stop_policy, unmet_groups, shortfall_floor)
+    st_name = solver.StatusName(status)
+    assignments = []
+    shortfall = 0
+    disagg_started = perf_counter()
+    if st_name in ('OPTIMAL','FEASIBLE'):
+        counts = {key: solver.Value(v) for key, v in count.items()}
+        assignments, shortfall = disaggregate_counts(counts, classes, start_date, horizon_days, agents, shifts, night_shift_ids, previous_metrics)
+    objective = None
+    solver_status = st_name
+    if st_name in ('OPTIMAL','FEASIBLE'):
+        # report the evaluator's score of the named schedule so it compares
+        # with exact mode; the count model's own objective is kept alongside.
+        # The count model relaxes the per-agent one, so its optimum is only
+        # reached when every slot found an agent at the tier it was priced at
+        from .evaluator import evaluate
+        objective = evaluate(assignments, agents, shifts, exceptions, per_shift_requirements, start_date, horizon_days,
+                             previous_metrics)['objective']
+        if st_name == 'OPTIMAL' and (shortfall or objective > round(solver.ObjectiveValue())):
+            st_name = 'FEASIBLE'
+    metrics = {'status': st_name, 'solver_status': solver_status, 'objective': objective,
+               'aggregate_objective': solver.ObjectiveValue() if st_name in ('OPTIMAL','FEASIBLE') else None,
+               'build_time': round(build_time, 4), 'solve_time': round(solver.WallTime(), 4),
+               'num_vars': len(model.Proto().variables), 'num_constraints': len(model.Proto().constraints),
+               'conflict_cliques': len(conflict_cliques),
+               'first_solution_time': round(timer.first_solution_time, 4) if timer.first_solution_time is not None else None,
+               'solutions': timer.solutions, 'stopped_early': timer.stopped_early, 'stop_reason': timer.stop_reason,
+               'time_limit': round(solver.parameters.max_time_in_seconds, 2), 'num_workers': solver.parameters.num_search_workers,
+               'warm_start': hinted > 0, 'hinted_assignments': hinted, 'repair_hint': bool(hinted and repair_hint),
+               'mode': 'aggregate', 'agent_classes': len(classes),
+               'disaggregation_time': round(perf_counter() - disagg_started, 4), 'disaggregation_shortfall': shortfall}
+    dumped = _dump_model(model, solver, model_dump, project_id, start_date, horizon_days, metrics)
+    if dumped:
+        metrics['model_dump'] = dumped
     return {'assignments': assignments, 'metrics': metrics}
+
+def disaggregate_counts(counts: Dict[Tuple[int,int,int,str], int],
+                        classes: List[Dict[str,Any]],
+                        start_date: date,
+                        horizon_days: int,
+                        agents: List[Dict[str,Any]],
+                        shifts: List[Dict[str,Any]],
+                        night_shift_ids: set,
+                        previous_metrics: Dict[int, Dict[str,int]]) -> Tuple[List[Dict[str,Any]], int]:
+    # day by day, match each class's slots to its named agents; an agent can
+    # only take a slot starting after its previous shift has ended. Night
+    # slots go first and prefer the agents with the fewest previous nights,
+    # the cheapest tier the count model priced them at.
+    windows = shift_windows(start_date, horizon_days, shifts)
+    nights = {a['id']: previous_metrics.get(a['id'], {}).get('nights', 0) for a in agents}
+    worked = defaultdict(int)
+    busy_until = {}
+    rows = []
+    shortfall = 0
+    for day in range(horizon_days):
+        for ci, c in enumerate(classes):
+            slots = []
+            for s in shifts:
+                for r in roles_for_skill(c['skill']):
+                    slots.extend([(s['id'], r)] * counts.get((ci, day, s['id'], r), 0))
+            if not slots:
+                continue
+            slots.sort(key=lambda sr: sr[0] not in night_shift_ids)
+            matched = {}
+            order = {}
+            for sid in {sid for sid, r in slots}:
+                st = windows[(day, sid)][0]
+                free = [a for a in c['agent_ids'] if busy_until.get(a) is None or busy_until[a] <= st]
+                if sid in night_shift_ids:
+                    order[sid] = sorted(free, key=lambda a: (nights[a], worked[a]))
+                else:
+                    order[sid] = sorted(free, key=lambda a: (worked[a], -nights[a]))
+
+            def place(i, seen):
+                # a free agent before displacing one, so earlier slots keep
+                # the agents they preferred
+                for a in order[slots[i][0]]:
+                    if a not in matched:
+                        matched[a] = i
+                        return True
+                for a in order[slots[i][0]]:
+                    if a in seen:
+                        continue
+                    seen.add(a)
+                    if place(matched[a], seen):
+                        matched[a] = i
+                        return True
+                return False
+
+            for i in range(len(slots)):
+                if not place(i, set()):
+                    shortfall += 1
+            for a, i in matched.items():
+                sid, r = slots[i]
+                busy_until[a] = windows[(day, sid)][1]
+                worked[a] += 1
+                rows.append((day, sid, a, r))
+    shift_pos = {s['id']: i for i, s in enumerate(shifts)}
+    agent_pos = {a['id']: i for i, a in enumerate(agents)}
+    rows.sort(key=lambda x: (x[0], shift_pos[x[1]], agent_pos[x[2]], x[3]))
+    assignments = [{'date': (start_date + timedelta(days=day)).isoformat(), 'shift_id': sid, 'agent_id': a, 'role': r}
+                   for day, sid, a, r in rows]
+    return assignments, shortfall
+
+def _solve_window(kwargs: Dict[str,Any]) -> Dict[str,Any]:
+    # the matrix pickles to a fraction of the row dicts
+    return build_schedule(output='matrix', **kwargs)
+
+def _night_counts(assignments: List[Dict[str,Any]], night_shift_ids: set, base: Dict[int,int]) -> Dict[int,int]:
+    nights = dict(base)
+    for a in assignments:
+        if a['shift_id'] in night_shift_ids:
+            nights[a['agent_id']] = nights.get(a['agent_id'], 0) + 1
+    return nights
+
+def build_schedule_rolling(project_id: int,
+                           start_date: date,
+                           horizon_days: int,
+                           agents: List[Dict[str,Any]],
+                           shifts: List[Dict[str,Any]],
+                           exceptions: List[Dict[str,Any]],
+                           per_shift_requirements: Dict[int, Dict[str,Any]],
+                           previous_metrics: Dict[int, Dict[str,int]] = None,
+                           solver_time_limit: int = 60,
+                           window_days: int = 7,
+                           overlap_days: int = 1,
+                           parallel: bool = False,
+                           max_workers: int = None,
+                           hint_assignments: List[Dict[str,Any]] = None,
+                           num_workers: int = None,
+                           progress_callback: Callable[[Dict[str,Any]], None] = None,
+                           should_stop: Callable[[], bool] = None,
+                           stop_policy: Dict[str,Any] = None,
+                           fail_fast: bool = False,
+                           model_dump: Dict[str,Any] = None,
+                           output: str = 'rows') -> Dict[str,Any]:
+    # Sequential mode solves each window with the previous window's last
+    # committed day as boundary and the nights committed so far as fairness
+    # state, then commits the first window_days days. Parallel mode solves all
+    # windows at once from the same fairness state and re-solves a window's
+    # first day whenever it clashes with the day before it.
+    if previous_metrics is None:
+        previous_metrics = {}
+    started = perf_counter()
+    if fail_fast:
+        allowed = availability(agents, shifts, exceptions, start_date, horizon_days)
+        pre = presolve(agents, shifts, per_shift_requirements, horizon_days, allowed, start_date)
+        if pre['shortfall_lower_bound']:
+            res = {'assignments': [], 'metrics': {'status': 'INSUFFICIENT_CAPACITY', 'objective': None, 'presolve': pre,
+                                                  'build_time': round(perf_counter() - started, 4), 'solve_time': 0, 'mode': 'rolling'}}
+            return _shape_output(res, output, start_date, horizon_days, agents, shifts)
+    night_shift_ids = {s['id'] for s in shifts if s['name'].lower().startswith('night')}
+    nights = {a['id']: previous_metrics.get(a['id'], {}).get('nights', 0) for a in agents}
+    starts = list(range(0, horizon_days, window_days))
+    num_workers = num_workers or default_num_workers()
+    common = dict(project_id=project_id, agents=agents, shifts=shifts, exceptions=exceptions,
+                  per_shift_requirements=per_shift_requirements, hint_assignments=hint_assignments, stop_policy=stop_policy,
+                  model_dump=model_dump)
+
+    def window_kwargs(w_start, span, nights, boundary, time_limit, workers):
+        return dict(common, start_date=start_date + timedelta(days=w_start), horizon_days=span,
+                    previous_metrics={a: {'nights': n} for a, n in nights.items()},
+                    boundary_assignments=boundary, solver_time_limit=time_limit, num_workers=workers)
+
+    def committed_rows(sol, w_start):
+        end = (start_date + timedelta(days=min(w_start + window_days, horizon_days))).isoformat()
+        return [a for a in sol['assignments'] if a['date'] < end]
+
+    windows_metrics = []
+    assignments = []
+    stitched = 0
+    unresolved = []
+    if not parallel:
+        for w_start in starts:
+            span = min(window_days + overlap_days, horizon_days - w_start)
+            edge = (start_date + timedelta(days=w_start - 1)).isoformat()
+            boundary = [a for a in assignments if a['date'] == edge]
+            time_limit = max(1, solver_time_limit / len(starts))
+            on_progress = None
+            if progress_callback is not None:
+                on_progress = lambda p, w=len(windows_metrics): progress_callback(dict(p, window=w, windows=len(starts)))
+            sol = build_schedule(**window_kwargs(w_start, span, nights, boundary, time_limit, num_workers),
+                                 progress_callback=on_progress, should_stop=should_stop)
+            keep = committed_rows(sol, w_start)
+            assignments.extend(keep)
+            nights = _night_counts(keep, night_shift_ids, nights)
+            windows_metrics.append(dict(sol['metrics'], start_day=w_start))
+    else:
+        from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+        pool_size = min(len(starts), max_workers or os.cpu_count() or 1)
+        per_window_workers = max(1, num_workers // pool_size)
+        time_limit = max(1, solver_time_limit * pool_size / len(starts))
+        jobs = [window_kwargs(w_start, min(window_days + overlap_days, horizon_days - w_start), nights, None, time_limit, per_window_workers)
+                for w_start in starts]
+        try:
+            with ProcessPoolExecutor(max_workers=pool_size) as pool:
+                sols = list(pool.map(_solve_window, jobs))
+        except (AssertionError, OSError):
+            # daemonic workers (e.g. Celery prefork children) cannot fork a pool
+            with ThreadPoolExecutor(max_workers=pool_size) as pool:
+                sols = list(pool.map(_solve_window, jobs))
+        sols = [dict(sol, assignments=sol.pop('matrix').to_rows()) for sol in sols]
+        shift_by_id = {s['id']: s for s in shifts}
+        parts = [committed_rows(sol, w_start) for sol, w_start in zip(sols, starts)]
+        for k in range(1, len(starts)):
+            edge_day = start_date + timedelta(days=starts[k])
+            prev_edge, edge = (edge_day - timedelta(days=1)).isoformat(), edge_day.isoformat()
+            busy = {}
+            for a in parts[k - 1]:
+                if a['date'] == prev_edge:
+                    busy[a['agent_id']] = shift_window_for_date(edge_day - timedelta(days=1), shift_by_id[a['shift_id']])[1]
+            clash = any(a['date'] == edge and a['agent_id'] in busy and shift_window_for_date(edge_day, shift_by_id[a['shift_id']])[0] < busy[a['agent_id']]
+                        for a in parts[k])
+            if not clash:
+                continue
+            after = (edge_day + timedelta(days=1)).isoformat()
+            boundary = [a for a in parts[k - 1] if a['date'] == prev_edge] + [a for a in parts[k] if a['date'] == after]
+            day_sol = build_schedule(**window_kwargs(starts[k], 1, nights, boundary, max(1, time_limit / window_days), num_workers))
+            if day_sol['metrics']['status'] in ('OPTIMAL', 'FEASIBLE'):
+                parts[k] = [a for a in parts[k] if a['date'] != edge] + day_sol['assignments']
+                stitched += 1
+            else:
+                # the clash stays in the schedule; the evaluation below reports it
+                unresolved.append(edge)
+        for sol, part, w_start in zip(sols, parts, starts):
+            assignments.extend(part)
+            windows_metrics.append(dict(sol['metrics'], start_day=w_start))
+        assignments.sort(key=lambda a: a['date'])
+
+    statuses = [m['status'] for m in windows_metrics]
+    if all(st == 'OPTIMAL' for st in statuses):
+        status = 'OPTIMAL'
+    elif all(st in ('OPTIMAL','FEASIBLE') for st in statuses):
+        status = 'FEASIBLE'
+    else:
+        status = next(st for st in statuses if st not in ('OPTIMAL','FEASIBLE'))
+    # window objectives double-count the overlap days and miss the seams, so
+    # the stitched schedule is scored as a whole
+    from .evaluator import evaluate
+    ev = evaluate(assignments, agents, shifts, exceptions, per_shift_requirements, start_date, horizon_days, previous_metrics)
+    objective = None
+    if status in ('OPTIMAL', 'FEASIBLE'):
+        objective = ev['objective']
+        if not ev['valid']:
+            status = 'INFEASIBLE'
+    metrics = {'status': status, 'objective': objective,
+               'build_time': round(sum(m['build_time'] for m in windows_metrics), 4),
+               'solve_time': round(sum(m['solve_time'] for m in windows_metrics), 4),
+               'wall_time': round(perf_counter() - started, 4),
+               'mode': 'rolling', 'parallel': parallel, 'window_days': window_days, 'overlap_days': overlap_days,
+               'stitched_days': stitched, 'unresolved_edges': unresolved, 'windows': windows_metrics}
+    if not ev['valid']:
+        metrics['violations'] = {k: n for k, n in ev['violations'].items() if n}
+    return _shape_output({'assignments': assignments, 'metrics': metrics}, output, start_date, horizon_days, agents, shifts)
+
+def repair_schedule(project_id: int,
+                    start_date: date,
+                    horizon_days: int,
+                    agents: List[Dict[str,Any]],
+                    shifts: List[Dict[str,Any]],
+                    exceptions: List[Dict[str,Any]],
+                    per_shift_requirements: Dict[int, Dict[str,Any]],
+                    baseline_assignments: List[Dict[str,Any]],
+                    affected_days: set,
+                    previous_metrics: Dict[int, Dict[str,int]] = None,
+                    solver_time_limit: int = 5,
+                    change_weight: int = 100,
+                    num_workers: int = None,
+                    model_dump: Dict[str,Any] = None,
+                    output: str = 'rows') -> Dict[str,Any]:
+    # Keep the baseline on every unaffected day and re-solve each contiguous
+    # block of affected days with a minimal-change objective. The baseline
+    # days around a block are its boundary, so cross-midnight overlaps into
+    # the fixed part stay correct. Baseline rows of agents no longer in
+    # `agents` are dropped.
+    if previous_metrics is None:
+        previous_metrics = {}
+    started = perf_counter()
+    active = {a['id'] for a in agents}
+    night_shift_ids = {s['id'] for s in shifts if s['name'].lower().startswith('night')}
+    base = [dict(b, date=parse_date_obj(b['date']).isoformat()) for b in baseline_assignments if b['agent_id'] in active]
+    days = sorted(d for d in affected_days if 0 <= d < horizon_days)
+    blocks = []
+    for d in days:
+        if blocks and d == blocks[-1][1] + 1:
+            blocks[-1][1] = d
+        else:
+            blocks.append([d, d])
+
+    def iso(day):
+        return (start_date + timedelta(days=day)).isoformat()
+
+    # nights already fixed outside the blocks count towards fairness
+    block_dates = {iso(d) for d in days}
+    nights = _night_counts([b for b in base if b['date'] not in block_dates], night_shift_ids,
+                           {a: m.get('nights', 0) for a, m in previous_metrics.items()})
+    assignments = [b for b in base if b['date'] not in block_dates]
+    block_metrics = []
+    per_block = max(1, solver_time_limit / max(1, len(blocks)))
+    for first, last in blocks:
+        inside = [b for b in base if iso(first) <= b['date'] <= iso(last)]
+        boundary = [b for b in base if b['date'] in (iso(first - 1), iso(last + 1))]
+        sol = build_schedule(project_id, start_date + timedelta(days=first), last - first + 1, agents, shifts, exceptions,
+                             per_shift_requirements, {a: {'nights': n} for a, n in nights.items()}, per_block,
+                             hint_assignments=inside, boundary_assignments=boundary, num_workers=num_workers,
+                             baseline_assignments=inside, change_weight=change_weight, model_dump=model_dump)
+        if sol['metrics']['status'] in ('OPTIMAL', 'FEASIBLE'):
+            assignments.extend(sol['assignments'])
+        else:
+            assignments.extend(inside)
+        block_metrics.append(dict(sol['metrics'], start_day=first, days=last - first + 1))
+    assignments.sort(key=lambda a: a['date'])
+
+    statuses = [m['status'] for m in block_metrics] or ['OPTIMAL']
+    status = 'OPTIMAL' if all(st == 'OPTIMAL' for st in statuses) else ('FEASIBLE' if all(st in ('OPTIMAL','FEASIBLE') for st in statuses) else statuses[0])
+    # block objectives carry the change costs and only see their own days;
+    # the repaired schedule is scored as a whole, like a generated one. A
+    # block that kept its baseline rows may now break a new exception.
+    from .evaluator import evaluate
+    ev = evaluate(assignments, agents, shifts, exceptions, per_shift_requirements, start_date, horizon_days, previous_metrics)
+    objective = None
+    if status in ('OPTIMAL', 'FEASIBLE'):
+        objective = ev['objective']
+        if not ev['valid']:
+            status = 'INFEASIBLE'
+    metrics = {'status': status, 'objective': objective, 'mode': 'repair', 'affected_days': len(days), 'blocks': block_metrics,
+               'changes': sum(m.get('changes') or 0 for m in block_metrics),
+               'build_time': round(sum(m['build_time'] for m in block_metrics), 4),
+               'solve_time': round(sum(m['solve_time'] for m in block_metrics), 4),
+               'wall_time': round(perf_counter() - started, 4)}
+    if not ev['valid']:
+        metrics['violations'] = {k: n for k, n in ev['violations'].items() if n}
+    return _shape_output({'assignments': assignments, 'metrics': metrics}, output, start_date, horizon_days, agents, shifts)
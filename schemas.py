@@ -32,8 +32,49 @@ class PerShiftReq(BaseModel):
     email_min: int = 0
     total: Optional[int] = None
 
+class StopPolicy(BaseModel):
+    relative_gap: Optional[float] = None
+    stall_seconds: Optional[float] = 15
+    stop_when_covered: bool = False
+    adaptive_time: bool = True
+    min_time: float = 5
+    seconds_per_1k_vars: float = 2.0
+
 class GenerateScheduleReq(BaseModel):
     start_date: date
     horizon_days: int = 14
     per_shift_requirements: List[PerShiftReq]
     solver_time_limit: Optional[int] = 60
+    warm_start: bool = True
+    mode: str = "exact"
+    window_days: Optional[int] = None
+    window_overlap_days: int = 1
+    parallel_windows: bool = False
+    stop_policy: Optional[StopPolicy] = None
+    fail_fast: bool = False
+    dump_model: bool = False
+
+class RepairScheduleReq(BaseModel):
+    exceptions: List[ExceptionCreate] = []
+    removed_agent_ids: List[int] = []
+    per_shift_requirements: Optional[List[PerShiftReq]] = None
+    solver_time_limit: int = 5
+    change_weight: int = 100
+
+class AssignmentIn(BaseModel):
+    date: date
+    shift_id: int
+    agent_id: int
+    role: str
+
+class ValidateScheduleReq(BaseModel):
+    assignments: List[AssignmentIn]
+    per_shift_requirements: Optional[List[PerShiftReq]] = None
+
+class BatchScheduleJob(GenerateScheduleReq):
+    project_id: int
+    priority: int = 0
+
+class BatchScheduleReq(BaseModel):
+    jobs: List[BatchScheduleJob]
+    core_budget: Optional[int] = None
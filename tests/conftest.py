@@ -0,0 +1,78 @@
+import importlib.util, os, random, sys, tempfile
+from datetime import date
+import pytest
+
+# The code is imported as the `app` package (uvicorn app.main:app), whatever
+# the checkout directory is called. Tests run on a throwaway SQLite file, an
+# unreachable Redis (in-process caches) and eager Celery.
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TMP = tempfile.mkdtemp(prefix="scheduler-tests-")
+os.environ["DATABASE_URL"] = os.environ.get("TEST_DATABASE_URL") or f"sqlite:///{TMP}/scheduler.db"
+os.environ["REDIS_URL"] = os.environ.get("TEST_REDIS_URL") or "redis://127.0.0.1:1/0"
+os.environ.setdefault("EXPORT_DIR", os.path.join(TMP, "exports"))
+os.environ.setdefault("SCHEDULER_MODEL_DUMP_DIR", os.path.join(TMP, "models"))
+
+if "app" not in sys.modules:
+    spec = importlib.util.spec_from_file_location("app", os.path.join(ROOT, "__init__.py"), submodule_search_locations=[ROOT])
+    sys.modules["app"] = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(sys.modules["app"])
+
+from app import bench_engine, cache, db, models, tasks
+
+tasks.celery_app.conf.task_always_eager = True
+
+START = date(2026, 1, 5)
+
+def make_fixture(agents=24, days=7, pattern="3x9", exceptions=0.1, seed=1):
+    # bench_engine's synthetic project plus uneven night history
+    agent_rows, shifts, ex_rows, reqs = bench_engine.make_project(agents, days, pattern, [0.35, 0.35, 0.3], exceptions, 0.6, seed, START)
+    rnd = random.Random(seed)
+    prev = {a["id"]: {"nights": rnd.choice([0, 0, 1, 2, 3])} for a in agent_rows}
+    return {"agents": agent_rows, "shifts": shifts, "exceptions": ex_rows, "reqs": reqs, "prev": prev,
+            "start": START, "days": days}
+
+@pytest.fixture
+def fixture():
+    return make_fixture()
+
+@pytest.fixture
+def fixture14():
+    return make_fixture(days=14)
+
+@pytest.fixture
+def session():
+    models.Base.metadata.drop_all(bind=db.engine)
+    models.Base.metadata.create_all(bind=db.engine)
+    # ids restart with the database, so the caches have to as well
+    cache.reference_cache.local = cache.TTLCache(128, 3600)
+    cache.reference_cache.versions.clear()
+    tasks.solve_cache.local = cache.TTLCache(256, 3600)
+    s = db.SessionLocal()
+    try:
+        yield s
+    finally:
+        s.close()
+
+@pytest.fixture
+def client(session):
+    from fastapi.testclient import TestClient
+    from app import main
+    with TestClient(main.app) as c:
+        yield c
+
+def seed_project(session, f):
+    # writes a make_fixture project to the database under the same ids
+    from datetime import time
+    p = models.Project(name="Test")
+    session.add(p)
+    session.flush()
+    for i, s in enumerate(f["shifts"]):
+        session.add(models.Shift(id=s["id"], project_id=p.id, name=s["name"], start_time=time.fromisoformat(s["start_time"]),
+                                 end_time=time.fromisoformat(s["end_time"]), crosses_midnight=s["crosses_midnight"], shift_order=i))
+    for a in f["agents"]:
+        session.add(models.Agent(id=a["id"], project_id=p.id, name=a["name"], channel_skill=a["channel_skill"]))
+    session.flush()
+    for e in f["exceptions"]:
+        session.add(models.ExceptionRow(**e))
+    session.commit()
+    return p.id
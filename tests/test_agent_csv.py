@@ -0,0 +1,44 @@
+from datetime import date
+from app import main, models
+from conftest import make_fixture, seed_project
+
+CSV = """name,email,channel_skill,fixed_off_start,fixed_off_end,fixed_shift_id,fixed_shift_start,fixed_shift_end
+Ann,ann@x.io,chat,2026-01-06,2026-01-07,,,
+Bob,,Phone,,,2,2026-01-08,2026-01-08
+,nobody@x.io,email,,,,,
+Cat,,email,2026-01-09,2026-01-08,,,
+Dan,,both,,,9,2026-01-05,2026-01-05
+Eve,,EMAIL,,,1,2026-01-06,2026-01-05
+"""
+
+def test_parse_agent_csv():
+    agents, exceptions, errors = main.parse_agent_csv(CSV, {1, 2, 3})
+    assert [(a["name"], a["channel_skill"]) for a in agents] == [("Ann", "chat"), ("Bob", "both"), ("Cat", "email"), ("Dan", "both"), ("Eve", "email")]
+    assert agents[0]["email"] == "ann@x.io" and agents[1]["email"] is None
+    assert exceptions == [
+        {"agent_index": 0, "type": "fixed_off", "start_date": date(2026, 1, 6), "end_date": date(2026, 1, 7), "shift_id": None},
+        {"agent_index": 1, "type": "fixed_shift", "start_date": date(2026, 1, 8), "end_date": date(2026, 1, 8), "shift_id": 2},
+    ]
+    # bad rows are reported by line and skipped; the agent on them is kept
+    assert errors == [
+        {"line": 4, "error": "missing name"},
+        {"line": 5, "error": "fixed_off: end before start"},
+        {"line": 6, "error": "fixed_shift: unknown shift 9"},
+        {"line": 7, "error": "fixed_shift: end before start"},
+    ]
+
+def test_parse_agent_csv_bad_date():
+    agents, exceptions, errors = main.parse_agent_csv("Name,fixed_off,fixed_off_end\nAnn,soon,2026-01-07\n", set())
+    assert agents == [{"name": "Ann", "email": None, "channel_skill": "both"}] and not exceptions
+    assert errors[0]["line"] == 2 and errors[0]["error"].startswith("fixed_off: ")
+
+def test_bulk_upload(client, session):
+    pid = seed_project(session, make_fixture(agents=2, exceptions=0))
+    r = client.post(f"/projects/{pid}/agents/bulk_upload", files={"file": ("agents.csv", CSV.encode())})
+    assert r.status_code == 200
+    body = r.json()
+    assert body["count"] == 5 and len(body["errors"]) == 4
+    assert [a["name"] for a in client.get(f"/projects/{pid}/agents").json()][2:] == ["Ann", "Bob", "Cat", "Dan", "Eve"]
+    ann = body["created"][0]["id"]
+    assert session.query(models.ExceptionRow).filter_by(agent_id=ann, type="fixed_off").count() == 1
+    assert client.post("/projects/999/agents/bulk_upload", files={"file": ("agents.csv", CSV.encode())}).status_code == 404
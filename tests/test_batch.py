@@ -0,0 +1,21 @@
+from types import SimpleNamespace
+from app import tasks
+from conftest import make_fixture, seed_project
+
+def test_batch_honours_parallel_windows(client, session, monkeypatch):
+    f = make_fixture(days=14)
+    pid = seed_project(session, f)
+    sent = []
+    monkeypatch.setattr(tasks.run_batch_task, "apply_async", lambda args, kwargs: sent.append((args, kwargs)) or SimpleNamespace(id="batch"))
+    reqs = [{"shift_id": k, **v} for k, v in f["reqs"].items()]
+    job = {"project_id": pid, "start_date": f["start"].isoformat(), "horizon_days": 14, "per_shift_requirements": reqs,
+           "solver_time_limit": 5, "window_days": 7, "parallel_windows": True}
+    r = client.post("/schedules/batch", json={"jobs": [job, dict(job, parallel_windows=False, start_date="2026-02-02")], "core_budget": 4})
+    assert r.status_code == 200
+    (jobs, budget), kwargs = sent[0]
+    res = tasks.run_batch_task.apply([jobs, budget], kwargs).result
+    first, second = (x["result"]["metrics"] for x in res["results"])
+    assert first["parallel"] and not second["parallel"]
+    # the windows share the job's slice of the core budget
+    assert res["num_workers_per_job"] == 2
+    assert sum(w["num_workers"] for w in first["windows"]) <= 2
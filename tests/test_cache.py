@@ -0,0 +1,51 @@
+import asyncio, json, threading
+from app import cache, main
+
+def test_ttl_cache_byte_budget():
+    c = cache.TTLCache(maxsize=10, ttl=60, maxbytes=100)
+    c.set("a", 1, size=40)
+    c.set("b", 2, size=40)
+    c.get("a")
+    c.set("c", 3, size=40)  # over budget: the least recently used goes
+    assert c.get("b") is None and c.get("a") == 1 and c.nbytes == 80
+    c.set("a", 4, size=10)
+    c.delete("c")
+    assert c.nbytes == 10
+    # a single entry over the budget is still kept
+    c.set("d", 5, size=500)
+    assert c.get("d") == 5 and c.get("a") is None and c.nbytes == 500
+
+def test_ttl_cache_add_is_bounded(monkeypatch):
+    # the in-flight markers when Redis is absent: keys that never come back
+    # must not pile up
+    now = [0.0]
+    monkeypatch.setattr(cache.time, "monotonic", lambda: now[0])
+    c = cache.TTLCache(maxsize=3, ttl=10)
+    for k in "abcd":
+        assert c.add(k, 1)
+    assert list(c._data) == ["b", "c", "d"] and not c.add("d", 2)
+    now[0] = 11
+    assert c.add("e", 1, ttl=100)
+    assert list(c._data) == ["e"]
+
+def test_reference_cache_skips_oversize_values(session):
+    rc = cache.ReferenceCache(prefix="t", max_bytes=1000, max_entry_bytes=100)
+    assert rc.set(1, "small", [1, 2, 3]) and rc.get(1, "small") == [1, 2, 3]
+    big = ["x" * 50] * 3
+    assert len(json.dumps(big)) > 100
+    assert not rc.set(1, "big", big) and rc.get(1, "big") is None
+    rc.bump(1)
+    assert rc.get(1, "small") is None
+
+def test_async_handlers_reach_cache_off_the_loop(session, monkeypatch):
+    cache.reference_cache.set(1, "agents", [{"id": 1}])
+    get, threads = cache.reference_cache.get, []
+    def recording_get(*a):
+        threads.append(threading.current_thread())
+        return get(*a)
+    monkeypatch.setattr(cache.reference_cache, "get", recording_get)
+
+    async def run():
+        return await main.project_agents_async(None, 1), threading.current_thread()
+    agents, loop_thread = asyncio.run(run())
+    assert agents == [{"id": 1}] and threads and loop_thread not in threads
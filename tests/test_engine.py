@@ -0,0 +1,157 @@
+from datetime import timedelta
+import pytest
+from app import evaluator, model_template, scheduler_engine
+from conftest import START, make_fixture
+
+# Every engine path is checked against the evaluator: the schedule it returns
+# breaks no hard rule, and the objective it reports is the evaluator's score.
+
+SOLVE = {"solver_time_limit": 5, "num_workers": 1}
+
+def check(sol, f, previous_metrics=None):
+    m = sol["metrics"]
+    assert m["status"] in ("OPTIMAL", "FEASIBLE")
+    ev = evaluator.evaluate(sol["assignments"], f["agents"], f["shifts"], f["exceptions"], f["reqs"], f["start"], f["days"],
+                            f["prev"] if previous_metrics is None else previous_metrics)
+    assert ev["valid"], ev["violations"]
+    assert round(m["objective"]) == ev["objective"]
+    return ev
+
+@pytest.mark.parametrize("mode", scheduler_engine.MODES)
+def test_modes(fixture, mode):
+    f = fixture
+    sol = scheduler_engine.build_schedule(0, f["start"], f["days"], f["agents"], f["shifts"], f["exceptions"], f["reqs"],
+                                          f["prev"], mode=mode, **SOLVE)
+    check(sol, f)
+    assert sol["metrics"]["mode"] == mode
+
+@pytest.mark.parametrize("parallel", [False, True])
+def test_rolling(fixture14, parallel):
+    f = fixture14
+    sol = scheduler_engine.build_schedule_rolling(0, f["start"], f["days"], f["agents"], f["shifts"], f["exceptions"], f["reqs"],
+                                                  f["prev"], window_days=7, overlap_days=1, parallel=parallel, **SOLVE)
+    check(sol, f)
+    assert len(sol["metrics"]["windows"]) == 2
+
+def test_repair(fixture):
+    f = fixture
+    base = scheduler_engine.build_schedule(0, f["start"], f["days"], f["agents"], f["shifts"], f["exceptions"], f["reqs"],
+                                           f["prev"], **SOLVE)
+    sick = base["assignments"][0]["agent_id"]
+    day = f["start"] + timedelta(days=2)
+    f = dict(f, exceptions=f["exceptions"] + [{"agent_id": sick, "type": "fixed_off", "start_date": day, "end_date": day, "shift_id": None}])
+    sol = scheduler_engine.repair_schedule(0, f["start"], f["days"], f["agents"], f["shifts"], f["exceptions"], f["reqs"],
+                                           base["assignments"], {2}, f["prev"], **SOLVE)
+    check(sol, f)
+    assert not any(a["agent_id"] == sick and a["date"] == day.isoformat() for a in sol["assignments"])
+    kept = {(a["date"], a["shift_id"], a["agent_id"], a["role"]) for a in base["assignments"] if a["date"] != day.isoformat()}
+    assert kept <= {(a["date"], a["shift_id"], a["agent_id"], a["role"]) for a in sol["assignments"]}
+
+def test_evaluator_flags_broken_schedule(fixture):
+    f = fixture
+    sol = scheduler_engine.build_schedule(0, f["start"], f["days"], f["agents"], f["shifts"], f["exceptions"], f["reqs"],
+                                          f["prev"], **SOLVE)
+    check(sol, f)
+    row = sol["assignments"][0]
+    other = next(s["id"] for s in f["shifts"] if s["id"] != row["shift_id"])
+    broken = evaluator.evaluate(sol["assignments"] + [dict(row, shift_id=other)], f["agents"], f["shifts"], f["exceptions"],
+                                f["reqs"], f["start"], f["days"], f["prev"])
+    assert not broken["valid"] and broken["violations"]["multiple_shifts"] == 1
+
+def aggregate_and_exact(f):
+    sols = {}
+    for mode in ("exact", "aggregate"):
+        sols[mode] = scheduler_engine.build_schedule(0, f["start"], f["days"], f["agents"], f["shifts"], f["exceptions"], f["reqs"],
+                                                     f["prev"], mode=mode, solver_time_limit=20, num_workers=1,
+                                                     stop_policy={"relative_gap": 0, "adaptive_time": False})
+    return sols
+
+def test_aggregate_matches_exact():
+    # classes stay on skill and exceptions whatever the night history; the
+    # tiered night cost and the disaggregation keep the exact optimum
+    f = make_fixture(agents=20, days=14, exceptions=0.05, seed=3)
+    sols = aggregate_and_exact(f)
+    for sol in sols.values():
+        assert sol["metrics"]["status"] == "OPTIMAL"
+        check(sol, f)
+    assert sols["aggregate"]["metrics"]["objective"] == sols["exact"]["metrics"]["objective"]
+    classes = scheduler_engine.agent_classes(f["agents"], f["exceptions"], f["start"], f["days"], f["prev"])
+    assert sols["aggregate"]["metrics"]["agent_classes"] == len(classes) <= 3 + len(f["exceptions"])
+    for c in classes:
+        weights = sorted(1 + scheduler_engine.NIGHT_ALPHA * f["prev"][a]["nights"] for a in c["agent_ids"])
+        assert [w for w, n in c["night_tiers"] for _ in range(n)] == weights
+
+def test_aggregate_not_optimal_when_disaggregation_falls_short(monkeypatch):
+    f = make_fixture(agents=20, days=7, exceptions=0.05, seed=3)
+    disaggregate = scheduler_engine.disaggregate_counts
+    def dropping(*a):
+        rows, shortfall = disaggregate(*a)
+        return rows[1:], shortfall + 1
+    monkeypatch.setattr(scheduler_engine, "disaggregate_counts", dropping)
+    m = aggregate_and_exact(f)["aggregate"]["metrics"]
+    assert m["solver_status"] == "OPTIMAL" and m["status"] == "FEASIBLE"
+    assert m["disaggregation_shortfall"] == 1 and m["objective"] > m["aggregate_objective"]
+
+def seam_case():
+    # agent 1 is on nights at the end of the first window and, with the
+    # heavier night history, gets the next morning in a window solved
+    # without it: a rest clash at the seam unless the edge day is re-solved
+    shifts = [{"id": 1, "name": "Morning", "start_time": "07:00", "end_time": "16:00", "crosses_midnight": False},
+              {"id": 2, "name": "Night", "start_time": "23:00", "end_time": "08:00", "crosses_midnight": True}]
+    agents = [{"id": 1, "name": "A", "channel_skill": "both"}, {"id": 2, "name": "B", "channel_skill": "both"}]
+    ex = [{"agent_id": 1, "type": "fixed_shift", "shift_id": 2, "start_date": START, "end_date": START}]
+    return {"agents": agents, "shifts": shifts, "exceptions": ex, "reqs": {1: {"total": 1}, 2: {"total": 1}},
+            "prev": {1: {"nights": 3}, 2: {"nights": 0}}, "start": START, "days": 2}
+
+def rolling(f, parallel):
+    return scheduler_engine.build_schedule_rolling(0, f["start"], f["days"], f["agents"], f["shifts"], f["exceptions"], f["reqs"],
+                                                   f["prev"], window_days=1, overlap_days=0, parallel=parallel, **SOLVE)
+
+@pytest.mark.parametrize("parallel", [False, True])
+def test_rolling_seam(parallel):
+    f = seam_case()
+    sol = rolling(f, parallel)
+    check(sol, f)
+    assert sol["metrics"]["stitched_days"] == parallel and sol["metrics"]["unresolved_edges"] == []
+
+def test_rolling_unresolved_seam(monkeypatch):
+    f = seam_case()
+    solve = scheduler_engine.build_schedule
+    def failing_edge(**kw):
+        if kw.get("boundary_assignments"):
+            return {"assignments": [], "metrics": {"status": "UNKNOWN", "objective": None}}
+        return solve(**kw)
+    monkeypatch.setattr(scheduler_engine, "build_schedule", failing_edge)
+    sol = rolling(f, True)
+    m = sol["metrics"]
+    assert m["unresolved_edges"] == [(START + timedelta(days=1)).isoformat()]
+    ev = evaluator.evaluate(sol["assignments"], f["agents"], f["shifts"], f["exceptions"], f["reqs"], f["start"], f["days"], f["prev"])
+    assert not ev["valid"] and m["status"] == "INFEASIBLE" and m["violations"]
+    assert m["objective"] == ev["objective"]
+
+@pytest.mark.parametrize("mode,templates", [("exact", 4), ("exact", 0), ("aggregate", 4)])
+def test_stop_when_covered(monkeypatch, mode, templates):
+    # 3 chat agents for 4 chat slots a day: the bound is one open slot per
+    # day, while the objective charges it as both chat and total shortfall
+    monkeypatch.setattr(model_template, "MODEL_TEMPLATES", templates)
+    shifts = [{"id": 1, "name": "Morning", "start_time": "07:00", "end_time": "16:00", "crosses_midnight": False},
+              {"id": 2, "name": "Night", "start_time": "23:00", "end_time": "07:00", "crosses_midnight": True}]
+    agents = [{"id": i, "name": f"A{i}", "channel_skill": "chat"} for i in (1, 2, 3)]
+    reqs = {1: {"chat_min": 3, "total": 3}, 2: {"chat_min": 1, "total": 1}}
+    sol = scheduler_engine.build_schedule(0, START, 7, agents, shifts, [], reqs, {}, mode=mode, solver_time_limit=60, num_workers=1,
+                                          stop_policy={"stop_when_covered": True})
+    m = sol["metrics"]
+    assert m["presolve"]["shortfall_lower_bound"] == 7
+    assert m["stop_reason"] == "covered"
+
+def test_default_stop_policy_keeps_fairness():
+    # a relative gap would let a solve with any shortfall stop before the
+    # night weights are optimised, so none is applied unless asked for
+    from ortools.sat.python import cp_model
+    from app import schemas
+    default = cp_model.CpSolver().parameters.relative_gap_limit
+    for policy in (scheduler_engine.DEFAULT_STOP_POLICY, schemas.StopPolicy().dict()):
+        solver = scheduler_engine._configure_solver(cp_model.CpModel(), 10, 1, policy)
+        assert solver.parameters.relative_gap_limit == default
+    solver = scheduler_engine._configure_solver(cp_model.CpModel(), 10, 1, {"relative_gap": 0.05})
+    assert solver.parameters.relative_gap_limit == 0.05
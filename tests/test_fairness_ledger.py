@@ -0,0 +1,75 @@
+from datetime import timedelta
+from app import crud, models, scheduler_engine, tasks
+from conftest import START, seed_project
+
+def row(agent_id, age, nights, weekends=0, shifts=5):
+    return {"agent_id": agent_id, "cycle_end": START - timedelta(days=age), "nights": nights, "weekends": weekends, "shifts": shifts}
+
+def test_fairness_metrics_decay():
+    history = [row(1, 1, 3), row(1, 14, 2), row(1, 15, 2), row(1, 28, 1, 2), row(1, 40, 4), row(1, 57, 9, 9, 9), row(2, 30, 1)]
+    m = scheduler_engine.fairness_metrics(history, START)
+    # 3 + 2 in full, 2 + 1 at half, 4 at a quarter, the 57-day cycle
+    # forgotten; 7.5 nights round up
+    assert m[1] == {"nights": 8, "weekends": 1, "shifts": 16}
+    assert m[2] == {"nights": 0, "weekends": 0, "shifts": 1}
+    assert scheduler_engine.fairness_metrics(history, START, ((7, 1.0),)) == {1: {"nights": 3, "weekends": 0, "shifts": 5}}
+
+def test_parse_fairness_decay():
+    assert scheduler_engine.parse_fairness_decay("") == scheduler_engine.FAIRNESS_DECAY
+    assert scheduler_engine.parse_fairness_decay("56:0.25,14:1") == ((14, 1.0), (56, 0.25))
+
+def persist(session, pid, f, start):
+    sol = scheduler_engine.build_schedule(pid, start, f["days"], f["agents"], f["shifts"], f["exceptions"], f["reqs"],
+                                          solver_time_limit=5, num_workers=1)
+    return crud.persist_schedule(session, pid, start, start + timedelta(days=f["days"] - 1), {"per_shift_requirements": f["reqs"]},
+                                 sol["assignments"])
+
+def ledger(session):
+    return sorted((r.schedule_id, r.agent_id, r.nights, r.weekends, r.shifts) for r in session.query(models.FairnessLedger))
+
+def test_ledger_feeds_next_cycle(session, fixture):
+    pid = seed_project(session, fixture)
+    first = persist(session, pid, fixture, START)
+    second = persist(session, pid, fixture, START + timedelta(days=7))
+    assert {r[0] for r in ledger(session)} == {first.id, second.id}
+    nights = {s["id"] for s in fixture["shifts"] if s["name"] == "Night"}
+    later = START + timedelta(days=28)
+    inp = tasks.load_solver_input(session, pid, later, 7, warm_start=False)
+    # both cycles are 15-22 days old: half weight
+    expect = {}
+    for sch in (first, second):
+        for a in session.query(models.ScheduleAssignment).filter_by(schedule_id=sch.id):
+            expect[a.agent_id] = expect.get(a.agent_id, 0) + 0.5 * (a.shift_id in nights)
+    assert {a: m["nights"] for a, m in inp["previous_metrics"].items() if m["nights"]} == {a: int(n + 0.5) for a, n in expect.items() if int(n + 0.5)}
+
+def test_backfill_is_not_done_by_validate(session, client, fixture):
+    pid = seed_project(session, fixture)
+    first = persist(session, pid, fixture, START)
+    second = persist(session, pid, fixture, START + timedelta(days=7))
+    recorded = ledger(session)
+    # schedules from before the ledger existed
+    session.query(models.FairnessLedger).delete()
+    session.commit()
+    r = client.get(f"/schedules/{second.id}/validate")
+    assert r.status_code == 200 and r.json()["valid"]
+    assert ledger(session) == []
+    tasks.backfill_ledger(session, pid, START + timedelta(days=14))
+    assert ledger(session) == recorded
+    # once is enough
+    assert not crud.backfill_fairness_ledger(session, pid, START + timedelta(days=14))
+
+def test_regeneration_is_not_undone_by_cache(session, fixture):
+    # R1, R2, R1 again for the same cycle: the third job must not be served
+    # schedule 1, which schedule 2 superseded in the ledger
+    pid = seed_project(session, fixture)
+    r1 = {str(k): v for k, v in fixture["reqs"].items()}
+    r2 = {k: dict(v, total=v["total"] + 1) for k, v in r1.items()}
+    opts = {"solver_time_limit": 5, "num_workers": 1, "warm_start": False}
+    first = tasks.generate_for_project(session, pid, START, 7, r1, opts, "a")
+    second = tasks.generate_for_project(session, pid, START, 7, r2, opts, "b")
+    third = tasks.generate_for_project(session, pid, START, 7, r1, opts, "c")
+    assert len({first["schedule_id"], second["schedule_id"], third["schedule_id"]}) == 3 and not third.get("cached")
+    assert {r[0] for r in ledger(session)} == {third["schedule_id"]}
+    # and the fresh schedule is what later repeats are served
+    again = tasks.generate_for_project(session, pid, START, 7, r1, opts, "d")
+    assert again["cached"] and again["schedule_id"] == third["schedule_id"]
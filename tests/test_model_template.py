@@ -0,0 +1,51 @@
+from datetime import timedelta
+import pytest
+from app import evaluator, model_template, scheduler_engine
+from conftest import START, make_fixture
+
+# A template instance must be the model _build_model would have built: same
+# optimum on the same input, whatever the job patches in.
+
+SOLVE = {"solver_time_limit": 20, "num_workers": 1, "stop_policy": {"relative_gap": 0, "adaptive_time": False}}
+
+def solve_both(monkeypatch, f, **kw):
+    out = []
+    for templates in (0, 4):
+        monkeypatch.setattr(model_template, "MODEL_TEMPLATES", templates)
+        sol = scheduler_engine.build_schedule(0, f["start"], f["days"], f["agents"], f["shifts"], f["exceptions"], f["reqs"],
+                                              f["prev"], **dict(SOLVE, **kw))
+        assert sol["metrics"]["status"] == "OPTIMAL"
+        out.append(sol)
+    return out
+
+@pytest.mark.parametrize("pattern,exceptions", [("3x9", 0.0), ("3x9", 0.2), ("2x12", 0.1)])
+def test_template_matches_build_model(monkeypatch, pattern, exceptions):
+    model_template.clear_templates()
+    f = make_fixture(agents=20, days=7, pattern=pattern, exceptions=exceptions, seed=3)
+    built, templ = solve_both(monkeypatch, f)
+    assert built["metrics"]["objective"] == templ["metrics"]["objective"]
+    assert templ["metrics"]["template"] == "miss"
+    ev = evaluator.evaluate(templ["assignments"], f["agents"], f["shifts"], f["exceptions"], f["reqs"], f["start"], f["days"], f["prev"])
+    assert ev["valid"] and ev["objective"] == templ["metrics"]["objective"]
+    # blocked variables stay in the template proto, fixed to 0
+    m = templ["metrics"]
+    assert m["live_vars"] + m["fixed_vars"] <= m["num_vars"]
+    assert built["metrics"]["live_vars"] == built["metrics"]["num_vars"]
+
+def test_template_hit_patches_job_data(monkeypatch):
+    # second job on the same roster: new exceptions, demand, history and a
+    # baseline, all patched into the cached template
+    model_template.clear_templates()
+    f = make_fixture(agents=20, days=7, exceptions=0.0, seed=4)
+    solve_both(monkeypatch, f)
+    day = START + timedelta(days=3)
+    night = next(s["id"] for s in f["shifts"] if s["name"] == "Night")
+    f2 = dict(f, exceptions=[{"agent_id": 1, "type": "fixed_off", "start_date": START, "end_date": day, "shift_id": None},
+                             {"agent_id": 2, "type": "fixed_shift", "start_date": day, "end_date": day, "shift_id": night}],
+              reqs={sid: dict(r, total=r["total"] + 1) for sid, r in f["reqs"].items()},
+              prev={a: {"nights": 4 - m["nights"]} for a, m in f["prev"].items()})
+    base = solve_both(monkeypatch, f)[0]["assignments"]
+    built, templ = solve_both(monkeypatch, f2, baseline_assignments=base, change_weight=3)
+    assert templ["metrics"]["template"] == "hit"
+    assert built["metrics"]["objective"] == templ["metrics"]["objective"]
+    assert built["metrics"]["changes"] == templ["metrics"]["changes"]
@@ -0,0 +1,49 @@
+from datetime import timedelta
+from app import crud, models, scheduler_engine
+from conftest import seed_project
+
+def schedule(session, f):
+    pid = seed_project(session, f)
+    sol = scheduler_engine.build_schedule(pid, f["start"], f["days"], f["agents"], f["shifts"], f["exceptions"], f["reqs"],
+                                          f["prev"], solver_time_limit=5, num_workers=1)
+    return pid, crud.persist_schedule(session, pid, f["start"], f["start"] + timedelta(days=f["days"] - 1), {"per_shift_requirements": f["reqs"]}, sol["assignments"])
+
+def test_removed_agent_leaves_roster_not_schedules(client, session, fixture):
+    pid, sch = schedule(session, fixture)
+    gone = session.query(models.ScheduleAssignment).filter_by(schedule_id=sch.id).first().agent_id
+    assert any(a["id"] == gone for a in client.get(f"/projects/{pid}/agents").json())
+    r = client.post(f"/schedules/{sch.id}/repair", json={"removed_agent_ids": [gone]})
+    assert r.status_code == 200
+    assert not any(a["id"] == gone for a in client.get(f"/projects/{pid}/agents").json())
+    repaired = session.query(models.Schedule).filter(models.Schedule.id != sch.id).one()
+    assert not session.query(models.ScheduleAssignment).filter_by(schedule_id=repaired.id, agent_id=gone).count()
+    # the old schedule still names the agent, and its lookup tables must too
+    col = client.get(f"/schedules/{sch.id}", params={"format": "columnar"}).json()
+    assert -1 not in col["columns"]["agent"]
+
+def test_repair_rejects_unknown_fixed_shift(client, session, fixture):
+    _, sch = schedule(session, fixture)
+    ex = {"agent_id": 1, "type": "fixed_shift", "start_date": fixture["start"].isoformat(), "end_date": fixture["start"].isoformat(), "shift_id": 999}
+    before = session.query(models.ExceptionRow).count()
+    r = client.post(f"/schedules/{sch.id}/repair", json={"exceptions": [ex]})
+    assert r.status_code == 400 and r.json()["detail"] == "fixed_shift exception for agent 1: unknown shift 999"
+    assert session.query(models.ExceptionRow).count() == before
+    assert client.post(f"/schedules/{sch.id}/repair", json={"removed_agent_ids": [999]}).status_code == 404
+
+def test_unpersisted_repair_leaves_roster_alone(client, session, fixture, monkeypatch):
+    pid, sch = schedule(session, fixture)
+    gone = session.query(models.ScheduleAssignment).filter_by(schedule_id=sch.id).first().agent_id
+    day = fixture["start"].isoformat()
+    delta = {"exceptions": [{"agent_id": 1, "type": "fixed_off", "start_date": day, "end_date": day, "shift_id": None}],
+             "removed_agent_ids": [gone]}
+    before = session.query(models.ExceptionRow).count()
+    roster = client.get(f"/projects/{pid}/agents").json()
+    infeasible = {"assignments": [], "metrics": {"status": "INFEASIBLE", "objective": None, "violations": {"rest": 1}}}
+    for outcome in (lambda **kw: infeasible, lambda **kw: 1 / 0):
+        monkeypatch.setattr(scheduler_engine, "repair_schedule", outcome)
+        assert client.post(f"/schedules/{sch.id}/repair", json=delta).status_code == 200
+        session.expire_all()
+        assert session.query(models.ExceptionRow).count() == before
+        assert session.get(models.Agent, gone).is_active
+        assert session.query(models.Schedule).count() == 1
+        assert client.get(f"/projects/{pid}/agents").json() == roster
@@ -0,0 +1,69 @@
+import threading
+from datetime import timedelta
+from app import models, tasks
+from conftest import make_fixture, seed_project
+
+# Identical jobs share one solve and one schedule row; anything that changes
+# the input gets its own.
+
+OPTS = {"solver_time_limit": 5, "num_workers": 1, "warm_start": False}
+
+def generate(session, pid, f, owner="job", **opts):
+    return tasks.generate_for_project(session, pid, f["start"], f["days"], {str(k): v for k, v in f["reqs"].items()},
+                                      dict(OPTS, **opts), owner)
+
+def test_repeat_job_is_served_from_cache(session, fixture):
+    pid = seed_project(session, fixture)
+    first = generate(session, pid, fixture)
+    assert first["status"] == "OPTIMAL" and not first.get("cached")
+    again = generate(session, pid, fixture, owner="job2")
+    assert again["cached"] and again["schedule_id"] == first["schedule_id"]
+    assert session.query(models.Schedule).count() == 1
+    other = generate(session, pid, fixture, mode="heuristic")
+    assert other["schedule_id"] != first["schedule_id"]
+    assert session.query(models.Schedule).count() == 2
+
+def test_deleted_schedule_is_not_served(session, fixture):
+    pid = seed_project(session, fixture)
+    first = generate(session, pid, fixture)
+    session.delete(session.get(models.Schedule, first["schedule_id"]))
+    session.commit()
+    again = generate(session, pid, fixture)
+    assert not again.get("cached") and again["status"] == "OPTIMAL"
+    assert session.get(models.Schedule, again["schedule_id"]) is not None
+
+def test_concurrent_job_waits_for_the_owner(session):
+    key = "k"
+    assert tasks.solve_cache.acquire(key, "a", 60)
+    assert not tasks.solve_cache.acquire(key, "b", 60)
+    tasks.solve_cache.release(key, "b")  # not the owner: no effect
+    assert tasks.solve_cache.in_flight(key)
+    threading.Timer(0.2, lambda: (tasks.solve_cache.set(key, {"schedule_id": 1}), tasks.solve_cache.release(key, "a"))).start()
+    assert tasks.solve_cache.wait(key, timeout=5, poll=0.05) == {"schedule_id": 1}
+    assert not tasks.solve_cache.in_flight(key)
+
+def test_job_behind_identical_one_is_deduplicated(session, fixture, monkeypatch):
+    pid = seed_project(session, fixture)
+    first = generate(session, pid, fixture)
+    # replay the race: the job misses the cache, finds the key taken, and
+    # the owner's result lands while it waits
+    get, calls = tasks.solve_cache.get, []
+    monkeypatch.setattr(tasks.solve_cache, "get", lambda key: get(key) if calls.append(key) or len(calls) > 1 else None)
+    monkeypatch.setattr(tasks.solve_cache, "acquire", lambda *a: False)
+    again = generate(session, pid, fixture, owner="job2")
+    assert again["deduplicated"] and again["schedule_id"] == first["schedule_id"]
+    assert session.query(models.Schedule).count() == 1
+
+def test_broken_draft_is_not_kept(session):
+    # night then the next morning for the same agent: the heuristic draft
+    # keeps the clash, which the evaluator flags
+    f = make_fixture(agents=3, days=3, exceptions=0)
+    shift = {s["name"]: s["id"] for s in f["shifts"]}
+    day = f["start"] + timedelta(days=1)
+    f["exceptions"] = [{"agent_id": 1, "type": "fixed_shift", "start_date": f["start"], "end_date": f["start"], "shift_id": shift["Night"]},
+                       {"agent_id": 1, "type": "fixed_shift", "start_date": day, "end_date": day, "shift_id": shift["Morning"]}]
+    pid = seed_project(session, f)
+    res = generate(session, pid, f, mode="heuristic")
+    assert res["status"] == "no_solution" and res["violations"] and "schedule_id" not in res
+    assert session.query(models.Schedule).count() == 0
+    assert not tasks.solve_cache.local._data